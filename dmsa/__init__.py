@@ -1,5 +1,7 @@
 import os
 from dmsa.makers import make_model_from_service  # noqa
+from dmsa.makers import amake_model_from_service  # noqa
+from dmsa.registry import get_metadata  # noqa
 
 serial = os.environ.get('BUILD_NUM') or '0'
 sha = os.environ.get('COMMIT_SHA1') or '0'
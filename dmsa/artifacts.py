@@ -0,0 +1,217 @@
+""" A content-addressed cache of generated artifacts (DDL scripts, e.g.)
+
+Artifacts are keyed by a hash of everything that determines their content:
+the model, model version, dialect, operation, elements, data models service
+version and dmsa version. Because the key changes whenever any of those
+inputs change, entries never need to be invalidated, only evicted.
+
+Artifacts are held in a size-bounded in-memory LRU cache and, if the disk
+cache is enabled, also stored in the 'artifacts' namespace of the on-disk
+cache (see dmsa.cache) so that they survive restarts and are shared among
+processes. The oldest artifacts on disk are removed once they take up more
+than MAX_DISK_SIZE. Rather than measuring the artifacts on disk on every
+write, each process adds the artifacts it writes to the size last measured,
+and only measures (and prunes) again once that estimate passes the maximum,
+or after PRUNE_INTERVAL writes to account for other processes' writes.
+
+Compressed forms of artifacts (for HTTP content encoding) are computed once,
+on first use, and cached beside them under the artifact key and encoding.
+"""
+import gzip
+import hashlib
+import io
+import threading
+from dmsa import __version__
+from dmsa.cache import (LRUCache, get_entry, set_entry, has_entry,
+                        prune_namespace)
+
+MAX_MEMORY_SIZE = 64 * 1024 * 1024  # characters
+MAX_DISK_SIZE = 1024 * 1024 * 1024  # bytes
+PRUNE_INTERVAL = 100  # writes
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+__DISK = False
+__MAX_DISK_SIZE = MAX_DISK_SIZE
+__DISK_SIZE = None  # estimated; None until measured
+__DISK_WRITES = 0  # since last measured
+__MEMORY = LRUCache(MAX_MEMORY_SIZE, sizeof=len)
+__STATS_LOCK = threading.Lock()
+__STATS = {'disk_hits': 0, 'disk_misses': 0, 'disk_evictions': 0}
+
+
+def set_disk_cache(enabled):
+    """Enable or disable storing artifacts in the on-disk cache
+
+    If never enabled, artifacts are only cached in memory.
+    """
+    global __DISK
+    __DISK = enabled
+
+
+def set_max_memory_size(max_size):
+    """Set the maximum total size (in characters) of in-memory artifacts"""
+    global __MEMORY
+    __MEMORY = LRUCache(max_size, sizeof=len)
+
+
+def set_max_disk_size(max_size):
+    """Set the maximum total size (in bytes) of artifacts on disk"""
+    global __MAX_DISK_SIZE
+    __MAX_DISK_SIZE = max_size
+
+
+def artifact_key(model, model_version, dialect, operation, elements,
+                 service_version):
+    """Return the cache key for an artifact generated from these inputs
+
+    The dmsa version is always included in the key.
+    """
+    parts = [model, model_version, dialect, operation, elements,
+             service_version, __version__]
+    digest = hashlib.sha1(u'\0'.join(parts).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _count(stat):
+    with __STATS_LOCK:
+        __STATS[stat] += 1
+
+
+def _should_prune(size):
+    """Add an artifact of `size` to the estimated size of the artifacts on
+    disk, and return whether they should be measured and pruned"""
+    global __DISK_SIZE, __DISK_WRITES
+
+    with __STATS_LOCK:
+        __DISK_WRITES += 1
+        if __DISK_SIZE is None or __DISK_WRITES >= PRUNE_INTERVAL:
+            return True
+        __DISK_SIZE += size
+        return __DISK_SIZE > __MAX_DISK_SIZE
+
+
+def _prune():
+    global __DISK_SIZE, __DISK_WRITES
+
+    removed, size = prune_namespace('artifacts', __MAX_DISK_SIZE)
+
+    with __STATS_LOCK:
+        __STATS['disk_evictions'] += removed
+        __DISK_SIZE = size
+        __DISK_WRITES = 0
+
+
+def get_artifact(key):
+    """Return the artifact cached under `key`, or None if not cached
+
+    The in-memory cache is checked first, then the disk cache.
+    """
+    artifact = __MEMORY.get(key)
+    if artifact is not None or not __DISK:
+        return artifact
+
+    artifact = get_entry('artifacts', key)
+    if artifact is None:
+        _count('disk_misses')
+        return None
+
+    _count('disk_hits')
+    __MEMORY.set(key, artifact)
+    return artifact
+
+
+def has_artifact(key):
+    """Return whether an artifact is cached under `key`, without reading it
+    from disk"""
+    return key in __MEMORY or (__DISK and has_entry('artifacts', key))
+
+
+def set_artifact(key, artifact):
+    """Cache the artifact (a string) under `key`"""
+    __MEMORY.set(key, artifact)
+    if __DISK:
+        try:
+            set_entry('artifacts', key, artifact)
+        except (IOError, OSError):
+            pass  # Already logged; the artifact is still cached in memory.
+        if _should_prune(len(artifact)):
+            _prune()
+
+
+def _brotli():
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+
+def encodings():
+    """Return the content encodings artifacts can be compressed with, best
+    first ('br' only if the brotli module is installed)"""
+    if _brotli():
+        return ['br', 'gzip']
+    return ['gzip']
+
+
+def compress(data, encoding):
+    """Return the data (a byte string) compressed with the content encoding,
+    'gzip' or 'br'
+
+    gzip output does not embed a timestamp, so the same data always
+    compresses to the same bytes.
+    """
+    if encoding == 'gzip':
+        buf = io.BytesIO()
+        with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=GZIP_LEVEL,
+                           mtime=0) as f:
+            f.write(data)
+        return buf.getvalue()
+
+    if encoding == 'br' and _brotli():
+        return _brotli().compress(data, quality=BROTLI_QUALITY)
+
+    raise ValueError('unsupported encoding: {0}'.format(encoding))
+
+
+def get_encoded_artifact(key, encoding):
+    """Return the artifact cached under `key` compressed with the content
+    encoding, or None if the artifact is not cached
+
+    The compressed form is cached too, so it is only computed once.
+    """
+    encoded_key = key + '.' + encoding
+
+    data = get_artifact(encoded_key)
+    if data is not None:
+        return data
+
+    artifact = get_artifact(key)
+    if artifact is None:
+        return None
+
+    if isinstance(artifact, unicode):
+        artifact = artifact.encode('utf-8')
+
+    data = compress(artifact, encoding)
+    set_artifact(encoded_key, data)
+    return data
+
+
+def clear_artifacts():
+    """Remove all in-memory artifacts (the disk cache is left alone)"""
+    __MEMORY.clear()
+
+
+def stats():
+    """Return a dict of artifact cache statistics
+
+    `memory` holds the in-memory LRU statistics; `disk_hits` and `disk_misses`
+    count lookups that missed memory and went to the disk cache, and
+    `disk_evictions` counts artifacts removed from disk to stay within the
+    maximum size.
+    """
+    with __STATS_LOCK:
+        disk_stats = dict(__STATS)
+    return dict(disk_stats, memory=__MEMORY.stats())
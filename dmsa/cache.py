@@ -1,17 +1,49 @@
-""" A simple module for caching a single object on disk"""
+""" A keyed, multi-process safe on-disk cache
+
+Entries are pickled objects stored under a namespace and key, one file per
+entry. Each file starts with a header holding the format version, the key,
+and the entry's creation and expiry times. Entries are written to a
+temporary file that is then renamed into place, so readers in any process
+always see a complete entry (either the old or the new one) without taking
+a lock, and concurrent writers never lose updates to a lock they could not
+get: the last write wins.
+
+`get_cache` and `set_cache` store the single object used by the web service
+(the data models catalog) as one such entry. Entries read with `memoize=True`
+(as the catalog is) are also held decoded in memory and only re-read when the
+file is replaced, so that repeated lookups skip the file open and unpickle.
+
+Also provides `LRUCache`, a size-bounded in-memory cache.
+"""
 import cPickle as pickle
 import errno
+import hashlib
 import logging
 import os
-import simpleflock
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+FORMAT_VERSION = 1
+MEMO_CHECK_INTERVAL = 1  # seconds
 
-__LOCK_FILE = 'dmsa.cache.lockfile'
-__CACHE_FILE = 'dmsa.cache'
 __DIR = None
+__STATS_LOCK = threading.Lock()
+__STATS = {'hits': 0, 'misses': 0, 'stale': 0, 'memo_hits': 0}
+
+# Decoded memoized entries: pathname -> (signature, generation, checked,
+# header, object). The generation is bumped whenever this process writes or
+# deletes an entry; the file signature (inode, mtime and size) catches
+# writes by other processes, and is checked at most every
+# MEMO_CHECK_INTERVAL seconds.
+__MEMO = {}
+__MEMO_LOCK = threading.Lock()
+__GENERATION = 0
 
 
 def set_cache_dir(cache_dir):
-    """Set the directory to use for holding cache and lock files
+    """Set the directory to use for holding cache files
 
     If the directory is never set, the current directory is used (see below).
     """
@@ -40,28 +72,272 @@ def _pathname(name):
     return os.path.join(__DIR, name)
 
 
-def _pickle_and_cache_models(obj):
-    pathname = _pathname(__CACHE_FILE)
+def cache_pathname(name):
+    """Return the pathname of `name` within the cache directory
+
+    Any directories in `name` are created as necessary.
+    """
+    pathname = _pathname(name)
+    dirname = os.path.dirname(pathname)
+
+    if dirname:
+        try:
+            os.makedirs(dirname)
+        except OSError:
+            pass
+
+    return pathname
+
+
+def _entry_pathname(namespace, key):
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    return cache_pathname(os.path.join(namespace, digest + '.pickle'))
+
+
+def _count(stat):
+    with __STATS_LOCK:
+        __STATS[stat] += 1
+
+
+def _bump_generation():
+    global __GENERATION
+    with __MEMO_LOCK:
+        __GENERATION += 1
+
+
+def _signature(st):
+    return (st.st_ino, st.st_mtime, st.st_size)
+
+
+def set_entry(namespace, key, obj, ttl=None):
+    """Store an object in the cache under the namespace and key
+
+    Arguments:
+        namespace - name of the group of entries (also a subdirectory name)
+        key - string identifying the entry within the namespace
+        obj - picklable object to store
+        ttl - seconds after which the entry is stale, or None to never expire
+    """
+    pathname = _entry_pathname(namespace, key)
+    now = time.time()
+    header = {
+        'format': FORMAT_VERSION,
+        'key': key,
+        'created': now,
+        'expires': now + ttl if ttl is not None else None
+    }
+
     try:
-        with open(pathname, mode='w') as f:
-            pickle.dump(obj, f)
+        fd, tmp_pathname = tempfile.mkstemp(dir=os.path.dirname(pathname),
+                                            prefix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(header, f, pickle.HIGHEST_PROTOCOL)
+                pickle.dump(obj, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp_pathname, pathname)
+        except BaseException:
+            os.remove(tmp_pathname)
+            raise
+        finally:
+            _bump_generation()
     except pickle.PicklingError as e:
         logging.error('pickling object: {}'.format(e))
         raise
+    except (IOError, OSError) as e:
+        logging.error('writing {}: {}'.format(pathname, e))
+        raise
+
+
+def _read_entry(pathname, key):
+    """Read and check the entry file
+
+    Return: (signature, header, object), or None if there is no usable entry
+    """
+    try:
+        with open(pathname, mode='rb') as f:
+            signature = _signature(os.fstat(f.fileno()))
+            try:
+                header = pickle.load(f)
+                if (not isinstance(header, dict) or
+                        header.get('format') != FORMAT_VERSION or
+                        header.get('key') != key):
+                    return None
+                obj = pickle.load(f)
+            except Exception as e:
+                # Truncated or corrupt files can fail in many ways.
+                logging.error('unpickling {}: {}'.format(pathname, e))
+                return None
     except IOError as e:
-        logging.error('opening {} for writing: {}'.format(pathname, e))
+        if e.errno == errno.ENOENT:
+            return None
+        logging.error('opening {} for reading: {}'.format(pathname, e))
         raise
 
+    return signature, header, obj
+
+
+def _memoized_entry(pathname, key):
+    """Return the (header, object) of the entry, from memory if the file has
+    not been replaced since it was last read, or None"""
+    now = time.time()
+
+    with __MEMO_LOCK:
+        generation = __GENERATION
+        memo = __MEMO.get(pathname)
+
+    if memo:
+        signature, memo_generation, checked, header, obj = memo
+
+        if (memo_generation == generation and
+                now - checked < MEMO_CHECK_INTERVAL):
+            _count('memo_hits')
+            return header, obj
+
+        try:
+            current = _signature(os.stat(pathname))
+        except OSError:
+            current = None
+
+        if current == signature:
+            with __MEMO_LOCK:
+                __MEMO[pathname] = (signature, generation, now, header, obj)
+            _count('memo_hits')
+            return header, obj
+
+    entry = _read_entry(pathname, key)
+
+    with __MEMO_LOCK:
+        if entry is None:
+            __MEMO.pop(pathname, None)
+            return None
+        signature, header, obj = entry
+        __MEMO[pathname] = (signature, generation, now, header, obj)
+
+    return header, obj
+
+
+def get_entry(namespace, key, default=None, allow_stale=False,
+              memoize=False):
+    """Fetch the object stored under the namespace and key
+
+    Entries written with a different format version are treated as missing.
+
+    Arguments:
+        default - returned if there is no usable entry
+        allow_stale - return the entry even if its ttl has passed
+        memoize - keep the decoded object in memory and return it again
+            until the entry is replaced (callers must not modify it)
+
+    Return: the stored object, or `default`
+    """
+    pathname = _entry_pathname(namespace, key)
+
+    if memoize:
+        entry = _memoized_entry(pathname, key)
+    else:
+        entry = _read_entry(pathname, key)
+        if entry is not None:
+            entry = entry[1:]
+
+    if entry is None:
+        _count('misses')
+        return default
+
+    header, obj = entry
+
+    if header['expires'] is not None and header['expires'] < time.time():
+        _count('stale')
+        if not allow_stale:
+            return default
+
+    _count('hits')
+    return obj
+
+
+def has_entry(namespace, key):
+    """Return whether an entry file exists under the namespace and key
+
+    The entry is not read, so it may still turn out to be stale or unusable.
+    """
+    return os.path.exists(_entry_pathname(namespace, key))
+
+
+def delete_entry(namespace, key):
+    """Remove the entry stored under the namespace and key, if any"""
+    try:
+        os.remove(_entry_pathname(namespace, key))
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+    finally:
+        _bump_generation()
+
+
+def prune_namespace(namespace, max_size):
+    """Remove the oldest entries of the namespace until its entry files take
+    up at most max_size bytes
+
+    Entries are removed in the order they were written, so that an entry
+    rewritten by any process counts as new.
+
+    Return: (the number of entries removed, the size in bytes of the
+        remaining entry files)
+    """
+    dirname = _pathname(namespace)
+
+    try:
+        names = os.listdir(dirname)
+    except OSError:
+        return 0, 0
+
+    entries = []
+    total = 0
+
+    for name in names:
+        if not name.endswith('.pickle'):
+            continue
+        try:
+            st = os.stat(os.path.join(dirname, name))
+        except OSError:
+            continue  # Removed by another process.
+        entries.append((st.st_mtime, st.st_size, name))
+        total += st.st_size
+
+    removed = 0
+
+    for mtime, size, name in sorted(entries):
+        if total <= max_size:
+            break
+        try:
+            os.remove(os.path.join(dirname, name))
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                logging.error('removing {}: {}'.format(name, e))
+                continue
+        total -= size
+        removed += 1
+
+    if removed:
+        _bump_generation()
+
+    return removed, total
+
+
+def stats():
+    """Return a dict of disk cache hit, miss and stale counts
+
+    Stale lookups are counted whether or not the stale entry was returned.
+    `memo_hits` counts the hits served from memory without reading the file.
+    """
+    with __STATS_LOCK:
+        return dict(__STATS)
+
 
 def set_cache(obj):
     """Update the cache with an object (dict, e.g.)
 
-    The object is cached on disk. A lock file is used to coordinate
-    updates to this cache among threads and processes.
-
-    If another process has the cache locked (only used for writing),
-    then this function does nothing; i.e. it assumes that somebody
-    else is taking care of the update ....
+    The object is cached on disk, replacing the previously cached object
+    atomically.
 
     Arguments:
         obj - object to write to the cache
@@ -69,33 +345,108 @@ def set_cache(obj):
     Return:
         none
     """
-    lock_path = _pathname(__LOCK_FILE)
-    try:
-        with simpleflock.SimpleFlock(lock_path, timeout=0):
-            _pickle_and_cache_models(obj)
-    except IOError as e:
-        if e.errno != errno.EWOULDBLOCK:
-            logging.error('creating lock file {}: {}'.format(lock_path, e))
-            raise
+    set_entry('dmsa', 'cache', obj)
 
 
 def get_cache():
     """Fetch the object from disk cache
 
+    The object is memoized, so it must not be modified.
+
     Return: cached object as written by set_cache, or None if no cache file
     """
-    pathname = _pathname(__CACHE_FILE)
-    try:
-        with open(pathname, mode='r') as f:
+    return get_entry('dmsa', 'cache', memoize=True)
+
+
+class LRUCache(object):
+    """A thread-safe, size-bounded, least-recently-used in-memory cache
+
+    Arguments:
+        max_size - maximum total size of the cached values
+        sizeof - function returning the size of a value (default: every
+            value has a size of 1, so `max_size` is an entry count)
+    """
+
+    def __init__(self, max_size, sizeof=None):
+        self.max_size = max_size
+        self.sizeof = sizeof or (lambda value: 1)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Return the value cached under `key` (or `default`) and mark it as
+        most recently used"""
+        with self._lock:
             try:
-                obj = pickle.load(f)
-            except pickle.UnpicklingError as e:
-                logging.error('unpickling object: {}'.format(e))
-                raise
-    except IOError as e:
-        if e.errno == errno.ENOENT:
-            return None
-        logging.error('opening {} for reading: {}'.format(pathname, e))
-        raise
+                value, size = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._entries[key] = (value, size)
+            self.hits += 1
+            return value
 
-    return obj
+    def set(self, key, value):
+        """Cache `value` under `key`, evicting least recently used entries
+        as needed to stay within `max_size`
+
+        A value larger than `max_size` on its own is not cached.
+        """
+        size = self.sizeof(value)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            if size > self.max_size:
+                return
+            self._entries[key] = (value, size)
+            self.size += size
+            while self.size > self.max_size:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.size -= evicted_size
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        """Remove and return the value cached under `key` (or `default`)"""
+        with self._lock:
+            try:
+                value, size = self._entries.pop(key)
+            except KeyError:
+                return default
+            self.size -= size
+            return value
+
+    def clear(self):
+        """Remove all entries (statistics are kept)"""
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def keys(self):
+        """Return a list of the cached keys, least recently used first"""
+        with self._lock:
+            return list(self._entries.keys())
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def stats(self):
+        """Return a dict of hit/miss/eviction counts and current usage"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'size': self.size,
+                'max_size': self.max_size
+            }
@@ -1,87 +1,231 @@
-from sqlalchemy import (create_engine, MetaData, Table, Column,
-                        Integer, Numeric, String, Date, DateTime, text)
-from sqlalchemy.ext.compiler import compiles
+import copy
+import itertools
+import os
+import threading
+import time
+from sqlalchemy import (MetaData, Table, Column, Integer, Numeric, String,
+                        Date, DateTime, text)
+from sqlalchemy.dialects import registry as dialect_registry
+from sqlalchemy.sql.ddl import _CreateDropBase
 from sqlalchemy.schema import (CreateTable, AddConstraint, CreateIndex,
                                DropTable, DropConstraint, DropIndex,
                                ForeignKeyConstraint, CheckConstraint,
                                UniqueConstraint, PrimaryKeyConstraint)
 from dmsa import __version__
-from dmsa.utility import get_model_json, get_service_version
-from dmsa.makers import make_model
+from dmsa.utility import get_service_version, PRETTY_DIALECTS
+from dmsa.registry import get_metadata
+from dmsa.metrics import Histogram
+from dmsa.phases import phase
+
+COMPILE_SECONDS = Histogram('dmsa_ddl_compile_seconds',
+                            'Time spent compiling DDL scripts, excluding '
+                            'building the model.',
+                            labels=('dialect',))
+
+__DIALECTS = {}
+__DIALECTS_LOCK = threading.Lock()
+__VERSION_TABLE_DDL = {}
+__REGISTERED_HOOKS = set()
+
+# The compilation tweaks below are registered (see COMPILE_HOOKS) the first
+# time their dialect is used. They must not modify the types and constraints
+# they are handed, because model MetaData is shared among requests and
+# dialects (see dmsa.registry).
 
 
 # Coerce Numeric type to produce NUMBER on Oracle backend.
-@compiles(Numeric, 'oracle')
 def _compile_numeric_oracle(type_, compiler, **kw):
     return 'NUMBER'
 
 
 # Coerce Integer type to produce NUMBER(10) on Oracle backend.
-@compiles(Integer, 'oracle')
 def _compile_integer_oracle(type_, compiler, **kw):
     return 'NUMBER(10)'
 
 
 # Coerce DateTime type to produce TIMESTAMP on Oracle backend.
-@compiles(DateTime, 'oracle')
 def _compile_datetime_oracle(type_, compiler, **kw):
     return compiler.visit_TIMESTAMP(type_, **kw)
 
 
 # Coerce String type without length to produce VARCHAR2(255) on Oracle.
-@compiles(String, 'oracle')
 def _compile_string_oracle(type_, compiler, **kw):
 
     if not type_.length:
+        type_ = copy.copy(type_)
         type_.length = 255
     visit_attr = 'visit_{0}'.format(type_.__visit_name__)
     return getattr(compiler, visit_attr)(type_, **kw)
 
 
 # Coerce String type without length to produce VARCHAR(255) on MySQL.
-@compiles(String, 'mysql')
 def _compile_string_mysql(type_, compiler, **kw):
 
     if not type_.length:
+        type_ = copy.copy(type_)
         type_.length = 255
     visit_attr = 'visit_{0}'.format(type_.__visit_name__)
     return getattr(compiler, visit_attr)(type_, **kw)
 
 
 # Coerce DateTime type to produce DATETIME2 on MSSQL backend.
-@compiles(DateTime, 'mssql')
 def _compile_datetime_mssql(type_, compiler, **kw):
     return compiler.visit_DATETIME2(type_, **kw)
 
 
 # Coerce Date type to produce DATETIME2 on MSSQL backend.
-@compiles(Date, 'mssql')
-def _compile_datetime_mssql(type_, compiler, **kw):
+def _compile_date_mssql(type_, compiler, **kw):
     return compiler.visit_DATETIME2(type_, **kw)
 
 
+def _compile_deferred_constraint(constraint, compiler, **kw):
+
+    # Deferrability is rendered last, so it can be appended to the regular
+    # constraint DDL.
+    visit_attr = 'visit_{0}'.format(constraint.__visit_name__)
+    ddl = getattr(compiler, visit_attr)(constraint, **kw)
+    if constraint.deferrable is None and constraint.initially is None:
+        ddl += ' DEFERRABLE INITIALLY DEFERRED'
+    return ddl
+
+
 # Add DEFERRABLE INITIALLY DEFERRED to Oracle constraints.
-@compiles(ForeignKeyConstraint, 'oracle')
-@compiles(UniqueConstraint, 'oracle')
-@compiles(CheckConstraint, 'oracle')
 def _compile_constraint_oracle(constraint, compiler, **kw):
 
-    constraint.deferrable = True
-    constraint.initially = 'DEFERRED'
-    visit_attr = 'visit_{0}'.format(constraint.__visit_name__)
-    return getattr(compiler, visit_attr)(constraint, **kw)
+    return _compile_deferred_constraint(constraint, compiler, **kw)
 
 
 # Add DEFERRABLE INITIALLY DEFERRED to PostgreSQL constraints.
-@compiles(ForeignKeyConstraint, 'postgresql')
-@compiles(UniqueConstraint, 'postgresql')
-@compiles(CheckConstraint, 'postgresql')
 def _compile_constraint_postgresql(constraint, compiler, **kw):
 
-    constraint.deferrable = True
-    constraint.initially = 'DEFERRED'
-    visit_attr = 'visit_{0}'.format(constraint.__visit_name__)
-    return getattr(compiler, visit_attr)(constraint, **kw)
+    return _compile_deferred_constraint(constraint, compiler, **kw)
+
+
+COMPILE_HOOKS = {
+    'oracle': [(Numeric, _compile_numeric_oracle),
+               (Integer, _compile_integer_oracle),
+               (DateTime, _compile_datetime_oracle),
+               (String, _compile_string_oracle),
+               (ForeignKeyConstraint, _compile_constraint_oracle),
+               (UniqueConstraint, _compile_constraint_oracle),
+               (CheckConstraint, _compile_constraint_oracle)],
+    'postgresql': [(ForeignKeyConstraint, _compile_constraint_postgresql),
+                   (UniqueConstraint, _compile_constraint_postgresql),
+                   (CheckConstraint, _compile_constraint_postgresql)],
+    'mysql': [(String, _compile_string_mysql)],
+    'mssql': [(DateTime, _compile_datetime_mssql),
+              (Date, _compile_date_mssql)]
+}
+
+
+class _AddConstraint(AddConstraint):
+    """AddConstraint that leaves the constraint's create rule alone
+
+    SQLAlchemy's AddConstraint (and DropConstraint) disable the constraint's
+    inline rendering in any later CREATE TABLE, which would make the output
+    for a shared model depend on what was generated from it before.
+    """
+
+    def __init__(self, element, *args, **kw):
+        _CreateDropBase.__init__(self, element, *args, **kw)
+
+
+class _DropConstraint(DropConstraint):
+    """DropConstraint that leaves the constraint's create rule alone"""
+
+    def __init__(self, element, cascade=False, **kw):
+        self.cascade = cascade
+        _CreateDropBase.__init__(self, element, **kw)
+
+
+def get_dialect(dialect):
+    """Return the shared SQLAlchemy dialect object for a dialect name
+
+    Compiling DDL only needs the dialect, not an engine, so its DBAPI driver
+    does not have to be installed. Dialect objects are not modified by
+    compilation and are shared among threads.
+    """
+    with __DIALECTS_LOCK:
+        if dialect not in __DIALECTS:
+            sql_dialect = dialect_registry.load(dialect.replace('+', '.'))()
+            _register_compile_hooks(sql_dialect.name)
+            __DIALECTS[dialect] = sql_dialect
+        return __DIALECTS[dialect]
+
+
+def _register_compile_hooks(name):
+    """Register the compilation tweaks for the dialect, if not already
+    registered"""
+    from sqlalchemy.ext.compiler import compiles
+
+    if name in __REGISTERED_HOOKS:
+        return
+    for element, hook in COMPILE_HOOKS.get(name, []):
+        compiles(element, name)(hook)
+    __REGISTERED_HOOKS.add(name)
+
+
+def _section(metadata, sorted_tables, sql_dialect, kind, drop=False):
+    """Yield one section of a DDL script for the model: the statements
+    creating (or dropping) all its tables, constraints or indexes, or
+    deleting all its data, in order
+
+    Every script is composed of these sections plus per-script headers, so
+    each section is compiled once per dialect, the first time a script
+    needs it, and reused by every element selection and operation. The
+    first time, statements are yielded as they are compiled, so streamed
+    scripts start without waiting for the whole section; the joined section
+    is kept once all of it has been compiled. Sections are kept in
+    `metadata.info`, so they are dropped along with the shared model (see
+    dmsa.registry).
+    """
+    sections = metadata.info.setdefault('dmsa_sections', {})
+    key = (kind, sql_dialect, drop)
+
+    section = sections.get(key)
+    if section is not None:
+        yield section
+        return
+
+    # Objects are dropped, and data deleted, in the reverse of the order
+    # they are created in.
+    tables = list(reversed(sorted_tables)) if drop or kind == 'delete' \
+        else sorted_tables
+
+    if kind == 'tables':
+        statements = table_ddl(tables, sql_dialect, drop)
+    elif kind == 'constraints':
+        statements = constraint_ddl(tables, sql_dialect, drop)
+    elif kind == 'indexes':
+        statements = index_ddl(tables, sql_dialect, drop)
+    else:
+        statements = delete_ddl(tables, sql_dialect)
+
+    compiled = []
+    for statement in statements:
+        compiled.append(statement)
+        yield statement
+
+    sections[key] = ''.join(compiled)
+
+
+OPERATIONS = ['ddl', 'drop', 'delete', 'logging', 'nologging']
+ELEMENTS = ['tables', 'constraints', 'indexes', 'all']
+
+
+def operation_kwargs(operation, elements='all'):
+    """Return the `generate` keyword arguments for a web service operation
+    ('ddl', 'drop', 'delete', 'logging' or 'nologging') and elements
+    ('tables', 'constraints', 'indexes' or 'all')."""
+    return {
+        'tables': elements in ['tables', 'all'],
+        'constraints': elements in ['constraints', 'all'],
+        'indexes': elements in ['indexes', 'all'],
+        'drop': operation == 'drop',
+        'delete_data': operation == 'delete',
+        'logging': operation == 'logging',
+        'nologging': operation == 'nologging'
+    }
 
 
 def generate(model, model_version, dialect, tables=True, constraints=True,
@@ -105,15 +249,33 @@ def generate(model, model_version, dialect, tables=True, constraints=True,
       service        Base URL of the data models service to use.
     """  # noqa
 
-    metadata = MetaData()
-    model_json = get_model_json(model, model_version, service)
-    make_model(model_json, metadata)
+    return ''.join(iter_generate(model, model_version, dialect, tables,
+                                 constraints, indexes, drop, delete_data,
+                                 nologging, logging, service))
+
+
+def iter_generate(model, model_version, dialect, tables=True,
+                  constraints=True, indexes=True, drop=False,
+                  delete_data=False, nologging=False, logging=False,
+                  service='https://data-models-service.research.chop.edu/'):
+    """Generate data definition language like `generate`, but return an
+    iterator over the pieces of the script, in order, instead of a string.
+
+    The model is built (and any errors raised) before this returns, along
+    with the first section of the script and the statements dropping
+    constraints; the other statements are compiled as the iterator is
+    consumed.
+
+    Arguments are the same as for `generate`.
+    """  # noqa
+
+    metadata = get_metadata(model, model_version, service)
 
     service_version = get_service_version(service)
 
-    engine = create_engine(dialect + '://')
+    start = time.time()
 
-    output = []
+    sql_dialect = get_dialect(dialect)
 
     INSERT = ("INSERT INTO version_history (operation, model, model_version, "
               "dms_version, dmsa_version) VALUES ('{operation}', '" +
@@ -123,6 +285,54 @@ def generate(model, model_version, dialect, tables=True, constraints=True,
     if dialect.startswith('oracle'):
         INSERT = INSERT + "COMMIT;\n\n"
 
+    version_tbl_ddl = _version_table_ddl(dialect, sql_dialect)
+
+    with phase('sorted_tables'):
+        sorted_tables = metadata.sorted_tables
+
+    def section(kind, drop=False):
+        return _section(metadata, sorted_tables, sql_dialect, kind, drop)
+
+    def script(section):
+        if delete_data:
+            return _iter_delete(section, INSERT)
+        elif drop:
+            return _iter_drop(section, dialect, INSERT, tables, constraints,
+                              indexes)
+        else:
+            return _iter_create(sorted_tables, section, dialect, INSERT,
+                                tables, constraints, indexes, nologging,
+                                logging)
+
+    # Compile the script's first section, and any dropped constraints (which
+    # cannot be compiled if unnamed), before anything is produced, so that
+    # callers streaming the script can still report the error.
+    needed = []
+
+    def need(kind, drop=False):
+        needed.append((kind, drop))
+        return []
+
+    for statement in script(need):
+        pass
+
+    for kind, drop_section in needed[:1] + [k for k in needed[1:]
+                                            if k == ('constraints', True)]:
+        for statement in section(kind, drop_section):
+            pass
+
+    statements = script(section)
+
+    return _timed(itertools.chain([version_tbl_ddl + '\n\n'], statements),
+                  dialect, time.time() - start)
+
+
+def _version_table_ddl(dialect, sql_dialect):
+    """Return the statement creating the version_history table if it does
+    not exist, which depends only on the dialect"""
+    if dialect in __VERSION_TABLE_DDL:
+        return __VERSION_TABLE_DDL[dialect]
+
     version_history = Table(
         'version_history', MetaData(),
         Column('datetime', DateTime(), primary_key=True,
@@ -135,7 +345,7 @@ def generate(model, model_version, dialect, tables=True, constraints=True,
     )
 
     version_tbl_ddl = str(CreateTable(version_history).
-                          compile(dialect=engine.dialect)).strip()
+                          compile(dialect=sql_dialect)).strip()
 
     if dialect.startswith('mssql'):
         version_tbl_ddl = ("IF OBJECT_ID ('version_history', 'U') IS NULL " +
@@ -153,123 +363,206 @@ def generate(model, model_version, dialect, tables=True, constraints=True,
                                                   'CREATE TABLE IF NOT EXISTS')
         version_tbl_ddl = version_tbl_ddl + ";"
 
-    if delete_data:
+    __VERSION_TABLE_DDL[dialect] = version_tbl_ddl
+    return version_tbl_ddl
 
-        output.append(INSERT.format(operation='delete data'))
 
-        tables = reversed(metadata.sorted_tables)
-        output.extend(delete_ddl(tables, engine))
+def _timed(statements, dialect, elapsed):
+    """Yield the statements, recording the time spent producing them (plus
+    `elapsed` seconds) in COMPILE_SECONDS once all have been produced"""
+    statements = iter(statements)
 
-        output.insert(0, version_tbl_ddl + '\n\n')
+    while True:
+        start = time.time()
+        try:
+            statement = next(statements)
+        except StopIteration:
+            elapsed += time.time() - start
+            break
+        elapsed += time.time() - start
+        yield statement
 
-        output = ''.join(output)
+    COMPILE_SECONDS.observe(elapsed, dialect=dialect)
 
-        return output
 
-    LOGGING = 'ALTER {type} {name} LOGGING;\n'
-    NOLOGGING = 'ALTER {type} {name} NOLOGGING;\n'
+def generate_dialects(model, model_version, dialects, output_dir,
+                      processes=None,
+                      service='https://data-models-service.research.chop.edu/',
+                      **kwargs):
+    """Generate data definition language for the data model specified in
+    several DBMS dialects, writing one file per dialect.
 
-    if tables:
+    The model is retrieved and built once and then compiled for each dialect,
+    in a pool of worker processes if `processes` is greater than 1.
 
-        if drop:
+    Arguments:
+      model          Model to generate DDL for.
+      model_version  Model version to generate DDL for.
+      dialects       DBMS dialects to generate DDL in, or None for all
+                     dialects in PRETTY_DIALECTS.
+      output_dir     Directory to write `<model>_<model_version>_<dialect>.sql`
+                     files to.
+      processes      Number of worker processes to use (default: 1).
+      service        Base URL of the data models service to use.
+      **kwargs       `tables`, `constraints`, etc., as for `generate`.
 
-            tables = reversed(metadata.sorted_tables)
-            output.extend(table_ddl(tables, engine, True))
-            output.insert(0, INSERT.format(operation='drop tables'))
+    Returns: list of the paths written, in the order of `dialects`.
+    """  # noqa
 
-        elif logging and dialect.startswith('oracle'):
+    if dialects is None:
+        dialects = sorted(PRETTY_DIALECTS)
 
-            output.append(INSERT.format(operation='table logging'))
-            for table in metadata.sorted_tables:
-                output.append(LOGGING.format(type='TABLE', name=table.name))
-            output.append('\n')
+    try:
+        os.makedirs(output_dir)
+    except OSError:
+        pass
 
-        elif nologging and dialect.startswith('oracle'):
+    # Build the model and look up the service version before any workers are
+    # started, so that forked workers inherit both.
+    get_metadata(model, model_version, service)
+    get_service_version(service)
 
-            output.append(INSERT.format(operation='table nologging'))
-            for table in metadata.sorted_tables:
-                output.append(NOLOGGING.format(type='TABLE', name=table.name))
-            output.append('\n')
+    jobs = []
+    for dialect in dialects:
+        path = os.path.join(output_dir, '{0}_{1}_{2}.sql'.format(
+            model, model_version, dialect))
+        jobs.append((model, model_version, dialect, path, service, kwargs))
 
-        else:
+    if processes and processes > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(min(processes, len(jobs)))
+        try:
+            return pool.map(_write_dialect, jobs)
+        finally:
+            pool.close()
+            pool.join()
 
-            output.append(INSERT.format(operation='create tables'))
-            tables = metadata.sorted_tables
-            output.extend(table_ddl(tables, engine, False))
+    return [_write_dialect(job) for job in jobs]
 
-    if constraints:
 
-        if drop and not dialect.startswith('sqlite'):
+def _write_dialect(job):
 
-            tables = reversed(metadata.sorted_tables)
-            output.insert(0, '\n')
-            output[0:0] = constraint_ddl(tables, engine, True)
-            output.insert(0, INSERT.format(operation='drop constraints'))
+    model, model_version, dialect, path, service, kwargs = job
 
-        elif logging:
-            pass
-        elif nologging:
-            pass
+    statements = iter_generate(model, model_version, dialect, service=service,
+                               **kwargs)
 
-        elif not dialect.startswith('sqlite'):
+    with open(path, 'w') as f:
+        for statement in statements:
+            f.write(statement)
+
+    return path
+
+
+def _iter_delete(section, INSERT):
+
+    yield INSERT.format(operation='delete data')
+    for statement in section('delete'):
+        yield statement
 
-            output.append('\n')
-            output.append(INSERT.format(operation='create constraints'))
-            tables = metadata.sorted_tables
-            output.extend(constraint_ddl(tables, engine, False))
+
+def _iter_drop(section, dialect, INSERT, tables, constraints, indexes):
+
+    # Objects are dropped in the reverse of the order they are created in.
 
     if indexes:
 
-        if drop:
+        yield INSERT.format(operation='drop indexes')
+        for statement in section('indexes', True):
+            yield statement
+        yield '\n'
+
+    if constraints and not dialect.startswith('sqlite'):
+
+        yield INSERT.format(operation='drop constraints')
+        for statement in section('constraints', True):
+            yield statement
+        yield '\n'
+
+    if tables:
+
+        yield INSERT.format(operation='drop tables')
+        for statement in section('tables', True):
+            yield statement
+
+
+def _iter_create(sorted_tables, section, dialect, INSERT, tables, constraints,
+                 indexes, nologging, logging):
+
+    LOGGING = 'ALTER {type} {name} LOGGING;\n'
+    NOLOGGING = 'ALTER {type} {name} NOLOGGING;\n'
 
-            tables = reversed(metadata.sorted_tables)
-            output.insert(0, '\n')
-            output[0:0] = index_ddl(tables, engine, True)
-            output.insert(0, INSERT.format(operation='drop indexes'))
+    if tables:
 
-        elif logging and dialect.startswith('oracle'):
+        if logging and dialect.startswith('oracle'):
 
-            output.append(INSERT.format(operation='index logging'))
-            for table in metadata.sorted_tables:
-                output.append(LOGGING.format(type='INDEX', name=table.name))
-            output.append('\n')
+            yield INSERT.format(operation='table logging')
+            for table in sorted_tables:
+                yield LOGGING.format(type='TABLE', name=table.name)
+            yield '\n'
 
         elif nologging and dialect.startswith('oracle'):
 
-            output.append(INSERT.format(operation='index nologging'))
-            for table in metadata.sorted_tables:
-                output.append(NOLOGGING.format(type='INDEX', name=table.name))
-            output.append('\n')
+            yield INSERT.format(operation='table nologging')
+            for table in sorted_tables:
+                yield NOLOGGING.format(type='TABLE', name=table.name)
+            yield '\n'
 
         else:
 
-            output.append('\n')
-            output.append(INSERT.format(operation='create indexes'))
-            tables = metadata.sorted_tables
-            output.extend(index_ddl(tables, engine, False))
+            yield INSERT.format(operation='create tables')
+            for statement in section('tables'):
+                yield statement
 
-    output.insert(0, version_tbl_ddl + '\n\n')
+    if constraints:
 
-    output = ''.join(output)
+        if logging:
+            pass
+        elif nologging:
+            pass
 
-    return output
+        elif not dialect.startswith('sqlite'):
 
+            yield '\n'
+            yield INSERT.format(operation='create constraints')
+            for statement in section('constraints'):
+                yield statement
 
-def delete_ddl(tables, engine):
+    if indexes:
 
-    output = []
+        if logging and dialect.startswith('oracle'):
 
-    for table in tables:
-        output.append(str(table.delete().compile(dialect=engine.dialect)).
-                      strip())
-        output.append(';\n\n')
+            yield INSERT.format(operation='index logging')
+            for table in sorted_tables:
+                yield LOGGING.format(type='INDEX', name=table.name)
+            yield '\n'
+
+        elif nologging and dialect.startswith('oracle'):
 
-    return output
+            yield INSERT.format(operation='index nologging')
+            for table in sorted_tables:
+                yield NOLOGGING.format(type='INDEX', name=table.name)
+            yield '\n'
 
+        else:
+
+            yield '\n'
+            yield INSERT.format(operation='create indexes')
+            for statement in section('indexes'):
+                yield statement
+
+
+def delete_ddl(tables, sql_dialect):
+
+    for table in tables:
+        with phase('compile deletes'):
+            statement = str(table.delete().compile(
+                dialect=sql_dialect)).strip()
+        yield statement
+        yield ';\n\n'
 
-def table_ddl(tables, engine, drop=False):
 
-    output = []
+def table_ddl(tables, sql_dialect, drop=False):
 
     for table in tables:
 
@@ -278,15 +571,13 @@ def table_ddl(tables, engine, drop=False):
         else:
             ddl = DropTable(table)
 
-        output.append(str(ddl.compile(dialect=engine.dialect)).strip())
-        output.append(';\n\n')
+        with phase('compile tables'):
+            statement = str(ddl.compile(dialect=sql_dialect)).strip()
+        yield statement
+        yield ';\n\n'
 
-    return output
 
-
-def constraint_ddl(tables, engine, drop=False):
-
-    output = []
+def constraint_ddl(tables, sql_dialect, drop=False):
 
     for table in tables:
         constraints = sorted(list(table.constraints), key=lambda k: k.name,
@@ -298,19 +589,17 @@ def constraint_ddl(tables, engine, drop=False):
             if not isinstance(constraint, PrimaryKeyConstraint):
 
                 if not drop:
-                    ddl = AddConstraint(constraint)
+                    ddl = _AddConstraint(constraint)
                 else:
-                    ddl = DropConstraint(constraint)
-
-                output.append(str(ddl.compile(dialect=engine.dialect)).strip())
-                output.append(';\n\n')
+                    ddl = _DropConstraint(constraint)
 
-    return output
+                with phase('compile constraints'):
+                    statement = str(ddl.compile(dialect=sql_dialect)).strip()
+                yield statement
+                yield ';\n\n'
 
 
-def index_ddl(tables, engine, drop=False):
-
-    output = []
+def index_ddl(tables, sql_dialect, drop=False):
 
     for table in tables:
         indexes = sorted(list(table.indexes), key=lambda k: k.name,
@@ -322,7 +611,7 @@ def index_ddl(tables, engine, drop=False):
             else:
                 ddl = DropIndex(index)
 
-            output.append(str(ddl.compile(dialect=engine.dialect)).strip())
-            output.append(';\n\n')
-
-    return output
+            with phase('compile indexes'):
+                statement = str(ddl.compile(dialect=sql_dialect)).strip()
+            yield statement
+            yield ';\n\n'
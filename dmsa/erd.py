@@ -1,6 +1,14 @@
-from sqlalchemy import MetaData
-from dmsa.utility import get_model_json
-from dmsa.makers import make_model
+import os
+import threading
+import weakref
+import simpleflock
+from dmsa.registry import get_metadata
+from dmsa.phases import phase
+
+# Output locks only live while some thread is rendering or waiting for an
+# output, so the mapping does not grow with every diagram ever served.
+__LOCKS = weakref.WeakValueDictionary()
+__LOCKS_LOCK = threading.Lock()
 
 
 def write(model, model_version, output, service):
@@ -16,10 +24,56 @@ def write(model, model_version, output, service):
         ImportError, if erlalchemy cannot be imported
     """  # noqa
 
-    metadata = MetaData()
-    model_json = get_model_json(model, model_version, service)
-    make_model(model_json, metadata)
+    metadata = get_metadata(model, model_version, service)
 
     from eralchemy import render_er
 
-    render_er(metadata, output)
+    with phase('render ERD'):
+        render_er(metadata, output)
+
+
+def _output_lock(output):
+    with __LOCKS_LOCK:
+        return __LOCKS.setdefault(output, threading.Lock())
+
+
+def write_once(model, model_version, output, service):
+    """Generate the entity relationship diagram like `write`, unless the
+    output file already exists.
+
+    Concurrent calls for the same output, from threads or processes, render
+    it only once: the others wait for that render to finish. The diagram is
+    rendered to a temporary file and renamed into place, so the output file
+    never exists partially written.
+
+    Arguments are the same as for `write`.
+
+    Return: True if the diagram was rendered, False if it already existed.
+
+    Raises:
+        ImportError, if erlalchemy cannot be imported
+    """  # noqa
+
+    if os.path.exists(output):
+        return False
+
+    dirname, basename = os.path.split(output)
+
+    lock = _output_lock(output)
+    with lock:
+        with simpleflock.SimpleFlock(output + '.lock'):
+
+            if os.path.exists(output):
+                return False
+
+            # Keep the extension, which determines the rendered format.
+            tmp_output = os.path.join(dirname, '.tmp{0}_{1}'.format(
+                os.getpid(), basename))
+            try:
+                write(model, model_version, tmp_output, service)
+                os.rename(tmp_output, output)
+            finally:
+                if os.path.exists(tmp_output):
+                    os.remove(tmp_output)
+
+    return True
@@ -0,0 +1,296 @@
+""" Bulk export of every generated artifact to static files
+
+The export covers the same endpoints the web service exposes (DDL, drop DDL,
+data deletion DML and Oracle logging scripts for every element selection,
+plus ERDs) for every model version and dialect. Files are written to paths
+mirroring the web service URLs, with each URL's document stored as
+`index.sql` (or `index.png` for ERDs) in the matching directory, so that the
+output directory can be served by a static web server (e.g. with nginx's
+`index index.sql index.png;`).
+
+A `manifest.json` in the output directory records, for every artifact, a
+fingerprint of its inputs and the SHA-256 hash of its content. Artifacts
+whose inputs have not changed since the previous export are skipped.
+"""
+import datetime
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import tempfile
+from dmsa import __version__
+from dmsa.artifacts import artifact_key
+
+MANIFEST_FILE = 'manifest.json'
+ERD_FORMAT = 'png'
+
+
+def export_tasks(models, dialects, erd=True):
+    """Return the list of (model, version, operation, dialect, elements)
+    tuples describing every artifact to export
+
+    The ERD for a model version is described by operation 'erd', with
+    dialect and elements None.
+
+    Arguments:
+        models - template models, as returned by get_template_models
+        dialects - dialect names
+        erd - whether to include ERDs
+    """
+    tasks = []
+
+    for m in models:
+        for v in m['versions']:
+
+            model, version = m['name'], v['name']
+
+            if erd:
+                tasks.append((model, version, 'erd', None, None))
+
+            for elements in ['all', 'tables', 'indexes']:
+                tasks.append((model, version, 'logging', 'oracle', elements))
+                tasks.append((model, version, 'nologging', 'oracle',
+                              elements))
+
+            for dialect in dialects:
+
+                tasks.append((model, version, 'delete', dialect, 'all'))
+
+                for elements in ['all', 'tables', 'constraints', 'indexes']:
+                    if dialect == 'sqlite' and elements == 'constraints':
+                        continue
+                    tasks.append((model, version, 'ddl', dialect, elements))
+                    tasks.append((model, version, 'drop', dialect, elements))
+
+    return tasks
+
+
+def task_path(task):
+    """Return the path, relative to the export directory, of a task's file"""
+    model, version, operation, dialect, elements = task
+
+    if operation == 'erd':
+        return '/'.join([model, version, 'erd', 'index.' + ERD_FORMAT])
+
+    parts = [model, version, operation, dialect]
+    if elements != 'all':
+        parts.append(elements)
+    parts.append('index.sql')
+    return '/'.join(parts)
+
+
+def _model_json_hash(model_json):
+    return hashlib.sha1(json.dumps(model_json, sort_keys=True)).hexdigest()
+
+
+def _read_manifest(out_dir):
+    pathname = os.path.join(out_dir, MANIFEST_FILE)
+    try:
+        with open(pathname) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {'artifacts': {}}
+
+
+def _write_atomic(pathname, data):
+    dirname = os.path.dirname(pathname)
+    try:
+        os.makedirs(dirname)
+    except OSError:
+        pass
+    fd, tmp_pathname = tempfile.mkstemp(dir=dirname, prefix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.rename(tmp_pathname, pathname)
+
+
+def _file_hash(pathname):
+    try:
+        with open(pathname, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except IOError:
+        return None
+
+
+def _export_task(job):
+    """Generate one artifact and write it; run in worker processes
+
+    Return: (task, SHA-256 hash, size), or (task, None, None) if the
+        artifact could not be generated or written (the error is logged)
+    """
+    try:
+        return _export(job)
+    except Exception:
+        logging.exception('Failed to export %s', task_path(job[0]))
+        return job[0], None, None
+
+
+def _export(job):
+    task, pathname, service = job
+    model, version, operation, dialect, elements = task
+
+    if operation == 'erd':
+        from dmsa import erd
+        tmp_dir = tempfile.mkdtemp()
+        tmp_pathname = os.path.join(tmp_dir, 'erd.' + ERD_FORMAT)
+        try:
+            erd.write(model, version, tmp_pathname, service)
+            with open(tmp_pathname, 'rb') as f:
+                data = f.read()
+        finally:
+            try:
+                os.remove(tmp_pathname)
+            except OSError:
+                pass
+            os.rmdir(tmp_dir)
+    else:
+        from dmsa import ddl
+        data = ddl.generate(model, version, dialect, service=service,
+                            **ddl.operation_kwargs(operation, elements)
+                            ).encode('utf-8')
+
+    _write_atomic(pathname, data)
+
+    return task, hashlib.sha256(data).hexdigest(), len(data)
+
+
+def export(out_dir, service, models=None, dialects=None, erd=True,
+           processes=None):
+    """Export every artifact for the models to static files in out_dir
+
+    Arguments:
+        out_dir - directory to write artifacts and the manifest to
+        service - base URL of the data models service to use
+        models - template models to export (see get_template_models), or
+            None for all models from the service
+        dialects - dialect names to export, or None for all
+        erd - whether to export ERDs (skipped if ERAlchemy isn't installed)
+        processes - number of worker processes (default: one per CPU)
+
+    Return: dict with the number of artifacts 'written', 'skipped' and
+        'failed'. Failed artifacts are left out of the manifest, so they
+        are attempted again by the next export.
+    """
+    from dmsa.registry import get_metadata
+    from dmsa.utility import (get_template_models, get_template_dialects,
+                              get_service_version, get_model_json,
+                              fetch_model_jsons)
+
+    if models is None:
+        models = get_template_models(service)
+
+    if dialects is None:
+        dialects = [d['name'] for d in get_template_dialects()]
+
+    if erd:
+        try:
+            import eralchemy  # noqa
+        except ImportError:
+            logging.warning('ERAlchemy not installed; skipping ERDs')
+            erd = False
+
+    service_version = get_service_version(service)
+
+    # Retrieve every model version's JSON at once rather than one by one.
+    model_jsons = fetch_model_jsons(service, models)
+
+    old_artifacts = _read_manifest(out_dir)['artifacts']
+    artifacts = {}
+    jobs = []
+    model_hashes = {}
+    failed = 0
+    # Model versions whose JSON cannot be retrieved, or that cannot be built,
+    # fail all their artifacts.
+    failed_models = set()
+
+    for task in export_tasks(models, dialects, erd):
+
+        model, version, operation, dialect, elements = task
+
+        if (model, version) in failed_models:
+            failed += 1
+            continue
+
+        if (model, version) not in model_hashes:
+            if (model, version) not in model_jsons:
+                # Retry, failing the model version if it fails again.
+                try:
+                    model_jsons[(model, version)] = get_model_json(
+                        model, version, service)
+                except Exception:
+                    logging.exception('Failed to retrieve %s %s', model,
+                                      version)
+                    failed_models.add((model, version))
+                    failed += 1
+                    continue
+            model_hashes[(model, version)] = _model_json_hash(
+                model_jsons[(model, version)])
+
+        inputs = artifact_key(model, version, dialect or '', operation,
+                              elements or ERD_FORMAT, service_version) + \
+            model_hashes[(model, version)]
+
+        path = task_path(task)
+        pathname = os.path.join(out_dir, *path.split('/'))
+        old = old_artifacts.get(path)
+
+        if (old and old['inputs'] == inputs and
+                _file_hash(pathname) == old['sha256']):
+            artifacts[path] = old
+            continue
+
+        artifacts[path] = {'inputs': inputs}
+        jobs.append((task, pathname, service))
+
+    # Build the models that need work before starting the pool, so that the
+    # forked workers inherit them instead of each building their own.
+    for model, version in set((job[0][0], job[0][1]) for job in jobs):
+        try:
+            get_metadata(model, version, service,
+                         model_jsons[(model, version)])
+        except Exception:
+            logging.exception('Failed to build %s %s', model, version)
+            failed_models.add((model, version))
+
+    for job in jobs:
+        if job[0][:2] in failed_models:
+            del artifacts[task_path(job[0])]
+            failed += 1
+    jobs = [job for job in jobs if job[0][:2] not in failed_models]
+
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+
+    if processes > 1 and len(jobs) > 1:
+        pool = multiprocessing.Pool(min(processes, len(jobs)))
+        try:
+            results = pool.map(_export_task, jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_export_task(job) for job in jobs]
+
+    written = 0
+    for task, sha256, size in results:
+        if sha256 is None:
+            del artifacts[task_path(task)]
+            failed += 1
+        else:
+            artifacts[task_path(task)].update({'sha256': sha256,
+                                               'size': size})
+            written += 1
+
+    manifest = {
+        'dmsa_version': __version__,
+        'service': service,
+        'service_version': service_version,
+        'generated': datetime.datetime.utcnow().isoformat() + 'Z',
+        'artifacts': artifacts
+    }
+    _write_atomic(os.path.join(out_dir, MANIFEST_FILE),
+                  json.dumps(manifest, indent=2, sort_keys=True))
+
+    return {'written': written, 'skipped': len(artifacts) - written,
+            'failed': failed}
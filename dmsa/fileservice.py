@@ -0,0 +1,158 @@
+""" Serve data models service endpoints from a directory of JSON files
+
+A service directory holds model JSON as served by the data models service,
+one file per model version, and optionally the catalog and service version:
+
+    <directory>/schemata/<model>/<model_version>.json
+    <directory>/models.json     the catalog, as served at `models`; if
+                                absent, it lists every model version above
+                                as a final release
+    <directory>/VERSION         the service version (default: "local")
+
+`dmsa` reads such a directory directly when given a `file://` service URL
+(e.g. `--service=file:///srv/data-models/`): the shared session routes those
+URLs to `FileAdapter`, so no server or network is involved. `build_app`
+serves the same directory over HTTP, for tools that need a real data models
+service URL.
+"""
+import email.utils
+import json
+import os
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+DEFAULT_SERVICE_VERSION = 'local'
+
+
+def service_url(directory):
+    """Return the `file://` service URL for a service directory"""
+    return 'file://' + os.path.abspath(directory).rstrip('/') + '/'
+
+
+def service_version(directory):
+    try:
+        with open(os.path.join(directory, 'VERSION')) as f:
+            return f.read().strip() or DEFAULT_SERVICE_VERSION
+    except IOError:
+        return DEFAULT_SERVICE_VERSION
+
+
+def model_pathname(directory, model, model_version):
+    return os.path.join(directory, 'schemata', model, model_version + '.json')
+
+
+def catalog(directory):
+    """Return the catalog of model versions in the directory"""
+    pathname = os.path.join(directory, 'models.json')
+    if os.path.exists(pathname):
+        with open(pathname) as f:
+            return json.load(f)
+
+    models = []
+    schemata = os.path.join(directory, 'schemata')
+    for model in sorted(os.listdir(schemata)) \
+            if os.path.isdir(schemata) else []:
+        for filename in sorted(os.listdir(os.path.join(schemata, model))):
+            model_version, ext = os.path.splitext(filename)
+            if ext == '.json':
+                models.append({'name': model, 'version': model_version,
+                               'release': {'level': 'final'}})
+    return models
+
+
+def write_model(directory, model, model_version, model_json):
+    """Save model JSON in the directory; return its pathname"""
+    pathname = model_pathname(directory, model, model_version)
+    try:
+        os.makedirs(os.path.dirname(pathname))
+    except OSError:
+        pass
+    with open(pathname, 'w') as f:
+        json.dump(model_json, f, sort_keys=True)
+    return pathname
+
+
+def read(directory, path):
+    """Return the status code and body of the service endpoint at `path`
+    (relative to the service URL, without the query string)"""
+    parts = path.strip('/').split('/')
+
+    if parts == ['models']:
+        return 200, json.dumps(catalog(directory))
+
+    if len(parts) == 3 and parts[0] == 'schemata' and \
+            '' not in parts and '..' not in parts:
+        try:
+            with open(model_pathname(directory, parts[1], parts[2])) as f:
+                return 200, f.read()
+        except IOError:
+            pass
+
+    return 404, json.dumps({'error': 'not found'})
+
+
+def _headers(directory):
+    # The data models service reports its version in the User-Agent
+    # response header.
+    return {'Content-Type': 'application/json',
+            'User-Agent': 'DataModelsService/{0} (file)'.format(
+                service_version(directory))}
+
+
+class FileAdapter(BaseAdapter):
+    """A requests transport adapter answering `file://` data models service
+    URLs from a service directory"""
+
+    def send(self, request, **kwargs):
+        path = requests.compat.urlparse(request.url).path
+        path = requests.compat.unquote(path)
+
+        if path.endswith('/models'):
+            directory, path = path[:-len('models')], 'models'
+        elif '/schemata/' in path:
+            directory, _, path = path.rpartition('/schemata/')
+            path = 'schemata/' + path
+        else:
+            directory, path = path, ''
+
+        status_code, body = read(directory, path)
+
+        response = requests.Response()
+        response.status_code = status_code
+        response.reason = 'OK' if status_code == 200 else 'Not Found'
+        response.headers = CaseInsensitiveDict(_headers(directory))
+        response.headers['Date'] = email.utils.formatdate(usegmt=True)
+        response._content = body
+        response.encoding = 'utf-8'
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+def build_app(directory):
+    """Return a Flask app serving the service directory over HTTP"""
+    from flask import Flask, request, make_response
+
+    app = Flask(__name__)
+
+    @app.route('/models')
+    def models():
+        return respond('models')
+
+    @app.route('/schemata/<model>/<model_version>')
+    def schemata(model, model_version):
+        return respond('schemata/{0}/{1}'.format(model, model_version))
+
+    def respond(path):
+        status_code, body = read(directory, path)
+        response = make_response(body, status_code, _headers(directory))
+        if status_code == 200:
+            response.add_etag()
+            response.make_conditional(request)
+        return response
+
+    return app
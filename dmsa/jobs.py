@@ -0,0 +1,244 @@
+""" Background ERD rendering jobs for the web service
+
+ERDs are rendered in a bounded pool of worker processes, which keeps
+graphviz's memory use out of the web process and the web request threads
+free. Jobs are identified by their output file path, so requesting an ERD
+that is already queued joins the existing job instead of queueing another.
+Once the number of queued and running jobs reaches the maximum, new jobs are
+refused rather than piling up. A job that has not finished within its
+deadline (e.g. because its worker process died) is marked failed, so that it
+no longer counts towards the maximum and can be submitted again. Failures
+are reported for FAILED_TTL seconds, and at most MAX_FAILED are kept.
+
+The worker processes are started by `start`, which should be called before
+the process starts any threads: forking a process while other threads hold
+locks leaves those locks held in the children. Workers are never replaced,
+so no process is forked after that.
+
+Until the workers are started, or if the number of workers is set to 0, ERDs
+are rendered synchronously instead.
+"""
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from dmsa.metrics import Histogram
+
+ERD_WORKERS = 2
+MAX_PENDING = 16
+MAX_FAILED = 64
+JOB_TIMEOUT = 300  # seconds
+FAILED_TTL = 600  # seconds
+
+PENDING = 'pending'
+FAILED = 'failed'
+
+RENDER_SECONDS = Histogram('dmsa_erd_render_seconds',
+                           'Time spent rendering ERDs.',
+                           labels=('status',))
+
+__POOL = None
+__WORKERS = ERD_WORKERS
+__MAX_PENDING = MAX_PENDING
+__TIMEOUT = JOB_TIMEOUT
+__JOBS = {}
+__LOCK = threading.Lock()
+
+
+class QueueFull(Exception):
+    """Raised when a job is refused because too many are queued"""
+
+
+def configure(workers=None, max_pending=None, timeout=None):
+    """Set the number of render worker processes (0 to render synchronously),
+    the maximum number of queued and running jobs and the number of seconds
+    after which an unfinished job is failed
+
+    Arguments left as None keep their current values. Changing the number of
+    workers stops the running workers (see `shutdown`); call `start` to
+    start the new ones.
+    """
+    global __WORKERS, __MAX_PENDING, __TIMEOUT, __POOL
+
+    old_pool = None
+
+    with __LOCK:
+        if workers is not None and workers != __WORKERS:
+            __WORKERS = workers
+            old_pool, __POOL = __POOL, None
+        if max_pending is not None:
+            __MAX_PENDING = max_pending
+        if timeout is not None:
+            __TIMEOUT = timeout
+
+    _close(old_pool)
+
+
+def _close(pool):
+    # Let queued jobs finish; their callbacks need the lock.
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+
+def start():
+    """Start the render worker processes, unless started or the number of
+    workers is 0
+
+    Call this before the process starts any other threads.
+    """
+    global __POOL
+
+    # Fork the workers without holding the lock.
+    if __POOL is None and __WORKERS > 0:
+        __POOL = multiprocessing.Pool(__WORKERS)
+
+
+def shutdown():
+    """Stop the render worker processes once their queued jobs finish"""
+    global __POOL
+
+    with __LOCK:
+        pool, __POOL = __POOL, None
+
+    _close(pool)
+
+
+def _failed(error, now):
+    return {'status': FAILED, 'error': error, 'result': None,
+            'deadline': now + FAILED_TTL}
+
+
+def _expire(now):
+    """Fail pending jobs that are past their deadline, and forget failures
+    past theirs or beyond MAX_FAILED; call with the lock
+
+    A job's deadline is when it is failed, if pending, or forgotten, if
+    failed.
+    """
+    for output, job in __JOBS.items():
+        if job['deadline'] >= now:
+            continue
+        if job['status'] == FAILED:
+            del __JOBS[output]
+        elif not job['result'].ready():
+            __JOBS[output] = _failed(
+                'Not rendered within {0} seconds'.format(__TIMEOUT), now)
+
+    failures = sorted((job['deadline'], output)
+                      for output, job in __JOBS.items()
+                      if job['status'] == FAILED)
+    for deadline, output in failures[:-MAX_FAILED]:
+        del __JOBS[output]
+
+
+def _render(job):
+    """Render an ERD; run in worker processes
+
+    Return: (error, seconds), where error is None on success or an error
+        message, and seconds is the time spent rendering.
+    """
+    from dmsa import erd
+
+    model, model_version, output, service = job
+    start = time.time()
+
+    try:
+        erd.write_once(model, model_version, output, service)
+    except Exception as e:
+        logging.exception('rendering ERD {0}'.format(output))
+        return '{0}: {1}'.format(type(e).__name__, e), time.time() - start
+
+    return None, time.time() - start
+
+
+def _finished(output, error, seconds):
+    RENDER_SECONDS.observe(seconds, status='ok' if error is None else FAILED)
+
+    with __LOCK:
+        if error is None:
+            __JOBS.pop(output, None)
+        else:
+            __JOBS[output] = _failed(error, time.time())
+
+
+def submit_erd(model, model_version, output, service):
+    """Queue rendering of an ERD to the output file, unless the file exists
+    or a job for it is already queued
+
+    The ERD is rendered synchronously if the worker processes have not
+    been started (see `start`).
+
+    Return: True if the ERD is ready, False if it is being rendered.
+
+    Raises:
+        QueueFull, if the maximum number of jobs is already queued
+    """
+    if os.path.exists(output):
+        return True
+
+    job = (model, model_version, output, service)
+
+    with __LOCK:
+
+        if __POOL is None:
+            synchronous = True
+
+        else:
+            synchronous = False
+
+            now = time.time()
+            _expire(now)
+
+            existing = __JOBS.get(output)
+            if existing and existing['status'] == PENDING:
+                return False
+
+            pending = sum(1 for j in __JOBS.values()
+                          if j['status'] == PENDING)
+            if pending >= __MAX_PENDING:
+                raise QueueFull('{0} ERD jobs queued'.format(pending))
+
+            result = __POOL.apply_async(
+                _render, (job,),
+                callback=lambda result: _finished(output, *result))
+            __JOBS[output] = {'status': PENDING, 'error': None,
+                              'result': result,
+                              'deadline': now + __TIMEOUT}
+
+    if synchronous:
+        error, seconds = _render(job)
+        _finished(output, error, seconds)
+        return error is None
+
+    return False
+
+
+def erd_status(output):
+    """Return the status of the ERD output file: 'ready', 'pending',
+    'failed' or None if it is neither rendered nor being rendered
+
+    Renders queued by other processes are detected by their lock file.
+    """
+    if os.path.exists(output):
+        return 'ready'
+
+    with __LOCK:
+        _expire(time.time())
+        job = __JOBS.get(output)
+
+    if job:
+        return job['status']
+
+    if os.path.exists(output + '.lock'):
+        return PENDING
+
+    return None
+
+
+def erd_error(output):
+    """Return the error message of a failed ERD job, or None"""
+    with __LOCK:
+        job = __JOBS.get(output)
+    return job and job['error']
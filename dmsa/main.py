@@ -6,9 +6,12 @@ Functionality:
   sources to generate ERDs. Serves both through a basic web service.
 
 Usage:
-  dmsa ddl [--service=URL] [-tci] [-d | -x | -n | -l] [-o FILE] <model> <model_version> <dialect>
-  dmsa erd [--service=URL] -o FILE <model> <model_version>
-  dmsa serve [--service=URL] [--host=HOSTNAME --port=PORT --debug]
+  dmsa ddl [--service=URL --service-timeout=SECONDS] [-tci] [-d | -x | -n | -l] [-o FILE] [--profile [--profile-output=FILE]] <model> <model_version> <dialect>
+  dmsa ddl [--service=URL --service-timeout=SECONDS] [-tci] [-d | -x | -n | -l] [--processes=N] (--dialect=DIALECTS | --all-dialects) --output-dir=DIR <model> <model_version>
+  dmsa erd [--service=URL --service-timeout=SECONDS] [--profile [--profile-output=FILE]] -o FILE <model> <model_version>
+  dmsa export [--service=URL --service-timeout=SECONDS] [--processes=N] [--no-erd] --out=DIR (--all | <model> [<model_version>])
+  dmsa serve [--service=URL --service-timeout=SECONDS] [--host=HOSTNAME --port=PORT --debug] [--warm-workers=N]
+  dmsa file-service [--host=HOSTNAME --port=PORT] <directory>
   dmsa (-h | --help)
   dmsa --version
 
@@ -23,11 +26,34 @@ Options:
   -n --nologging       Generate Oracle DDL to make objects "nologging".
   -l --logging         Generate Oracle DDL to make objects "logging".
   -o --output=FILE     Output file for DDL or ERD.
+  --dialect=DIALECTS   Comma-separated DBMS dialects to generate DDL in, e.g.
+                       postgresql,oracle,mssql,mysql.
+  --all-dialects       Generate DDL in every supported dialect.
+  --output-dir=DIR     Output directory for DDL in several dialects, written
+                       as one <model>_<model_version>_<dialect>.sql per dialect.
+  --processes=N        Number of processes to generate DDL in (defaults to 1
+                       for ddl and one per CPU for export).
+  --out=DIR            Output directory for exported artifacts.
+  --all                Export artifacts for all models and versions.
+  --no-erd             Do not export ERDs.
+  --profile            Print the time and memory spent in each phase of
+                       generation (fetching and decoding the model JSON,
+                       building the model, sorting tables, compiling each kind
+                       of statement, rendering) to stderr.
+  --profile-output=FILE
+                       Also write cProfile statistics to FILE, for use with
+                       pstats or snakeviz.
   --host=HOSTNAME      The web service hostname [default: 127.0.0.1].
   --port=PORT          The web service port to listen on [default: 5000].
   --debug              Enable debug mode in the web service.
-  --service=URL        Base URL of the data models service to use
+  --warm-workers=N     Number of threads to pre-build models and their most
+                       requested DDL in after each catalog refresh [default: 0].
+  --service=URL        Base URL of the data models service to use, or a
+                       file:// URL of a directory of model JSON files
                        [default: https://data-models-service.research.chop.edu/].
+  --service-timeout=SECONDS
+                       Seconds to wait for the data models service to connect
+                       or respond (defaults to 5 to connect, 30 to respond).
 
 Environment Variables
 
@@ -36,6 +62,13 @@ Environment Variables
   issue a push-event webhook request to indicate that the dmsa service should
   re-cache data from the data models service.
 
+Service Directories
+
+  `dmsa file-service` serves the data models service endpoints used by dmsa
+  from a directory holding schemata/<model>/<model_version>.json files and,
+  optionally, the catalog in models.json and the service version in VERSION.
+  dmsa can also read such a directory directly via a file:// service URL.
+
 """  # noqa
 
 
@@ -47,22 +80,89 @@ def main():
     # Parse command line arguments.
     args = docopt(__doc__, argv=sys.argv[1:], version=__version__)
 
-    if args['ddl']:
+    if args['--service-timeout']:
+        from dmsa.utility import configure_session
+        configure_session(timeout=float(args['--service-timeout']))
+
+    if args['--profile']:
+        return profile(args)
+
+    return run(args)
+
+
+def profile(args):
+    """Run the command, then print its per-phase breakdown to stderr and
+    write cProfile statistics if requested"""
+    import sys
+    import time
+    from dmsa import phases
+
+    phases.enable()
+
+    profiler = None
+    if args['--profile-output']:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    start = time.time()
+
+    try:
+        return run(args)
+    finally:
+        total = time.time() - start
+
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(args['--profile-output'])
+
+        sys.stderr.write(phases.format_report(total))
+
+
+def run(args):
+    import sys
+
+    if args['ddl'] and args['--output-dir']:
         from dmsa import ddl
 
-        output = ddl.generate(args['<model>'], args['<model_version>'],
-                              args['<dialect>'], args['--tables'],
-                              args['--constraints'], args['--indexes'],
-                              args['--drop'], args['--delete-data'],
-                              args['--nologging'], args['--logging'],
-                              args['--service'])
+        dialects = None
+        if args['--dialect']:
+            dialects = [d.strip() for d in args['--dialect'].split(',')
+                        if d.strip()]
+
+        ddl.generate_dialects(args['<model>'], args['<model_version>'],
+                              dialects, args['--output-dir'],
+                              processes=int(args['--processes'] or 1),
+                              service=args['--service'],
+                              tables=args['--tables'],
+                              constraints=args['--constraints'],
+                              indexes=args['--indexes'],
+                              drop=args['--drop'],
+                              delete_data=args['--delete-data'],
+                              nologging=args['--nologging'],
+                              logging=args['--logging'])
+
+    elif args['ddl']:
+        from dmsa import ddl
 
+        statements = ddl.iter_generate(args['<model>'],
+                                       args['<model_version>'],
+                                       args['<dialect>'], args['--tables'],
+                                       args['--constraints'],
+                                       args['--indexes'], args['--drop'],
+                                       args['--delete-data'],
+                                       args['--nologging'],
+                                       args['--logging'], args['--service'])
+
+        # Write statements as they are generated rather than holding the
+        # whole script in memory.
         if args['--output']:
-            f = open(args['--output'], 'w')
-            f.write(output)
-            f.close()
+            with open(args['--output'], 'w') as f:
+                for statement in statements:
+                    f.write(statement)
         else:
-            return sys.stdout.write(output)
+            for statement in statements:
+                sys.stdout.write(statement)
 
     elif args['erd']:
         from dmsa import erd
@@ -74,12 +174,45 @@ def main():
                 'ERD not supported because ERAlchemy module not installed\n')
             sys.exit(1)
 
+    elif args['export']:
+        from dmsa import export
+        from dmsa.utility import get_template_models
+
+        models = get_template_models(args['--service'])
+        if args['<model>']:
+            models = [m for m in models if m['name'] == args['<model>']]
+            if args['<model_version>']:
+                models = [dict(m, versions=[
+                    v for v in m['versions']
+                    if v['name'] == args['<model_version>']])
+                    for m in models]
+            if not models or not models[0]['versions']:
+                sys.stderr.write('Model or version not found\n')
+                sys.exit(1)
+
+        processes = args['--processes']
+        result = export.export(args['--out'], args['--service'],
+                               models=models, erd=not args['--no-erd'],
+                               processes=int(processes) if processes
+                               else None)
+        sys.stderr.write(
+            '{0} artifacts written, {1} unchanged, {2} failed\n'.format(
+                result['written'], result['skipped'], result['failed']))
+        if result['failed']:
+            sys.exit(1)
+
     elif args['serve']:
         from dmsa import service
-        app = service.build_app(args['--service'])
+        app = service.build_app(args['--service'],
+                                warm_workers=int(args['--warm-workers']))
         app.run(host=args['--host'], port=int(args['--port']),
                 debug=args['--debug'])
 
+    elif args['file-service']:
+        from dmsa import fileservice
+        app = fileservice.build_app(args['<directory>'])
+        app.run(host=args['--host'], port=int(args['--port']))
+
 
 if __name__ == '__main__':
     main()
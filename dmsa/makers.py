@@ -1,9 +1,34 @@
 from __future__ import unicode_literals
 
+import time
+from collections import defaultdict
+from dmsa.metrics import Histogram
+from dmsa.phases import phase
+
+MAKE_MODEL_SECONDS = Histogram('dmsa_make_model_seconds',
+                               'Time spent building models from their JSON.',
+                               labels=('model',))
+
+_DATATYPE_MAP = None
+
 
 def get_datatype_map():
+    """Returns the mapping of data-models type names to SQLAlchemy types.
+
+    The mapping is built on first use and shared afterwards.
+    """
+    global _DATATYPE_MAP
+
+    if _DATATYPE_MAP is None:
+        _DATATYPE_MAP = _make_datatype_map()
+
+    return _DATATYPE_MAP
+
+
+def _make_datatype_map():
     from sqlalchemy import (Integer, Numeric, Float, String, Date,
-                            DateTime, Time, Text, Boolean, LargeBinary,BigInteger)
+                            DateTime, Time, Text, Boolean, LargeBinary,
+                            BigInteger)
 
     return {
         'integer': Integer,
@@ -94,8 +119,7 @@ def make_column(field, not_null_flag=False):
     column_kwargs['name'] = field['name']
 
     type_string = field['type']
-    DATATYPE_MAP = get_datatype_map()
-    type_class = DATATYPE_MAP[type_string]
+    type_class = get_datatype_map()[type_string]
     type_kwargs = {}
 
     if field.get('description'):
@@ -141,14 +165,11 @@ def make_table(table_json, metadata, not_nulls):
 
     fields = table_json.get('fields', []) or []
 
-    for field in fields:
+    not_null_fields = set(not_null['field'] for not_null in not_nulls)
 
-        not_null_flag = False
+    for field in fields:
 
-        for not_null in not_nulls:
-            if not_null['field'] == field['name']:
-                not_null_flag = True
-                break
+        not_null_flag = field['name'] in not_null_fields
 
         table.append_column(make_column(field, not_null_flag))
 
@@ -167,21 +188,19 @@ def make_model(data_model, metadata):
     This could simply be sqlalchemy.MetaData().
     """
 
-    for table_json in data_model['tables']:
-
-        # Construct table-relevant not-null constraint list.
+    # Group not-null constraints by table in a single pass.
 
-        table_not_nulls = []
+    not_nulls = defaultdict(list)
 
-        for not_null in data_model['schema']['constraints']['not_null'] or []:
+    for not_null in data_model['schema']['constraints']['not_null'] or []:
 
-            if not_null['table'] == table_json['name']:
+        not_nulls[not_null['table']].append(not_null)
 
-                table_not_nulls.append(not_null)
+    for table_json in data_model['tables']:
 
         # Construct and attach table to metadata.
 
-        make_table(table_json, metadata, table_not_nulls)
+        make_table(table_json, metadata, not_nulls[table_json['name']])
 
     # Construct and add constraints to the relevant tables.
 
@@ -206,6 +225,36 @@ def make_model(data_model, metadata):
     return metadata
 
 
-def make_model_from_service(model, model_version, service, metadata):
-    from dmsa.utility import get_model_json
-    return make_model(get_model_json(model, model_version, service), metadata)
+def make_model_from_service(model, model_version, service, metadata,
+                            model_json=None):
+    """Retrieve the model version's JSON from the service and build the
+    model in metadata, or build it from `model_json` if that has already
+    been retrieved"""
+    if model_json is None:
+        from dmsa.utility import get_model_json
+        model_json = get_model_json(model, model_version, service)
+    start = time.time()
+    with phase('make_model'):
+        metadata = make_model(model_json, metadata)
+    # Only observed once the model is built, so that unknown or broken
+    # models do not add values of the model label.
+    MAKE_MODEL_SECONDS.observe(time.time() - start, model=model)
+    return metadata
+
+
+def amake_model_from_service(model, model_version, service, metadata,
+                             callback=None):
+    """Retrieve the model JSON and build the model like
+    `make_model_from_service`, but in the shared pool of threads that
+    service requests are made in (see dmsa.utility.get_pool), so that many
+    model versions can be fetched and built concurrently with at most one
+    connection to the service per thread
+
+    Returns: a multiprocessing AsyncResult whose `get()` returns the
+    metadata or raises the first exception; `callback`, if given, is called
+    with the metadata once the model is built.
+    """
+    from dmsa.utility import get_pool
+    return get_pool().apply_async(
+        make_model_from_service, (model, model_version, service, metadata),
+        callback=callback)
@@ -0,0 +1,202 @@
+""" Minimal in-process metrics in the Prometheus text exposition format
+
+Counters and histograms are created at import time by the modules they
+instrument and rendered by the web service's `/metrics` endpoint. Values
+are kept per process; under gunicorn each worker reports its own, which
+Prometheus distinguishes by instance and aggregates.
+
+Collectors (functions returning samples computed at scrape time, e.g. from
+cache statistics) can be registered with `register_collector`.
+"""
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+                   30, 60)
+
+__METRICS = []
+__COLLECTORS = []
+__LOCK = threading.Lock()
+
+
+def _escape(value):
+    return unicode(value).replace('\\', r'\\').replace('\n', r'\n') \
+        .replace('"', r'\"')
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    return u'{' + u','.join(u'{0}="{1}"'.format(n, _escape(v))
+                            for n, v in zip(names, values)) + u'}'
+
+
+def _ordered(names, values):
+    return OrderedDict(zip(names, values))
+
+
+def _register(metric):
+    with __LOCK:
+        __METRICS.append(metric)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class _Metric(object):
+
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        _register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError('{0} takes labels {1}'.format(
+                self.name, ', '.join(self.labels)))
+        return tuple(labels[n] for n in self.labels)
+
+    def samples(self):
+        """Return a list of (name, labels dict, value) samples"""
+        with self._lock:
+            items = sorted(self._values.items())
+        return [(self.name, _ordered(self.labels, key), value)
+                for key, value in items]
+
+    def render(self):
+        lines = ['# HELP {0} {1}'.format(self.name, self.help),
+                 '# TYPE {0} {1}'.format(self.name, self.type)]
+        for name, labels, value in self.samples():
+            lines.append(u'{0}{1} {2}'.format(
+                name, _format_labels(list(labels), list(labels.values())),
+                _format_value(value)))
+        return lines
+
+
+class Counter(_Metric):
+    """A monotonically increasing count
+
+    Arguments:
+        name - metric name, ending in `_total` by convention
+        help - description of the metric
+        labels - names of the labels every increment must give
+    """
+
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    """A value that can go up and down"""
+
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    """A distribution of observed values (durations in seconds, e.g.)
+
+    Arguments:
+        buckets - upper bounds of the buckets, in increasing order
+    """
+
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, help, labels)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key,
+                                             ([0] * len(self.buckets), 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the time spent in the `with` block"""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(time.time() - start, **labels)
+
+    def count(self, **labels):
+        with self._lock:
+            counts, total = self._values.get(self._key(labels), ([0], 0))
+        return counts[-1]
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, (list(counts), total))
+                           for key, (counts, total) in self._values.items())
+
+        samples = []
+        for key, (counts, total) in items:
+            labels = _ordered(self.labels, key)
+            for bound, count in zip(self.buckets, counts):
+                bucket_labels = _ordered(self.labels + ('le',),
+                                         key + (_format_value(bound),))
+                samples.append((self.name + '_bucket', bucket_labels, count))
+            samples.append((self.name + '_count', labels, counts[-1]))
+            samples.append((self.name + '_sum', labels, total))
+        return samples
+
+
+def register_collector(collector):
+    """Register a function returning a list of (name, type, help, samples)
+    tuples, where samples is a list of (labels dict, value) pairs, to be
+    called on every scrape"""
+    with __LOCK:
+        __COLLECTORS.append(collector)
+
+
+def render():
+    """Return all metrics in the Prometheus text exposition format"""
+    with __LOCK:
+        metrics = list(__METRICS)
+        collectors = list(__COLLECTORS)
+
+    lines = []
+
+    for metric in metrics:
+        lines.extend(metric.render())
+
+    for collector in collectors:
+        for name, type_, help, samples in collector():
+            lines.append('# HELP {0} {1}'.format(name, help))
+            lines.append('# TYPE {0} {1}'.format(name, type_))
+            for labels, value in samples:
+                if value is None:
+                    continue
+                lines.append(u'{0}{1} {2}'.format(
+                    name, _format_labels(list(labels), list(labels.values())),
+                    _format_value(value)))
+
+    return u'\n'.join(lines) + u'\n'
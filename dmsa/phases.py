@@ -0,0 +1,96 @@
+""" Per-phase timing and memory breakdown for profiling generation
+
+The slow parts of generating DDL or an ERD (fetching and decoding the model
+JSON, building the model, sorting tables, compiling statements, rendering)
+are wrapped in `phase` blocks. When enabled (by `dmsa ddl --profile`, e.g.),
+each phase's number of calls, total time and growth of the process's peak
+resident memory are recorded; otherwise `phase` does nothing.
+
+Python 2 has no tracemalloc, so memory is measured as the growth of the peak
+resident set size while in each phase: a phase that allocates more than any
+earlier phase shows how much more, and phases that reuse memory show 0.
+"""
+import resource
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+__ENABLED = False
+__PHASES = OrderedDict()
+__LOCK = threading.Lock()
+
+
+def enable(enabled=True):
+    """Enable (or disable) recording phases, clearing those recorded"""
+    global __ENABLED
+    with __LOCK:
+        __ENABLED = enabled
+        __PHASES.clear()
+
+
+def _maxrss():
+    """Return the peak resident set size in KB"""
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        maxrss //= 1024  # reported in bytes
+    return maxrss
+
+
+@contextmanager
+def phase(name):
+    """Record the time and memory spent in the `with` block under `name`"""
+    if not __ENABLED:
+        yield
+        return
+
+    start = time.time()
+    maxrss = _maxrss()
+
+    try:
+        yield
+    finally:
+        seconds = time.time() - start
+        growth = _maxrss() - maxrss
+        with __LOCK:
+            calls, total, total_growth = __PHASES.get(name, (0, 0, 0))
+            __PHASES[name] = (calls + 1, total + seconds,
+                              total_growth + growth)
+
+
+def report():
+    """Return a list of (name, calls, seconds, peak memory growth in KB)
+    tuples, in the order phases were first entered"""
+    with __LOCK:
+        return [(name,) + values for name, values in __PHASES.items()]
+
+
+def format_report(total_seconds=None):
+    """Return the recorded phases as a table
+
+    Arguments:
+        total_seconds - the total time of the profiled run; if given, each
+            phase's share of it and the unaccounted time are included
+    """
+    lines = ['{0:<24} {1:>8} {2:>10} {3:>7} {4:>12}'.format(
+        'phase', 'calls', 'seconds', '%', 'peak RSS KB')]
+
+    accounted = 0
+
+    for name, calls, seconds, growth in report():
+        accounted += seconds
+        share = '{0:.1f}'.format(100 * seconds / total_seconds) \
+            if total_seconds else ''
+        lines.append('{0:<24} {1:>8} {2:>10.4f} {3:>7} {4:>12}'.format(
+            name, calls, seconds, share, '+{0}'.format(growth)))
+
+    if total_seconds:
+        other = max(0, total_seconds - accounted)
+        lines.append('{0:<24} {1:>8} {2:>10.4f} {3:>7.1f} {4:>12}'.format(
+            'other', '', other, 100 * other / total_seconds, ''))
+        lines.append('{0:<24} {1:>8} {2:>10.4f} {3:>7} {4:>12}'.format(
+            'total', '', total_seconds, '100.0',
+            '{0}'.format(_maxrss())))
+
+    return '\n'.join(lines) + '\n'
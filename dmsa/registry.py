@@ -0,0 +1,70 @@
+""" A process-wide registry of built data model MetaData objects
+
+Building a model's SQLAlchemy MetaData from its JSON is expensive for large
+models, so each (service, model, version) is built once and the same
+MetaData object is handed to every caller. Callers must treat it as
+read-only: attaching tables or mutating columns or constraints would affect
+every other user of the model.
+"""
+import threading
+import weakref
+from dmsa.cache import LRUCache
+
+MAX_MODELS = 32
+
+__MODELS = LRUCache(MAX_MODELS)
+# Build locks are held only while a build is wanted, so keys whose builds are
+# done (and later evicted) do not accumulate.
+__BUILD_LOCKS = weakref.WeakValueDictionary()
+__BUILD_LOCKS_LOCK = threading.Lock()
+
+
+def _build_lock(key):
+    with __BUILD_LOCKS_LOCK:
+        return __BUILD_LOCKS.setdefault(key, threading.Lock())
+
+
+def get_metadata(model, model_version, service, model_json=None):
+    """Return the shared, read-only MetaData for the model version
+
+    The model is built from the service's JSON on first use (or from
+    `model_json`, if given, instead of retrieving it). Concurrent callers
+    asking for the same model version wait for a single build.
+    """
+    key = (service, model, model_version)
+
+    metadata = __MODELS.get(key)
+    if metadata is not None:
+        return metadata
+
+    lock = _build_lock(key)
+    with lock:
+        if key in __MODELS:
+            return __MODELS.get(key)
+
+        from sqlalchemy import MetaData
+        from dmsa.makers import make_model_from_service
+
+        metadata = make_model_from_service(model, model_version, service,
+                                           MetaData(), model_json)
+        __MODELS.set(key, metadata)
+
+    return metadata
+
+
+def invalidate_metadata(service=None, model=None, model_version=None):
+    """Drop built models from the registry so they are rebuilt on next use
+
+    Each argument that is not None restricts which models are dropped; with
+    no arguments the whole registry is cleared.
+    """
+    for key in __MODELS.keys():
+        if ((service is None or key[0] == service) and
+                (model is None or key[1] == model) and
+                (model_version is None or key[2] == model_version)):
+            __MODELS.pop(key)
+
+
+def stats():
+    """Return a dict of registry hit/miss/eviction counts and usage"""
+    return __MODELS.stats()
@@ -0,0 +1,185 @@
+""" A single background thread that runs a task periodically and on demand
+
+Used by the web service to refresh the data models catalog. One long-lived
+thread runs every refresh, so the number of threads does not grow with the
+number of refreshes or webhook requests, and a refresh never overlaps
+another. Periodic runs are spread out with random jitter, and failed runs
+are retried with exponential backoff instead of ending the schedule.
+
+Callers keep using the results of the last successful run while a run is in
+flight or after one fails (the catalog, for example, is only replaced in the
+cache once it has been fetched).
+"""
+import atexit
+import logging
+import random
+import threading
+import time
+
+JITTER = 0.1  # fraction of the interval
+MIN_BACKOFF = 10  # seconds
+MAX_BACKOFF = 600  # seconds
+EXIT_TIMEOUT = 1  # seconds to wait for a run in progress at exit
+
+
+class Scheduler(object):
+    """Runs `task` in a background thread every `interval` seconds and
+    whenever triggered
+
+    Arguments:
+        task - function to call with no arguments
+        interval - seconds between runs, or None to only run when triggered
+        jitter - fraction of the interval by which to randomly vary it
+        min_backoff - seconds to wait before retrying after a first failure;
+            the wait doubles with every further consecutive failure
+        max_backoff - maximum seconds to wait before retrying
+        name - name of the thread
+    """
+
+    def __init__(self, task, interval=None, jitter=JITTER,
+                 min_backoff=MIN_BACKOFF, max_backoff=MAX_BACKOFF,
+                 name='dmsa-scheduler'):
+        self.task = task
+        self.interval = interval
+        self.jitter = jitter
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.name = name
+
+        self.last_success = None
+        self.last_failure = None
+        self.last_error = None
+        self.failures = 0
+        self.running = False
+        self.next_run = None
+
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+    def _jittered(self, delay):
+        return delay * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def start(self, delay=None):
+        """Start the scheduler thread, if not already started
+
+        Arguments:
+            delay - seconds until the first run (default: one interval, or
+                never if there is no interval)
+        """
+        with self._condition:
+            if self._thread is not None:
+                return
+            if delay is not None:
+                self.next_run = time.time() + delay
+            elif self.interval:
+                self.next_run = time.time() + self._jittered(self.interval)
+            self._stopped = False
+            self._thread = threading.Thread(target=self._run, name=self.name)
+            self._thread.daemon = True
+            self._thread.start()
+
+        # Stop the thread before the interpreter tears down the modules it
+        # uses.
+        atexit.register(self.stop, EXIT_TIMEOUT)
+
+    def trigger(self, delay=0):
+        """Run the task after `delay` seconds, or sooner if a run is already
+        scheduled sooner
+
+        A trigger received while the task is running makes it run again once
+        the delay has passed.
+        """
+        with self._condition:
+            run = time.time() + delay
+            if self.next_run is None or run < self.next_run:
+                self.next_run = run
+                self._condition.notify()
+
+    def stop(self, timeout=None):
+        """Stop the scheduler thread after any current run finishes"""
+        with self._condition:
+            self._stopped = True
+            thread, self._thread = self._thread, None
+            self._condition.notify()
+        if thread is not None:
+            thread.join(timeout)
+
+    def status(self):
+        """Return a dict describing the scheduler's state
+
+        Times are seconds since the epoch, or None.
+        """
+        with self._condition:
+            return {
+                'interval': self.interval,
+                'running': self.running,
+                'next_run': self.next_run,
+                'last_success': self.last_success,
+                'last_failure': self.last_failure,
+                'last_error': self.last_error,
+                'failures': self.failures
+            }
+
+    def _wait(self):
+        """Wait until the next run is due; return False if stopped"""
+        with self._condition:
+            while not self._stopped:
+                now = time.time()
+                if self.next_run is not None and self.next_run <= now:
+                    self.next_run = None
+                    self.running = True
+                    return True
+                # Wake up periodically so that clock changes are noticed.
+                timeout = 60 if self.next_run is None \
+                    else min(60, self.next_run - now)
+                self._condition.wait(timeout)
+            return False
+
+    def run(self):
+        """Run the task now in the calling thread, recording its outcome as
+        for a scheduled run; exceptions are raised to the caller"""
+        try:
+            self.task()
+        except Exception as e:
+            self._finished('{0}: {1}'.format(type(e).__name__, e))
+            raise
+        self._finished(None)
+
+    def _run(self):
+        while self._wait():
+
+            try:
+                self.task()
+            except Exception as e:
+                logging.exception('running scheduled {0}'.format(self.name))
+                error = '{0}: {1}'.format(type(e).__name__, e)
+            else:
+                error = None
+
+            self._finished(error)
+
+    def _finished(self, error):
+        """Record the outcome of a run and schedule the next one"""
+        now = time.time()
+
+        with self._condition:
+            self.running = False
+
+            if error is None:
+                self.last_success = now
+                self.failures = 0
+                delay = self.interval and self._jittered(self.interval)
+            else:
+                self.last_failure = now
+                self.last_error = error
+                self.failures += 1
+                delay = self._jittered(min(
+                    self.max_backoff,
+                    self.min_backoff * 2 ** (self.failures - 1)))
+
+            if delay:
+                run = now + delay
+                if self.next_run is None or run < self.next_run:
+                    self.next_run = run
+                    self._condition.notify()
@@ -1,52 +1,141 @@
+import mimetypes
 import os
-import threading
+import tempfile
+import time
 from flask import (Flask, Response, request, send_file, render_template,
-                   redirect, url_for, abort)
+                   redirect, url_for, abort, jsonify, g)
 from github_webhook import Webhook
-from dmsa import ddl, erd, __version__
+from dmsa import ddl, jobs, warm, __version__
 from dmsa.utility import (get_template_models, get_service_version,
-                          get_template_dialects, ReverseProxied, dmsa_version)
+                          get_template_dialects, ReverseProxied, dmsa_version,
+                          configure_session, cache_control)
+from dmsa.artifacts import artifact_key, get_artifact, set_artifact
+from dmsa.registry import invalidate_metadata
+from dmsa.scheduler import Scheduler
+from dmsa.metrics import Counter, Histogram
+import dmsa.artifacts
 import dmsa.cache
+import dmsa.metrics
+import dmsa.registry
 
 PERIODIC_REFRESH_DELAY = 3600  # seconds
 POST_HOOK_REFRESH_DELAY = 10
+STREAM_CHUNK_SIZE = 16 * 1024  # characters
+ERD_RETRY_AFTER = 2  # seconds
+ARTIFACT_MAX_AGE = 300  # seconds
+ERD_FORMATS = ('png', 'pdf', 'svg', 'dot')
+COMPRESSIBLE_ERD_FORMATS = ('svg', 'dot')  # png and pdf are compressed
 
 app = Flask('dmsa')
 app.wsgi_app = ReverseProxied(app.wsgi_app)
 dmsa.cache.set_cache_dir(app.instance_path)
+dmsa.artifacts.set_disk_cache(True)
 
 hmac_key = os.environ.get('DMSA_WEBHOOK_SECRET')
 webhook = Webhook(app, endpoint='/refresh', secret=hmac_key)
 
 
 def refresh_data_models_template():
-    """Retrieve the data models from the service and cache them"""
-    get_template_models(app.config['service'], force_refresh=True)
+    """Retrieve the data models from the service and cache them
 
+    Built models are dropped from the registry so that changes to the data
+    models are picked up, and then, if enabled, rebuilt in the background
+    along with the most requested DDL.
+    """
+    service = app.config['service']
+    models = get_template_models(service, force_refresh=True)
+    invalidate_metadata(service)
 
-def refresh_data_models_template_and_reschedule(delay=None):
-    """Refresh the data models summary data and optionally reschedule
+    default_variants = [(d['name'], 'ddl', 'all')
+                        for d in app.config['dialects']]
+    warm.start(service, models, warm.popular_variants(default_variants))
 
-    Arguments:
-        delay - delay in seconds (to reschedule), or None (to not reschedule)
-    """
-    refresh_data_models_template()
-    if delay:
-            schedule_data_models_template_refresh(delay, reschedule=True)
+
+scheduler = Scheduler(refresh_data_models_template, name='dmsa-refresh')
+
+REQUESTS = Counter('dmsa_requests_total', 'Requests handled, by route.',
+                   labels=('route', 'method', 'status'))
+REQUEST_SECONDS = Histogram('dmsa_request_seconds',
+                            'Time spent handling requests, by route, until '
+                            'the response starts (streamed DDL continues '
+                            'after).',
+                            labels=('route',))
+
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.time()
+
+
+@app.after_request
+def record_request_metrics(resp):
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    REQUESTS.inc(route=route, method=request.method,
+                 status=str(resp.status_code))
+    if 'request_start' in g:
+        REQUEST_SECONDS.observe(time.time() - g.request_start, route=route)
+    return resp
 
 
-def schedule_data_models_template_refresh(delay, reschedule=False):
+def collect_metrics():
+    """Return cache and refresh scheduler metrics for /metrics"""
+    artifacts = dmsa.artifacts.stats()
+    memory = artifacts['memory']
+    cache = dmsa.cache.stats()
+    registry = dmsa.registry.stats()
+    refresh = scheduler.status()
+
+    return [
+        ('dmsa_cache_hits_total', 'counter', 'Cache lookups that hit.', [
+            ({'cache': 'artifacts_memory'}, memory['hits']),
+            ({'cache': 'artifacts_disk'}, artifacts['disk_hits']),
+            ({'cache': 'disk'}, cache['hits']),
+            ({'cache': 'disk_memo'}, cache['memo_hits']),
+            ({'cache': 'registry'}, registry['hits'])]),
+        ('dmsa_cache_misses_total', 'counter', 'Cache lookups that missed.', [
+            ({'cache': 'artifacts_memory'}, memory['misses']),
+            ({'cache': 'artifacts_disk'}, artifacts['disk_misses']),
+            ({'cache': 'disk'}, cache['misses']),
+            ({'cache': 'registry'}, registry['misses'])]),
+        ('dmsa_cache_evictions_total', 'counter',
+         'Entries evicted from caches to bound their size.',
+         [({'cache': 'artifacts_memory'}, memory['evictions']),
+          ({'cache': 'artifacts_disk'}, artifacts['disk_evictions']),
+          ({'cache': 'registry'}, registry['evictions'])]),
+        ('dmsa_cache_size', 'gauge',
+         'Size of in-memory caches (characters for artifacts, models for '
+         'the registry).',
+         [({'cache': 'artifacts_memory'}, memory['size']),
+          ({'cache': 'registry'}, registry['size'])]),
+        ('dmsa_refresh_last_success_timestamp_seconds', 'gauge',
+         'Time of the last successful catalog refresh.',
+         [({}, refresh['last_success'])]),
+        ('dmsa_refresh_last_failure_timestamp_seconds', 'gauge',
+         'Time of the last failed catalog refresh.',
+         [({}, refresh['last_failure'])]),
+        ('dmsa_refresh_consecutive_failures', 'gauge',
+         'Catalog refreshes that failed since the last success.',
+         [({}, refresh['failures'])]),
+        ('dmsa_refresh_running', 'gauge',
+         'Whether a catalog refresh is in flight.',
+         [({}, int(refresh['running']))])
+    ]
+
+
+dmsa.metrics.register_collector(collect_metrics)
+
+
+def schedule_data_models_template_refresh(delay):
     """Refresh the data models summary data after a delay in seconds
 
+    The refresh runs in the scheduler thread, which keeps serving the
+    previously cached data until the refresh succeeds.
+
     Arguments:
         delay - delay in seconds
-        reschedule - whether to reschedule another refresh afterwards
     """
-    t = threading.Timer(delay,
-                        refresh_data_models_template_and_reschedule,
-                        args=[delay if reschedule else None]
-                        )
-    t.start()
+    scheduler.start()
+    scheduler.trigger(delay)
 
 
 @webhook.hook(event_type='push')
@@ -73,9 +162,9 @@ def model_route(model_name):
     return render_template('model.html', model=model)
 
 
-@app.route('/<model_name>/<version_name>/')
-@dmsa_version
-def version_route(model_name, version_name):
+def find_model_version(model_name, version_name):
+    """Return the catalog's model and version, aborting with 404 Not Found
+    if either is not in the catalog"""
 
     for model in get_template_models(app.config['service']):
         if model['name'] == model_name:
@@ -89,82 +178,180 @@ def version_route(model_name, version_name):
     else:
         abort(404)
 
-    return render_template('version.html', model=model, version=version,
-                           dialects=app.config['dialects'])
+    return model, version
 
 
-@app.route('/<model>/<version>/ddl/<dialect>/', defaults={'elements': 'all'})
-@app.route('/<model>/<version>/ddl/<dialect>/<elements>/')
+@app.route('/<model_name>/<version_name>/')
 @dmsa_version
-def ddl_route(model, version, dialect, elements):
-
-    tables, constraints, indexes = False, False, False
+def version_route(model_name, version_name):
 
-    if elements in ['tables', 'all']:
-        tables = True
+    model, version = find_model_version(model_name, version_name)
 
-    if elements in ['constraints', 'all']:
-        constraints = True
+    return render_template('version.html', model=model, version=version,
+                           dialects=app.config['dialects'])
 
-    if elements in ['indexes', 'all']:
-        indexes = True
 
-    ddl_str = ddl.generate(model, version, dialect, tables=tables,
-                           constraints=constraints, indexes=indexes,
-                           service=app.config['service'])
+def stream_and_cache(key, statements, done=None):
+    """Yield the statements joined into chunks of about STREAM_CHUNK_SIZE,
+    and cache the whole script under `key` once all of it has been sent
 
-    resp = Response(ddl_str, status='200 OK', mimetype='text/plain')
+    If given, `done` is called with no arguments after that.
+    """
+    sent = []
+    chunk = []
+    chunk_size = 0
+
+    for statement in statements:
+        chunk.append(statement)
+        chunk_size += len(statement)
+        if chunk_size >= STREAM_CHUNK_SIZE:
+            data = ''.join(chunk)
+            sent.append(data)
+            yield data
+            chunk = []
+            chunk_size = 0
+
+    data = ''.join(chunk)
+    sent.append(data)
+    yield data
+
+    set_artifact(key, ''.join(sent))
+
+    if done is not None:
+        done()
+
+
+def ddl_response(model, version, dialect, operation, elements='all'):
+    """Return a plain text response holding the generated DDL, using the
+    artifact cache
+
+    The artifact key is the response's ETag, so a request whose
+    If-None-Match matches it is answered 304 Not Modified without
+    generating anything. On a cache miss, the DDL is streamed to the client
+    as it is generated, once the parts of it most likely to fail have been
+    compiled (see ddl.iter_generate), so that those errors are answered 500
+    rather than with a truncated script. Cached DDL is sent compressed if
+    the client accepts it, with the compressed form cached beside the DDL.
 
-    return resp
+    Arguments:
+        operation - one of 'ddl', 'drop', 'delete', 'logging' or 'nologging'
+        elements - one of 'tables', 'constraints', 'indexes' or 'all'
+    """
+    # Only catalog model versions and supported dialects and elements are
+    # generated, so that arbitrary URLs cannot fill the caches.
+    find_model_version(model, version)
+    if dialect not in [d['name'] for d in app.config['dialects']] or \
+            elements not in ddl.ELEMENTS:
+        abort(404)
 
+    service = app.config['service']
+    key = artifact_key(model, version, dialect, operation, elements,
+                       get_service_version(service))
+
+    # Count the variant only once it has been served, so that failed
+    # requests do not affect what is warmed.
+    def record():
+        warm.record_request(dialect, operation, elements)
+
+    encoding = request.accept_encodings.best_match(
+        dmsa.artifacts.encodings())
+
+    # Every encoding of the script has the same content, so a client holding
+    # any of them has an up to date copy.
+    for etag in [key] + ['{0}-{1}'.format(key, e)
+                         for e in dmsa.artifacts.encodings()]:
+        if etag in request.if_none_match:
+            resp = Response(status=304)
+            resp.set_etag(etag)
+            resp.vary.add('Accept-Encoding')
+            record()
+            return resp
+
+    data = encoding and dmsa.artifacts.get_encoded_artifact(key, encoding)
+
+    if data is not None:
+        resp = Response(data, status='200 OK', mimetype='text/plain')
+        resp.content_encoding = encoding
+        resp.set_etag('{0}-{1}'.format(key, encoding))
+        record()
 
-@app.route('/<model>/<version>/drop/<dialect>/', defaults={'elements': 'all'})
-@app.route('/<model>/<version>/drop/<dialect>/<elements>/')
-@dmsa_version
-def drop_route(model, version, dialect, elements):
+    else:
+        ddl_str = get_artifact(key)
 
-    tables, constraints, indexes = False, False, False
+        if ddl_str is None:
 
-    if elements in ['tables', 'all']:
-        tables = True
+            # Stream uncompressed; later requests get the compressed form.
+            statements = ddl.iter_generate(model, version, dialect,
+                                           service=service,
+                                           **ddl.operation_kwargs(operation,
+                                                                  elements))
 
-    if elements in ['constraints', 'all']:
-        constraints = True
+            resp = Response(stream_and_cache(key, statements, record),
+                            status='200 OK', mimetype='text/plain')
 
-    if elements in ['indexes', 'all']:
-        indexes = True
+        else:
+            resp = Response(ddl_str, status='200 OK', mimetype='text/plain')
+            record()
 
-    ddl_str = ddl.generate(model, version, dialect, tables=tables,
-                           constraints=constraints, indexes=indexes,
-                           drop=True, service=app.config['service'])
+        resp.set_etag(key)
 
-    resp = Response(ddl_str, status='200 OK', mimetype='text/plain')
+    resp.vary.add('Accept-Encoding')
 
     return resp
 
 
+@app.route('/<model>/<version>/ddl/<dialect>/', defaults={'elements': 'all'})
+@app.route('/<model>/<version>/ddl/<dialect>/<elements>/')
+@dmsa_version
+@cache_control(ARTIFACT_MAX_AGE)
+def ddl_route(model, version, dialect, elements):
+    return ddl_response(model, version, dialect, 'ddl', elements)
+
+
+@app.route('/<model>/<version>/drop/<dialect>/', defaults={'elements': 'all'})
+@app.route('/<model>/<version>/drop/<dialect>/<elements>/')
+@dmsa_version
+@cache_control(ARTIFACT_MAX_AGE)
+def drop_route(model, version, dialect, elements):
+    return ddl_response(model, version, dialect, 'drop', elements)
+
+
 @app.route('/<model>/<version>/delete/<dialect>/')
 @dmsa_version
+@cache_control(ARTIFACT_MAX_AGE)
 def delete_route(model, version, dialect):
+    return ddl_response(model, version, dialect, 'delete')
 
-    ddl_str = ddl.generate(model, version, dialect, delete_data=True,
-                           service=app.config['service'])
-
-    resp = Response(ddl_str, status='200 OK', mimetype='text/plain')
 
+def erd_job_response(status, url, status_code):
+    """Return a JSON response describing an ERD job"""
+    resp = jsonify(status=status, url=url)
+    resp.status_code = status_code
+    if status_code in (202, 503):
+        resp.headers['Retry-After'] = str(ERD_RETRY_AFTER)
     return resp
 
 
 @app.route('/<model>/<version>/erd/')
 @dmsa_version
 def create_erd_route(model, version):
+    """Redirect to the ERD if it has been rendered; otherwise queue it for
+    rendering and answer 202 Accepted with its URL"""
+
+    # Only catalog model versions are rendered, in supported formats, so
+    # that arbitrary URLs cannot occupy the render workers.
+    find_model_version(model, version)
 
     ext = request.args.get('format') or 'png'
+    if ext not in ERD_FORMATS:
+        abort(400)
 
     filename = '{0}_{1}_dms_{2}_dmsa_{3}.{4}'.format(
         model, version, get_service_version(app.config['service']), __version__,
         ext)
     filepath = '/'.join([app.instance_path, filename])
+    erd_url = url_for('erd_route', model=model, version=version,
+                      filename=filename)
 
     try:
         os.makedirs(app.instance_path)
@@ -172,88 +359,164 @@ def create_erd_route(model, version):
         pass
 
     try:
-        erd.write(model, version, filepath, app.config['service'])
+        import eralchemy  # noqa
     except ImportError:
         return render_template('erd_500.html'), 500
 
-    return redirect(url_for('erd_route', model=model, version=version,
-                            filename=filename))
+    try:
+        ready = jobs.submit_erd(model, version, filepath,
+                                app.config['service'])
+    except jobs.QueueFull:
+        return erd_job_response('busy', erd_url, 503)
+
+    if ready:
+        return redirect(erd_url)
+
+    if jobs.erd_status(filepath) == jobs.FAILED:
+        return erd_job_response(jobs.FAILED, erd_url, 500)
+
+    resp = erd_job_response(jobs.PENDING, erd_url, 202)
+    resp.headers['Location'] = erd_url
+    return resp
+
+
+def gzipped_file(filepath):
+    """Return the path name of a gzipped copy of the file, creating it if
+    necessary"""
+    gz_filepath = filepath + '.gz'
+
+    if not os.path.exists(gz_filepath):
+        with open(filepath, 'rb') as f:
+            data = dmsa.artifacts.compress(f.read(), 'gzip')
+        fd, tmp_filepath = tempfile.mkstemp(
+            dir=os.path.dirname(filepath), prefix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.rename(tmp_filepath, gz_filepath)
+
+    return gz_filepath
 
 
 @app.route('/<model>/<version>/erd/<filename>')
 @dmsa_version
+@cache_control(ARTIFACT_MAX_AGE)
 def erd_route(model, version, filename):
-    """Serve the file generated by create_erd_route (/<model>/<version>/erd)"""
+    """Serve the file generated by create_erd_route (/<model>/<version>/erd),
+    or its job status while it is being rendered
+
+    The file is served with ETag and Last-Modified headers and conditional
+    requests are answered 304 Not Modified. Text formats are sent gzipped
+    if the client accepts it.
+    """
+    find_model_version(model, version)
+    if filename.rsplit('.', 1)[-1] not in ERD_FORMATS:
+        abort(404)
+
     filepath = '/'.join([app.instance_path, filename])
 
-    return send_file(filepath)
+    status = jobs.erd_status(filepath)
 
+    if status == 'ready':
 
-@app.route('/<model>/<version>/logging/oracle/', defaults={'elements': 'all'})
-@app.route('/<model>/<version>/logging/oracle/<elements>/')
-@dmsa_version
-def logging_route(model, version, elements):
+        if (filename.rsplit('.', 1)[-1] in COMPRESSIBLE_ERD_FORMATS and
+                request.accept_encodings.best_match(['gzip'])):
+            resp = send_file(gzipped_file(filepath),
+                             mimetype=mimetypes.guess_type(filename)[0],
+                             conditional=True)
+            resp.content_encoding = 'gzip'
+        else:
+            resp = send_file(filepath, conditional=True)
 
-    tables, constraints, indexes = False, False, False
+        resp.vary.add('Accept-Encoding')
+        return resp
 
-    if elements in ['tables', 'all']:
-        tables = True
+    erd_url = url_for('erd_route', model=model, version=version,
+                      filename=filename)
 
-    if elements in ['constraints', 'all']:
-        constraints = True
+    if status == jobs.PENDING:
+        return erd_job_response(status, erd_url, 202)
 
-    if elements in ['indexes', 'all']:
-        indexes = True
+    if status == jobs.FAILED:
+        return erd_job_response(status, erd_url, 500)
 
-    ddl_str = ddl.generate(model, version, 'oracle', tables=tables,
-                           constraints=constraints, indexes=indexes,
-                           logging=True, service=app.config['service'])
+    abort(404)
 
-    resp = Response(ddl_str, status='200 OK', mimetype='text/plain')
 
-    return resp
+@app.route('/<model>/<version>/logging/oracle/', defaults={'elements': 'all'})
+@app.route('/<model>/<version>/logging/oracle/<elements>/')
+@dmsa_version
+@cache_control(ARTIFACT_MAX_AGE)
+def logging_route(model, version, elements):
+    return ddl_response(model, version, 'oracle', 'logging', elements)
 
 
 @app.route('/<model>/<version>/nologging/oracle/',
            defaults={'elements': 'all'})
 @app.route('/<model>/<version>/nologging/oracle/<elements>/')
 @dmsa_version
+@cache_control(ARTIFACT_MAX_AGE)
 def nologging_route(model, version, elements):
+    return ddl_response(model, version, 'oracle', 'nologging', elements)
 
-    tables, constraints, indexes = False, False, False
 
-    if elements in ['tables', 'all']:
-        tables = True
+@app.route('/metrics')
+def metrics_route():
+    """Report metrics in the Prometheus text exposition format"""
+    return Response(dmsa.metrics.render(),
+                    content_type='text/plain; version=0.0.4; charset=utf-8')
 
-    if elements in ['constraints', 'all']:
-        constraints = True
 
-    if elements in ['indexes', 'all']:
-        indexes = True
-
-    ddl_str = ddl.generate(model, version, 'oracle', tables=tables,
-                           constraints=constraints, indexes=indexes,
-                           nologging=True, service=app.config['service'])
-
-    resp = Response(ddl_str, status='200 OK', mimetype='text/plain')
-
-    return resp
+@app.route('/_stats/')
+@dmsa_version
+def stats_route():
+    """Report artifact and disk cache statistics, for sizing the caches, and
+    the state of the catalog refresh scheduler and cache warming"""
+    return jsonify(artifacts=dmsa.artifacts.stats(),
+                   cache=dmsa.cache.stats(),
+                   refresh=scheduler.status(),
+                   warm=warm.stats())
 
 
-def build_app(service, refresh_interval=PERIODIC_REFRESH_DELAY):
+def build_app(service, refresh_interval=PERIODIC_REFRESH_DELAY,
+              service_timeout=None, erd_workers=None, warm_workers=None):
     """Builds and returns a web app that exposes DDL and ERD.
 
     Arguments:
       service - Base URL of the data models service to use.
       refresh_interval - Number of seconds between refreshes of model summaries.
-          To disable periodic refreshes, set to None.
+          To disable periodic refreshes, set to None. Failed refreshes are
+          retried with exponential backoff.
+      service_timeout - Seconds to wait for the data models service, either a
+          number or a (connect, read) tuple. None keeps the default.
+      erd_workers - Number of processes to render ERDs in, or 0 to render
+          them in the request. None keeps the default.
+      warm_workers - Number of threads to pre-build models and DDL in after
+          each refresh, or 0 to not pre-build. None keeps the default (0).
     """  # noqa
 
+    # Start the ERD workers first, before the scheduler and warm-up threads
+    # exist, so they are not forked while another thread holds a lock.
+    jobs.configure(workers=erd_workers)
+    jobs.start()
+
+    if warm_workers is not None:
+        warm.configure(warm_workers)
+
+    if service_timeout is not None:
+        configure_session(timeout=service_timeout)
+
     app.config['service'] = service
     app.config['dialects'] = get_template_dialects()
 
-    # Cache the data models from the data models service
+    # Cache the data models from the data models service, unless already
+    # cached (in which case the cached data is served while it is refreshed),
     # and refresh periodically.
-    refresh_data_models_template_and_reschedule(delay=refresh_interval)
+    scheduler.interval = refresh_interval
+    if dmsa.cache.get_cache() is None:
+        scheduler.run()
+        scheduler.start()
+    else:
+        scheduler.start()
+        scheduler.trigger()
 
     return app
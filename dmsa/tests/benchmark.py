@@ -0,0 +1,413 @@
+"""dmsa benchmarks
+
+Times building models, generating DDL in every dialect and mode (`ddl`
+compiles the whole script, `ddl_warm` reuses the sections compiled before, as
+repeated requests for a model version do), rendering ERDs, serving the main web service routes and running `dmsa` commands from
+process start (so including imports), entirely offline: models come
+from fixture JSON files and synthetic models instead of the data models
+service. Results are saved as JSON so that runs can be compared.
+
+Fixtures are model JSON files as served by the data models service, stored
+as `schemata/<model>/<model_version>.json` in the fixtures directory
+(default: `fixtures/` beside this script); `fetch` saves one from a service.
+Synthetic models of the given sizes (in tables, of 20 fields each) are always
+included. All models are served to dmsa through a `file://` service URL (see
+dmsa.fileservice), so no time is spent on the network.
+
+The checked-in fixtures are trimmed snapshots of OMOP 5.0.0, PEDSnet 2.0.0,
+PCORnet 3.0.0 and i2b2 1.7.0: the core tables of each model with their keys,
+not null constraints and indexes, transcribed from the published
+specifications. They are not the service's JSON for those versions, so
+compare their numbers only with other runs on the same fixtures; models
+fetched into another fixtures directory can be benchmarked with --fixtures.
+
+Dialects SQLAlchemy does not support, and ERDs if ERAlchemy is not
+installed, are skipped.
+
+Usage:
+  benchmark.py run [--fixtures=DIR] [--synthetic=SIZES] [--repeat=N] [--dialects=DIALECTS] [--no-erd] [--no-service] [-o FILE]
+  benchmark.py compare [--threshold=PERCENT] <baseline> <results>
+  benchmark.py fetch [--service=URL] [--fixtures=DIR] <model> <model_version>
+  benchmark.py (-h | --help)
+
+Options:
+  -h --help            Show this usage message.
+  --fixtures=DIR       Directory of fixture model JSON files.
+  --synthetic=SIZES    Comma-separated numbers of tables of synthetic models
+                       [default: 50,500].
+  --repeat=N           Number of times to repeat each measurement; the
+                       median is reported [default: 5].
+  --dialects=DIALECTS  Comma-separated dialects (default: all supported).
+  --no-erd             Do not benchmark ERD rendering.
+  --no-service         Do not benchmark the web service.
+  -o --output=FILE     File to save results to (default:
+                       benchmark_<dmsa version>_<time>.json).
+  --threshold=PERCENT  Report benchmarks whose median changed by more than
+                       PERCENT [default: 10].
+  --service=URL        Base URL of the data models service to fetch from
+                       [default: https://data-models-service.research.chop.edu/].
+"""  # noqa
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'fixtures')
+SERVICE_VERSION = 'benchmark'
+SYNTHETIC_FIELDS = 20
+SERVICE_REQUESTS = 200
+MODES = [('ddl', 'all'), ('ddl', 'tables'), ('ddl', 'constraints'),
+         ('ddl', 'indexes'), ('drop', 'all'), ('delete', 'all'),
+         ('logging', 'all'), ('nologging', 'all')]
+
+
+def load_models(fixtures_dir, sizes):
+    """Return an ordered list of ((model, version), model JSON)"""
+    from dmsa.fileservice import catalog, model_pathname
+    from dmsa.tests.synthetic import synthetic_model
+
+    models = []
+
+    for entry in catalog(fixtures_dir):
+        model, version = entry['name'], entry['version']
+        with open(model_pathname(fixtures_dir, model, version)) as f:
+            models.append(((model, version), json.load(f)))
+
+    for size in sizes:
+        models.append((('synthetic', str(size)),
+                       synthetic_model(size, SYNTHETIC_FIELDS, varied=True)))
+
+    return models
+
+
+def make_service(models, directory):
+    """Write `models` to a service directory; return its service URL"""
+    from dmsa.fileservice import service_url, write_model
+
+    for (model, version), model_json in models:
+        write_model(directory, model, version, model_json)
+    with open(os.path.join(directory, 'VERSION'), 'w') as f:
+        f.write(SERVICE_VERSION)
+
+    return service_url(directory)
+
+
+def measure(func, repeat, setup=None):
+    """Call func `repeat` times; return the sorted durations in seconds
+
+    If given, `setup` is called, untimed, before each call.
+    """
+    times = []
+    for i in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.time()
+        func()
+        times.append(time.time() - start)
+    return sorted(times)
+
+
+def result(name, times, **params):
+    return dict(params, name=name, runs=len(times), min=times[0],
+                median=times[len(times) // 2],
+                mean=sum(times) / len(times))
+
+
+def dialect_available(dialect):
+    from sqlalchemy.exc import NoSuchModuleError
+    from dmsa.ddl import get_dialect
+    try:
+        get_dialect(dialect)
+    except (ImportError, NoSuchModuleError):
+        return False
+    return True
+
+
+def bench_make_model(models, repeat):
+    from sqlalchemy import MetaData
+    from dmsa.makers import make_model
+
+    for (model, version), model_json in models:
+        yield result('make_model',
+                     measure(lambda: make_model(model_json, MetaData()),
+                             repeat),
+                     model=model, version=version)
+
+
+def bench_ddl(models, service, dialects, repeat):
+    from dmsa import ddl
+    from dmsa.registry import get_metadata
+
+    for (model, version), model_json in models:
+
+        # Time compilation only; building is measured by make_model.
+        metadata = get_metadata(model, version, service)
+
+        def forget_sections():
+            metadata.info.pop('dmsa_sections', None)
+
+        for dialect in dialects:
+            for operation, elements in MODES:
+                if operation in ('logging', 'nologging') and \
+                        dialect != 'oracle':
+                    continue
+                kwargs = ddl.operation_kwargs(operation, elements)
+
+                def generate():
+                    ddl.generate(model, version, dialect, service=service,
+                                 **kwargs)
+
+                # 'ddl' compiles every section of the script each time;
+                # 'ddl_warm' composes it from the sections compiled before.
+                for name, setup in [('ddl', forget_sections),
+                                    ('ddl_warm', None)]:
+                    yield result(name, measure(generate, repeat, setup),
+                                 model=model, version=version,
+                                 dialect=dialect, operation=operation,
+                                 elements=elements)
+
+
+def bench_erd(models, service, repeat):
+    from dmsa import erd
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        for (model, version), model_json in models:
+            output = os.path.join(tmp_dir, 'erd.png')
+            yield result('erd', measure(
+                lambda: erd.write(model, version, output, service), repeat),
+                model=model, version=version)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def bench_cli(models, service, dialects, repeat):
+    # Run in a fresh interpreter, so that imports are included.
+    dialect = 'postgresql' if 'postgresql' in dialects else dialects[0]
+    (model, version), model_json = models[0]
+
+    root = os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))))
+    env = dict(os.environ, PYTHONPATH=root)
+
+    tmp_dir = tempfile.mkdtemp()
+    output = os.path.join(tmp_dir, 'ddl.sql')
+    commands = [('version', ['--version'], {}),
+                ('ddl', ['ddl', '--service=' + service, '-o', output, model,
+                         version, dialect],
+                 {'model': model, 'version': version, 'dialect': dialect})]
+
+    try:
+        with open(os.devnull, 'w') as devnull:
+            for command, args, params in commands:
+
+                def call():
+                    subprocess.check_call(
+                        [sys.executable, '-c',
+                         'from dmsa.main import main; main()'] + args,
+                        cwd=tmp_dir, env=env, stdout=devnull)
+
+                yield result('cli', measure(call, repeat), command=command,
+                             **params)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def bench_service(models, service_url, dialects, repeat):
+    import dmsa.artifacts
+    import dmsa.cache
+    from dmsa import service
+
+    tmp_dir = tempfile.mkdtemp()
+    service.app.instance_path = tmp_dir
+    dmsa.cache.set_cache_dir(tmp_dir)
+
+    try:
+        app = service.build_app(service_url, refresh_interval=None)
+        client = app.test_client()
+
+        (model, version), model_json = models[0]
+        routes = [('index', '/'), ('model', '/{0}/'.format(model)),
+                  ('version', '/{0}/{1}/'.format(model, version))]
+        routes.extend(('ddl', '/{0}/{1}/ddl/{2}/'.format(model, version, d))
+                      for d in dialects)
+
+        for route, url in routes:
+
+            def get():
+                r = client.get(url)
+                r.get_data()
+                if r.status_code != 200:
+                    raise AssertionError('{0} returned {1}'.format(
+                        url, r.status_code))
+
+            # The first DDL request generates and caches the script; the
+            # rest measure serving it.
+            get()
+
+            times = measure(lambda: [get() for i in range(SERVICE_REQUESTS)],
+                            repeat)
+            r = result('service', times, route=route, url=url,
+                       requests=SERVICE_REQUESTS)
+            r['requests_per_second'] = SERVICE_REQUESTS / r['median']
+            yield r
+
+    finally:
+        service.scheduler.stop()
+        dmsa.artifacts.clear_artifacts()
+        dmsa.cache.set_cache_dir(None)
+        shutil.rmtree(tmp_dir)
+
+
+def environment():
+    import sqlalchemy
+    from dmsa import __version__
+    return {
+        'dmsa_version': __version__,
+        'python_version': platform.python_version(),
+        'sqlalchemy_version': sqlalchemy.__version__,
+        'platform': platform.platform(),
+        'time': datetime.datetime.utcnow().isoformat() + 'Z'
+    }
+
+
+def run(fixtures_dir, sizes, repeat, dialects=None, erd=True, service=True,
+        log=None):
+    """Run the benchmarks; return the results document"""
+    from dmsa.utility import PRETTY_DIALECTS
+
+    import dmsa.cache
+
+    models = load_models(fixtures_dir, sizes)
+
+    if dialects is None:
+        dialects = sorted(PRETTY_DIALECTS)
+
+    skipped = [d for d in dialects if not dialect_available(d)]
+    dialects = [d for d in dialects if d not in skipped]
+
+    if erd:
+        try:
+            import eralchemy  # noqa
+        except ImportError:
+            skipped.append('erd')
+            erd = False
+
+    tmp_dir = tempfile.mkdtemp()
+    dmsa.cache.set_cache_dir(tmp_dir)
+
+    try:
+        service_url = make_service(models, os.path.join(tmp_dir, 'service'))
+
+        benchmarks = [bench_make_model(models, repeat),
+                      bench_ddl(models, service_url, dialects, repeat)]
+        if erd:
+            benchmarks.append(bench_erd(models, service_url, repeat))
+        if service:
+            benchmarks.append(bench_service(models, service_url, dialects,
+                                            repeat))
+        benchmarks.append(bench_cli(models, service_url, dialects, repeat))
+
+        results = []
+        for benchmark in benchmarks:
+            for r in benchmark:
+                if log:
+                    log.write('{0:<60} {1:10.4f}s\n'.format(_label(r),
+                                                            r['median']))
+                results.append(r)
+
+    finally:
+        dmsa.cache.set_cache_dir(None)
+        shutil.rmtree(tmp_dir)
+
+    return {'environment': environment(), 'skipped': skipped,
+            'models': [list(m) for m, j in models], 'results': results}
+
+
+def _label(r):
+    params = [r.get(k) for k in ['command', 'model', 'version', 'dialect',
+                                 'operation', 'elements', 'url']]
+    return ' '.join([r['name']] + [p for p in params if p])
+
+
+def compare(baseline, results, threshold):
+    """Return lines describing benchmarks whose median changed by more than
+    threshold percent, and whether any got slower"""
+    old = dict((_label(r), r) for r in baseline['results'])
+    lines = []
+    slower = False
+
+    for r in results['results']:
+        label = _label(r)
+        if label not in old:
+            continue
+        change = 100 * (r['median'] / old[label]['median'] - 1)
+        if abs(change) > threshold:
+            slower = slower or change > 0
+            lines.append('{0:<60} {1:10.4f}s -> {2:10.4f}s {3:+7.1f}%'.format(
+                label, old[label]['median'], r['median'], change))
+
+    return lines, slower
+
+
+def fetch(service, fixtures_dir, model, model_version):
+    """Save a model's JSON from the service as a fixture"""
+    import requests
+    from dmsa.fileservice import write_model
+
+    url = ''.join([service, 'schemata/', model, '/', model_version,
+                   '?format=json'])
+    r = requests.get(url)
+    r.raise_for_status()
+
+    return write_model(fixtures_dir, model, model_version, r.json())
+
+
+def main():
+    from docopt import docopt
+    from dmsa import __version__
+
+    args = docopt(__doc__)
+    fixtures_dir = args['--fixtures'] or FIXTURES_DIR
+
+    if args['run']:
+        sizes = [int(s) for s in args['--synthetic'].split(',') if s.strip()]
+        dialects = args['--dialects'] and \
+            [d.strip() for d in args['--dialects'].split(',')]
+        results = run(fixtures_dir, sizes, int(args['--repeat']), dialects,
+                      erd=not args['--no-erd'],
+                      service=not args['--no-service'], log=sys.stderr)
+
+        output = args['--output'] or 'benchmark_{0}_{1}.json'.format(
+            __version__, datetime.datetime.now().strftime('%Y%m%d%H%M%S'))
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        if results['skipped']:
+            sys.stderr.write('skipped: {0}\n'.format(
+                ', '.join(results['skipped'])))
+        sys.stderr.write('results saved to {0}\n'.format(output))
+
+    elif args['compare']:
+        with open(args['<baseline>']) as f:
+            baseline = json.load(f)
+        with open(args['<results>']) as f:
+            results = json.load(f)
+        lines, slower = compare(baseline, results,
+                                float(args['--threshold']))
+        for line in lines:
+            print(line)
+        sys.exit(1 if slower else 0)
+
+    elif args['fetch']:
+        print(fetch(args['--service'], fixtures_dir, args['<model>'],
+                    args['<model_version>']))
+
+
+if __name__ == '__main__':
+    main()
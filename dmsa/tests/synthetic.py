@@ -0,0 +1,96 @@
+from __future__ import unicode_literals
+
+import random
+
+# Generates model JSON in the data models service's format, for tests and
+# benchmarks that must not depend on the service.
+
+FIELD_TYPES = ['integer', 'string', 'decimal', 'date']
+ALL_FIELD_TYPES = ['integer', 'number', 'decimal', 'float', 'string', 'date',
+                   'datetime', 'timestamp', 'time', 'text', 'clob', 'blob',
+                   'biginteger']
+
+
+def synthetic_model(n_tables, n_fields=50, varied=False, seed=0):
+    """Return model JSON with n_tables tables of n_fields fields each
+
+    Every field is not null, every table has a primary key and an index, and
+    every table but the first has a foreign key to the previous one.
+
+    Arguments:
+        varied - also use every field type, string lengths, decimal
+            precisions, defaults, unique constraints and multi-field
+            indexes, chosen randomly (but repeatably, from `seed`)
+    """
+    rnd = random.Random(seed)
+
+    tables = []
+    not_nulls = []
+    primary_keys = []
+    foreign_keys = []
+    uniques = []
+    indexes = []
+
+    for i in range(n_tables):
+
+        table_name = 'table_{0}'.format(i)
+        fields = []
+
+        for j in range(n_fields):
+
+            if varied and j > 4:
+                field = {'name': 'field_{0}'.format(j),
+                         'type': rnd.choice(ALL_FIELD_TYPES)}
+                if field['type'] == 'string' and rnd.random() < 0.5:
+                    field['length'] = rnd.randint(1, 4000)
+                if field['type'] == 'decimal' and rnd.random() < 0.5:
+                    field['precision'] = 20
+                    field['scale'] = rnd.randint(0, 10)
+                if rnd.random() < 0.1:
+                    field['default'] = '0'
+            else:
+                field = {'name': 'field_{0}'.format(j),
+                         'type': FIELD_TYPES[j % 4]}
+
+            fields.append(field)
+
+        tables.append({'name': table_name, 'fields': fields})
+
+        for field in fields:
+            not_nulls.append({'table': table_name, 'field': field['name']})
+
+        primary_keys.append({'table': table_name, 'fields': ['field_0']})
+        indexes.append({'table': table_name, 'fields': ['field_1']})
+
+        if i:
+            foreign_keys.append({'source_table': table_name,
+                                 'source_field': 'field_4',
+                                 'target_table': 'table_{0}'.format(i - 1),
+                                 'target_field': 'field_0'})
+
+        if varied:
+            primary_keys[-1]['name'] = 'pk_{0}'.format(table_name)
+            indexes[-1]['name'] = 'idx_{0}_1'.format(table_name)
+            if i:
+                foreign_keys[-1]['name'] = 'fk_{0}'.format(table_name)
+            if rnd.random() < 0.3:
+                uniques.append({'name': 'uq_{0}'.format(table_name),
+                                'table': table_name,
+                                'fields': ['field_2', 'field_3']})
+            if rnd.random() < 0.5:
+                indexes.append({'name': 'idx_{0}_2'.format(table_name),
+                                'table': table_name,
+                                'fields': ['field_2', 'field_3']})
+
+    return {
+        'schema': {
+            'constraints': {
+                'not_null': not_nulls,
+                'primary_keys': primary_keys,
+                'foreign_keys': foreign_keys,
+                'uniques': uniques
+            },
+            'indexes': indexes
+        },
+        'tables': tables
+    }
@@ -0,0 +1,47 @@
+import shutil
+import tempfile
+from sqlalchemy import MetaData
+from nose.tools import eq_, raises, with_setup
+from dmsa import amake_model_from_service
+from dmsa.fileservice import service_url, write_model
+from dmsa.tests.synthetic import synthetic_model
+from dmsa.utility import aget_models_json
+
+TEMP_DIR = None
+
+
+def setup_dir():
+    global TEMP_DIR
+    TEMP_DIR = tempfile.mkdtemp()
+    for n_tables in range(1, 21):
+        write_model(TEMP_DIR, 'synthetic', str(n_tables),
+                    synthetic_model(n_tables, 5))
+
+
+def teardown_dir():
+    shutil.rmtree(TEMP_DIR)
+
+
+@with_setup(setup_dir, teardown_dir)
+def test_concurrent():
+    service = service_url(TEMP_DIR)
+
+    models, service_version = aget_models_json(service).get(10)
+    eq_(len(models), 20)
+
+    built = []
+    results = [amake_model_from_service(m['name'], m['version'], service,
+                                        MetaData(), callback=built.append)
+               for m in models]
+
+    for m, result in zip(models, results):
+        eq_(len(result.get(10).tables), int(m['version']))
+    eq_(len(built), 20)
+
+
+@raises(KeyError)
+@with_setup(setup_dir, teardown_dir)
+def test_error():
+    # The service directory answers 404 with JSON that is not a model.
+    amake_model_from_service('synthetic', '0', service_url(TEMP_DIR),
+                             MetaData()).get(10)
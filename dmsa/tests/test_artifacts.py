@@ -0,0 +1,123 @@
+import gzip
+import io
+import shutil
+import tempfile
+from nose.tools import eq_, ok_, with_setup
+import dmsa.artifacts
+import dmsa.cache
+from dmsa.artifacts import artifact_key, get_artifact, set_artifact
+
+TEMP_DIR = None
+
+
+def setup_dir():
+    global TEMP_DIR
+    TEMP_DIR = tempfile.mkdtemp()
+    dmsa.cache.set_cache_dir(TEMP_DIR)
+    dmsa.artifacts.set_disk_cache(True)
+    dmsa.artifacts.clear_artifacts()
+
+
+def teardown_dir():
+    dmsa.artifacts.set_disk_cache(False)
+    dmsa.cache.set_cache_dir(None)
+    dmsa.artifacts.clear_artifacts()
+    shutil.rmtree(TEMP_DIR)
+
+
+def test_key():
+    key = artifact_key('omop', '5.0.0', 'oracle', 'ddl', 'all', '0.6.0')
+    eq_(key, artifact_key('omop', '5.0.0', 'oracle', 'ddl', 'all', '0.6.0'))
+    ok_(key != artifact_key('omop', '5.0.0', 'oracle', 'drop', 'all',
+                            '0.6.0'))
+    ok_(key != artifact_key('omop', '5.0.0', 'oracle', 'ddl', 'all',
+                            '0.6.1'))
+
+
+@with_setup(setup_dir, teardown_dir)
+def test_memory():
+    key = artifact_key('omop', '5.0.0', 'oracle', 'ddl', 'all', '0.6.0')
+    eq_(get_artifact(key), None)
+    set_artifact(key, u'CREATE TABLE foo ();')
+    eq_(get_artifact(key), u'CREATE TABLE foo ();')
+
+
+@with_setup(setup_dir, teardown_dir)
+def test_disk():
+    key = artifact_key('omop', '5.0.0', 'oracle', 'ddl', 'all', '0.6.0')
+    set_artifact(key, u'CREATE TABLE foo ();')
+    dmsa.artifacts.clear_artifacts()
+    eq_(get_artifact(key), u'CREATE TABLE foo ();')
+    ok_(dmsa.artifacts.stats()['disk_hits'] >= 1)
+
+
+@with_setup(setup_dir, teardown_dir)
+def test_has_artifact():
+    key = artifact_key('omop', '5.0.0', 'oracle', 'ddl', 'all', '0.6.0')
+    ok_(not dmsa.artifacts.has_artifact(key))
+    set_artifact(key, 'CREATE TABLE person;')
+    ok_(dmsa.artifacts.has_artifact(key))
+    dmsa.artifacts.clear_artifacts()
+    ok_(dmsa.artifacts.has_artifact(key))
+
+
+def test_compress():
+    data = 'CREATE TABLE person (person_id INTEGER);\n' * 100
+    gzipped = dmsa.artifacts.compress(data, 'gzip')
+    ok_(len(gzipped) < len(data))
+    eq_(gzipped, dmsa.artifacts.compress(data, 'gzip'))
+    eq_(gzip.GzipFile(fileobj=io.BytesIO(gzipped)).read(), data)
+    ok_('gzip' in dmsa.artifacts.encodings())
+
+
+@with_setup(setup_dir, teardown_dir)
+def test_encoded_artifact():
+    key = artifact_key('omop', '5.0.0', 'oracle', 'ddl', 'all', '0.6.0')
+    eq_(dmsa.artifacts.get_encoded_artifact(key, 'gzip'), None)
+    set_artifact(key, u'CREATE TABLE person;\n' * 100)
+    gzipped = dmsa.artifacts.get_encoded_artifact(key, 'gzip')
+    eq_(gzip.GzipFile(fileobj=io.BytesIO(gzipped)).read(),
+        'CREATE TABLE person;\n' * 100)
+    # The compressed form is cached, in memory and on disk.
+    dmsa.artifacts.clear_artifacts()
+    ok_(dmsa.artifacts.get_encoded_artifact(key, 'gzip') is not None)
+    ok_(dmsa.artifacts.get_encoded_artifact(key, 'gzip') is
+        dmsa.artifacts.get_encoded_artifact(key, 'gzip'))
+
+
+@with_setup(setup_dir, teardown_dir)
+def test_max_disk_size():
+    key = artifact_key('omop', '5.0.0', 'oracle', 'ddl', 'all', '0.6.0')
+    evictions = dmsa.artifacts.stats()['disk_evictions']
+    dmsa.artifacts.set_max_disk_size(0)
+    try:
+        set_artifact(key, u'CREATE TABLE foo ();')
+    finally:
+        dmsa.artifacts.set_max_disk_size(dmsa.artifacts.MAX_DISK_SIZE)
+    eq_(dmsa.artifacts.stats()['disk_evictions'], evictions + 1)
+    dmsa.artifacts.clear_artifacts()
+    eq_(get_artifact(key), None)
+
+
+@with_setup(setup_dir, teardown_dir)
+def test_prune_estimate():
+    scans = []
+    real_prune_namespace = dmsa.artifacts.prune_namespace
+
+    def prune_namespace(namespace, max_size):
+        scans.append(namespace)
+        return real_prune_namespace(namespace, max_size)
+
+    dmsa.artifacts.prune_namespace = prune_namespace
+    dmsa.artifacts.set_max_disk_size(100)
+    try:
+        # The first write measures the disk cache; later writes only do once
+        # the estimate passes the maximum.
+        for i in range(5):
+            key = artifact_key('omop', str(i), 'oracle', 'ddl', 'all', '0.6.0')
+            set_artifact(key, u'x' * 40)
+    finally:
+        dmsa.artifacts.set_max_disk_size(dmsa.artifacts.MAX_DISK_SIZE)
+        dmsa.artifacts.prune_namespace = real_prune_namespace
+
+    ok_(0 < len(scans) < 5)
@@ -0,0 +1,42 @@
+from nose.tools import eq_, ok_
+from sqlalchemy import MetaData
+from dmsa.makers import make_model
+from dmsa.tests.benchmark import FIXTURES_DIR, compare, load_models, result
+from dmsa.tests.synthetic import synthetic_model
+
+
+def test_synthetic_varied():
+    model_json = synthetic_model(20, 10, varied=True)
+    eq_(model_json, synthetic_model(20, 10, varied=True))
+    metadata = make_model(model_json, MetaData())
+    eq_(len(metadata.tables), 20)
+    ok_(metadata.tables['table_19'].foreign_keys)
+
+
+def test_fixtures():
+    models = load_models(FIXTURES_DIR, [])
+    eq_(sorted(model for model, version in dict(models)),
+        ['i2b2', 'omop', 'pcornet', 'pedsnet'])
+    for (model, version), model_json in models:
+        metadata = make_model(model_json, MetaData())
+        eq_(len(metadata.tables), len(model_json['tables']), model)
+
+
+def test_compare():
+    baseline = {'results': [
+        result('ddl', [1.0], model='omop', dialect='oracle'),
+        result('ddl', [1.0], model='omop', dialect='mysql'),
+        result('make_model', [1.0], model='omop')]}
+    results = {'results': [
+        result('ddl', [1.5], model='omop', dialect='oracle'),
+        result('ddl', [1.05], model='omop', dialect='mysql'),
+        result('make_model', [0.5], model='omop'),
+        result('make_model', [0.5], model='pcornet')]}
+    lines, slower = compare(baseline, results, 10)
+    eq_(len(lines), 2)
+    ok_(lines[0].startswith('ddl omop oracle'))
+    ok_(lines[1].startswith('make_model omop'))
+    ok_(slower)
+    lines, slower = compare(baseline, results, 60)
+    eq_(lines, [])
+    ok_(not slower)
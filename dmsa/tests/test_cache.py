@@ -0,0 +1,188 @@
+import cPickle as pickle
+import os
+import shutil
+import tempfile
+import time
+from nose.tools import eq_, ok_, with_setup
+import dmsa.cache
+from dmsa.cache import (LRUCache, get_entry, set_entry, delete_entry,
+                        get_cache, set_cache)
+
+TEMP_DIR = None
+
+
+def setup_dir():
+    global TEMP_DIR
+    TEMP_DIR = tempfile.mkdtemp()
+    dmsa.cache.set_cache_dir(TEMP_DIR)
+
+
+def teardown_dir():
+    dmsa.cache.set_cache_dir(None)
+    shutil.rmtree(TEMP_DIR)
+
+
+@with_setup(setup_dir, teardown_dir)
+def test_entries():
+    set_entry('test', 'a', {'value': 1})
+    set_entry('test', 'b', {'value': 2})
+    set_entry('other', 'a', {'value': 3})
+    eq_(get_entry('test', 'a'), {'value': 1})
+    eq_(get_entry('test', 'b'), {'value': 2})
+    eq_(get_entry('other', 'a'), {'value': 3})
+    eq_(get_entry('test', 'c'), None)
+    eq_(get_entry('test', 'c', 'default'), 'default')
+    delete_entry('test', 'a')
+    eq_(get_entry('test', 'a'), None)
+
+
+@with_setup(setup_dir, teardown_dir)
+def test_prune():
+    for i, key in enumerate(['a', 'b', 'c']):
+        set_entry('test', key, 'x' * 1000)
+        # Make the entries' write order visible in their mtimes.
+        mtime = time.time() - 100 + i
+        os.utime(dmsa.cache._entry_pathname('test', key), (mtime, mtime))
+    set_entry('other', 'a', 'x' * 1000)
+
+    size = os.path.getsize(dmsa.cache._entry_pathname('test', 'a'))
+    eq_(dmsa.cache.prune_namespace('test', 3 * size), (0, 3 * size))
+    eq_(dmsa.cache.prune_namespace('test', 2 * size), (1, 2 * size))
+    eq_(get_entry('test', 'a'), None)
+    eq_(get_entry('test', 'b'), 'x' * 1000)
+    eq_(dmsa.cache.prune_namespace('test', 0), (2, 0))
+    eq_(get_entry('test', 'c'), None)
+    eq_(get_entry('other', 'a'), 'x' * 1000)
+
+
+@with_setup(setup_dir, teardown_dir)
+def test_replace():
+    set_entry('test', 'a', 1)
+    set_entry('test', 'a', 2)
+    eq_(get_entry('test', 'a'), 2)
+    eq_(os.listdir(os.path.join(TEMP_DIR, 'test')),
+        [os.path.basename(dmsa.cache._entry_pathname('test', 'a'))])
+
+
+@with_setup(setup_dir, teardown_dir)
+def test_ttl():
+    before = dmsa.cache.stats()['stale']
+    set_entry('test', 'a', 1, ttl=-1)
+    eq_(get_entry('test', 'a'), None)
+    eq_(get_entry('test', 'a', allow_stale=True), 1)
+    eq_(dmsa.cache.stats()['stale'], before + 2)
+    set_entry('test', 'a', 1, ttl=60)
+    eq_(get_entry('test', 'a'), 1)
+
+
+@with_setup(setup_dir, teardown_dir)
+def test_format_version():
+    pathname = dmsa.cache._entry_pathname('test', 'a')
+    with open(pathname, 'wb') as f:
+        pickle.dump({'format': dmsa.cache.FORMAT_VERSION + 1, 'key': 'a',
+                     'created': time.time(), 'expires': None}, f)
+        pickle.dump(1, f)
+    eq_(get_entry('test', 'a'), None)
+    with open(pathname, 'wb') as f:
+        f.write('not a pickle')
+    eq_(get_entry('test', 'a'), None)
+
+
+@with_setup(setup_dir, teardown_dir)
+def test_single_object():
+    eq_(get_cache(), None)
+    set_cache({'service_version': '1.0.0'})
+    set_cache({'service_version': '2.0.0'})
+    eq_(get_cache(), {'service_version': '2.0.0'})
+
+
+@with_setup(setup_dir, teardown_dir)
+def test_memoize():
+    set_entry('test', 'a', {'value': 1})
+    obj = get_entry('test', 'a', memoize=True)
+    eq_(obj, {'value': 1})
+    ok_(get_entry('test', 'a', memoize=True) is obj)
+
+    # Writes in this process are seen immediately.
+    set_entry('test', 'a', {'value': 2})
+    eq_(get_entry('test', 'a', memoize=True), {'value': 2})
+    delete_entry('test', 'a')
+    eq_(get_entry('test', 'a', memoize=True), None)
+
+
+@with_setup(setup_dir, teardown_dir)
+def test_memoize_other_process():
+    interval = dmsa.cache.MEMO_CHECK_INTERVAL
+    dmsa.cache.MEMO_CHECK_INTERVAL = 0
+
+    try:
+        set_entry('test', 'a', {'value': 1})
+        obj = get_entry('test', 'a', memoize=True)
+        ok_(get_entry('test', 'a', memoize=True) is obj)
+
+        # Replace the file the way another process would, bypassing this
+        # process's generation counter.
+        pathname = dmsa.cache._entry_pathname('test', 'a')
+        tmp_pathname = pathname + '.tmp'
+        with open(tmp_pathname, 'wb') as f:
+            pickle.dump({'format': dmsa.cache.FORMAT_VERSION, 'key': 'a',
+                         'created': time.time(), 'expires': None}, f)
+            pickle.dump({'value': 2}, f)
+        os.rename(tmp_pathname, pathname)
+
+        eq_(get_entry('test', 'a', memoize=True), {'value': 2})
+    finally:
+        dmsa.cache.MEMO_CHECK_INTERVAL = interval
+
+
+def test_get_set():
+    cache = LRUCache(2)
+    cache.set('a', 1)
+    eq_(cache.get('a'), 1)
+    eq_(cache.get('b'), None)
+    eq_(cache.get('b', 2), 2)
+
+
+def test_eviction():
+    cache = LRUCache(2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    ok_('a' in cache)
+    ok_('b' not in cache)
+    ok_('c' in cache)
+    eq_(cache.stats()['evictions'], 1)
+
+
+def test_sizeof():
+    cache = LRUCache(10, sizeof=len)
+    cache.set('a', 'x' * 6)
+    cache.set('b', 'x' * 6)
+    ok_('a' not in cache)
+    eq_(cache.stats()['size'], 6)
+    cache.set('c', 'x' * 11)
+    ok_('c' not in cache)
+
+
+def test_stats():
+    cache = LRUCache(2)
+    cache.set('a', 1)
+    cache.get('a')
+    cache.get('a')
+    cache.get('b')
+    stats = cache.stats()
+    eq_(stats['hits'], 2)
+    eq_(stats['misses'], 1)
+    eq_(stats['entries'], 1)
+
+
+def test_pop_clear():
+    cache = LRUCache(2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    eq_(cache.pop('a'), 1)
+    eq_(len(cache), 1)
+    cache.clear()
+    eq_(len(cache), 0)
+    eq_(cache.stats()['size'], 0)
@@ -1,6 +1,11 @@
 import os
-from nose.tools import ok_
+import shutil
+import tempfile
+from nose.tools import ok_, eq_, raises, with_setup
+from sqlalchemy import MetaData
+from sqlalchemy.exc import CompileError
 from dmsa import ddl
+from dmsa.makers import make_model
 
 # These testing functions are definitely non-exhaustive. They all operate on
 # the OMOP v5.0.0 data model, retrieved from the default data-models-service
@@ -97,3 +102,135 @@ def test_nologging_noindexes():
     ddl_output = ddl.generate('omop', '5.0.0', 'sqlite', nologging=True,
                               indexes=False)
     ok_(ddl_output)
+
+
+# The following tests run offline against a small model built from JSON.
+
+OFFLINE_MODEL_JSON = {
+    'schema': {
+        'constraints': {
+            'foreign_keys': [{'source_table': 'test_table_1',
+                              'source_field': 'integer',
+                              'target_table': 'test_table_2',
+                              'target_field': 'integer'}],
+            'not_null': [{'table': 'test_table_1', 'field': 'string'}],
+            'uniques': [{'table': 'test_table_2', 'fields': ['integer'],
+                         'name': 'uq_test_table_2'}],
+            'primary_keys': [{'table': 'test_table_1', 'fields': ['pk']}]
+        },
+        'indexes': [{'table': 'test_table_2', 'fields': ['string'],
+                     'name': 'idx_test_table_2'}]
+    },
+    'tables': [{'name': 'test_table_1', 'fields': [{'type': 'integer',
+                                                    'name': 'pk'},
+                                                   {'type': 'integer',
+                                                    'name': 'integer'},
+                                                   {'type': 'string',
+                                                    'name': 'string'}]},
+               {'name': 'test_table_2', 'fields': [{'type': 'integer',
+                                                    'name': 'integer'},
+                                                   {'type': 'string',
+                                                    'name': 'string'}]}]
+}
+
+REAL_GET_METADATA = ddl.get_metadata
+REAL_GET_SERVICE_VERSION = ddl.get_service_version
+
+
+def setup_offline():
+    metadata = make_model(OFFLINE_MODEL_JSON, MetaData())
+    ddl.get_metadata = lambda model, model_version, service: metadata
+    ddl.get_service_version = lambda service: '0.0.0'
+
+
+def teardown_offline():
+    ddl.get_metadata = REAL_GET_METADATA
+    ddl.get_service_version = REAL_GET_SERVICE_VERSION
+
+
+@with_setup(setup_offline, teardown_offline)
+def test_iter_generate():
+    for kwargs in [{}, {'drop': True}, {'delete_data': True},
+                   {'indexes': False, 'drop': True}, {'logging': True}]:
+        eq_(''.join(ddl.iter_generate('test', '1.0.0', 'sqlite', **kwargs)),
+            ddl.generate('test', '1.0.0', 'sqlite', **kwargs))
+
+
+@with_setup(setup_offline, teardown_offline)
+def test_drop_order():
+    ddl_output = ddl.generate('test', '1.0.0', 'sqlite', drop=True)
+    ok_(ddl_output.index('CREATE TABLE IF NOT EXISTS version_history') <
+        ddl_output.index('drop indexes') <
+        ddl_output.index('DROP INDEX idx_test_table_2') <
+        ddl_output.index('drop tables') <
+        ddl_output.index('DROP TABLE test_table_1'))
+
+
+@with_setup(setup_offline, teardown_offline)
+def test_generate_dialects():
+    output_dir = tempfile.mkdtemp()
+    try:
+        for processes in [1, 2]:
+            paths = ddl.generate_dialects('test', '1.0.0', ['sqlite'],
+                                          output_dir, processes=processes,
+                                          drop=True)
+            eq_(paths, [os.path.join(output_dir, 'test_1.0.0_sqlite.sql')])
+            with open(paths[0]) as f:
+                eq_(f.read(), ddl.generate('test', '1.0.0', 'sqlite',
+                                           drop=True))
+    finally:
+        shutil.rmtree(output_dir)
+
+
+@with_setup(setup_offline, teardown_offline)
+def test_sections():
+    metadata = ddl.get_metadata('test', '1.0.0', None)
+    eq_(ddl.get_dialect('oracle'), ddl.get_dialect('oracle'))
+
+    def generate_all():
+        # No DBAPI drivers are needed.
+        return [ddl.generate('test', '1.0.0', dialect, **kwargs)
+                for dialect in ['postgresql', 'oracle', 'mssql', 'mysql']
+                for kwargs in [{}, {'tables': False}, {'constraints': False},
+                               {'drop': True, 'constraints': False},
+                               {'delete_data': True}]]
+
+    outputs = generate_all()
+
+    # Create and drop tables, constraints and indexes, and delete, in each
+    # dialect.
+    sections = metadata.info['dmsa_sections']
+    eq_(len(sections), 4 * 6)
+    sections = dict(sections)
+
+    eq_(generate_all(), outputs)
+    eq_(metadata.info['dmsa_sections'], sections)
+
+
+@with_setup(setup_offline, teardown_offline)
+def test_sections_streamed():
+    metadata = ddl.get_metadata('test', '1.0.0', None)
+    sql_dialect = ddl.get_dialect('postgresql')
+
+    # The first section is compiled up front; later ones are yielded as
+    # they are compiled, and each is only kept once compiled in full.
+    statements = ddl.iter_generate('test', '1.0.0', 'postgresql')
+    ok_(('tables', sql_dialect, False) in metadata.info['dmsa_sections'])
+    for statement in statements:
+        if statement.startswith('ALTER TABLE'):
+            break
+    eq_(list(metadata.info['dmsa_sections']),
+        [('tables', sql_dialect, False)])
+
+    first = [s for s in ddl.iter_generate('test', '1.0.0', 'postgresql')]
+    second = [s for s in ddl.iter_generate('test', '1.0.0', 'postgresql')]
+    eq_(''.join(first), ''.join(second))
+    ok_(len(first) > len(second))
+
+
+@with_setup(setup_offline, teardown_offline)
+@raises(CompileError)
+def test_drop_unnamed_constraints():
+    # Unnamed constraints cannot be dropped; the error is raised before any
+    # of the script is produced.
+    ddl.iter_generate('test', '1.0.0', 'postgresql', drop=True)
@@ -1,6 +1,11 @@
+import gc
 import os
+import shutil
+import tempfile
+import threading
+import time
 from nose import SkipTest
-from nose.tools import ok_
+from nose.tools import ok_, eq_
 from dmsa import erd
 
 # This testing function is definitely non-exhaustive. It operates on the
@@ -20,3 +25,35 @@ def test_all():
     except ImportError:
         raise SkipTest('Skipping erd test; ERLAlchemy package not installed')
     ok_(os.path.exists('test_erd_out.png'))
+
+
+def test_write_once():
+    output_dir = tempfile.mkdtemp()
+    output = os.path.join(output_dir, 'test_erd.png')
+    renders = []
+
+    def fake_write(model, model_version, output, service):
+        renders.append(output)
+        time.sleep(0.05)
+        with open(output, 'w') as f:
+            f.write('png')
+
+    real_write = erd.write
+    erd.write = fake_write
+    try:
+        threads = [threading.Thread(target=erd.write_once,
+                                    args=('omop', '5.0.0', output, SERVICE))
+                   for i in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        ok_(not erd.write_once('omop', '5.0.0', output, SERVICE))
+    finally:
+        erd.write = real_write
+
+    eq_(len(renders), 1)
+    eq_(os.listdir(output_dir), ['test_erd.png'])
+    gc.collect()
+    eq_(len(getattr(erd, '__LOCKS')), 0)
+    shutil.rmtree(output_dir)
@@ -0,0 +1,161 @@
+from __future__ import unicode_literals
+
+import json
+import os
+import shutil
+import tempfile
+from nose.tools import eq_, ok_, with_setup
+import dmsa.ddl
+import dmsa.utility
+from dmsa import export
+from dmsa.registry import invalidate_metadata
+from dmsa.tests.test_make_model import model_json
+
+SERVICE = 'http://dms.example.org/'
+MODELS = [{'name': 'test', 'pretty': 'Test',
+           'versions': [{'name': '1.0.0'}, {'name': '2.0.0'}]}]
+
+OUT_DIR = None
+REAL = {}
+
+
+def setup_export():
+    global OUT_DIR
+    OUT_DIR = tempfile.mkdtemp()
+    invalidate_metadata()
+    REAL['get_model_json'] = dmsa.utility.get_model_json
+    REAL['utility.get_service_version'] = dmsa.utility.get_service_version
+    REAL['ddl.get_service_version'] = dmsa.ddl.get_service_version
+    dmsa.utility.get_model_json = lambda *args: model_json
+    dmsa.utility.get_service_version = lambda service: '0.0.0'
+    dmsa.ddl.get_service_version = lambda service: '0.0.0'
+
+    # Only export sqlite artifacts, to keep the tests quick.
+    REAL['export_tasks'] = export.export_tasks
+    export.export_tasks = lambda *args: [
+        t for t in REAL['export_tasks'](*args) if t[3] == 'sqlite']
+
+
+def teardown_export():
+    export.export_tasks = REAL['export_tasks']
+    dmsa.utility.get_model_json = REAL['get_model_json']
+    dmsa.utility.get_service_version = REAL['utility.get_service_version']
+    dmsa.ddl.get_service_version = REAL['ddl.get_service_version']
+    invalidate_metadata()
+    shutil.rmtree(OUT_DIR)
+
+
+def test_tasks():
+    tasks = export.export_tasks(MODELS, ['sqlite', 'postgresql'])
+    ok_(('test', '1.0.0', 'erd', None, None) in tasks)
+    ok_(('test', '2.0.0', 'ddl', 'postgresql', 'constraints') in tasks)
+    ok_(('test', '2.0.0', 'ddl', 'sqlite', 'constraints') not in tasks)
+    ok_(('test', '2.0.0', 'nologging', 'oracle', 'indexes') in tasks)
+    eq_(len(tasks), len(set(tasks)))
+
+
+def test_task_path():
+    eq_(export.task_path(('test', '1.0.0', 'ddl', 'oracle', 'all')),
+        'test/1.0.0/ddl/oracle/index.sql')
+    eq_(export.task_path(('test', '1.0.0', 'drop', 'oracle', 'tables')),
+        'test/1.0.0/drop/oracle/tables/index.sql')
+    eq_(export.task_path(('test', '1.0.0', 'erd', None, None)),
+        'test/1.0.0/erd/index.png')
+
+
+@with_setup(setup_export, teardown_export)
+def test_export():
+    tasks = export.export_tasks(MODELS, ['sqlite'], False)
+    result = export.export(OUT_DIR, SERVICE, models=MODELS,
+                           dialects=['sqlite'], erd=False, processes=1)
+
+    with open(os.path.join(OUT_DIR, export.MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+
+    path = 'test/1.0.0/ddl/sqlite/index.sql'
+    ok_(path in manifest['artifacts'])
+    with open(os.path.join(OUT_DIR, *path.split('/'))) as f:
+        eq_(f.read(), dmsa.ddl.generate('test', '1.0.0', 'sqlite',
+                                        service=SERVICE))
+    eq_(result['skipped'], 0)
+    eq_(result['written'], len(tasks))
+    eq_(result['failed'], 0)
+
+
+@with_setup(setup_export, teardown_export)
+def test_export_unchanged():
+    models = [dict(MODELS[0], versions=[{'name': '1.0.0'}])]
+    kwargs = {'models': models, 'dialects': ['sqlite'], 'erd': False}
+
+    first = export.export(OUT_DIR, SERVICE, processes=2, **kwargs)
+    second = export.export(OUT_DIR, SERVICE, processes=2, **kwargs)
+
+    path = os.path.join(OUT_DIR, 'test', '1.0.0', 'delete', 'sqlite',
+                        'index.sql')
+    with open(path, 'w') as f:
+        f.write('tampered')
+    third = export.export(OUT_DIR, SERVICE, processes=1, **kwargs)
+
+    eq_(second, {'written': 0, 'skipped': first['written'], 'failed': 0})
+    eq_(third, {'written': 1, 'skipped': first['written'] - 1, 'failed': 0})
+
+
+@with_setup(setup_export, teardown_export)
+def test_export_failed():
+    models = [dict(MODELS[0], versions=[{'name': '1.0.0'}])]
+    kwargs = {'models': models, 'dialects': ['sqlite'], 'erd': False,
+              'processes': 1}
+    path = 'test/1.0.0/delete/sqlite/index.sql'
+
+    real_generate = dmsa.ddl.generate
+
+    def failing_generate(*args, **kwargs):
+        if kwargs.get('delete_data'):
+            raise RuntimeError('generation failed')
+        return real_generate(*args, **kwargs)
+
+    dmsa.ddl.generate = failing_generate
+    try:
+        first = export.export(OUT_DIR, SERVICE, **kwargs)
+    finally:
+        dmsa.ddl.generate = real_generate
+
+    with open(os.path.join(OUT_DIR, export.MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+
+    eq_(first['failed'], 1)
+    ok_(path not in manifest['artifacts'])
+    eq_(len(manifest['artifacts']), first['written'])
+
+    second = export.export(OUT_DIR, SERVICE, **kwargs)
+    eq_(second, {'written': 1, 'skipped': first['written'], 'failed': 0})
+
+
+@with_setup(setup_export, teardown_export)
+def test_export_failed_model():
+    broken_json = dict(model_json, tables=[
+        {'name': 'broken', 'fields': [{'type': 'xml', 'name': 'doc'}]}])
+
+    def get_model_json(model, model_version, service):
+        if model == 'broken':
+            return broken_json
+        if model == 'missing':
+            raise IOError('not found')
+        return model_json
+
+    models = [dict(MODELS[0], versions=[{'name': '1.0.0'}]),
+              {'name': 'broken', 'versions': [{'name': '1.0.0'}]},
+              {'name': 'missing', 'versions': [{'name': '1.0.0'}]}]
+    dmsa.utility.get_model_json = get_model_json
+
+    result = export.export(OUT_DIR, SERVICE, models=models,
+                           dialects=['sqlite'], erd=False, processes=1)
+
+    with open(os.path.join(OUT_DIR, export.MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+
+    tasks = export.export_tasks(models[:1], ['sqlite'], False)
+    eq_(result, {'written': len(tasks), 'skipped': 0,
+                 'failed': 2 * len(tasks)})
+    eq_(sorted(manifest['artifacts']),
+        sorted(export.task_path(task) for task in tasks))
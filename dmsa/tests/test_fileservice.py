@@ -0,0 +1,75 @@
+import json
+import os
+import shutil
+import tempfile
+from nose.tools import eq_, ok_, with_setup
+from dmsa import fileservice
+from dmsa.utility import get_model_json, get_models_json
+
+MODEL_JSON = {'tables': [], 'schema': {'constraints': {}, 'indexes': []}}
+
+TEMP_DIR = None
+
+
+def setup_dir():
+    global TEMP_DIR
+    TEMP_DIR = tempfile.mkdtemp()
+    fileservice.write_model(TEMP_DIR, 'omop', '5.0.0', MODEL_JSON)
+    fileservice.write_model(TEMP_DIR, 'omop', '4.0.0', MODEL_JSON)
+
+
+def teardown_dir():
+    shutil.rmtree(TEMP_DIR)
+
+
+@with_setup(setup_dir, teardown_dir)
+def test_file_service():
+    service = fileservice.service_url(TEMP_DIR)
+    ok_(service.startswith('file:///'))
+
+    eq_(get_model_json('omop', '5.0.0', service), MODEL_JSON)
+
+    models, service_version = get_models_json(service)
+    eq_(service_version, 'local')
+    eq_([(m['name'], m['version']) for m in models],
+        [('omop', '4.0.0'), ('omop', '5.0.0')])
+    eq_(models[0]['release']['level'], 'final')
+
+
+@with_setup(setup_dir, teardown_dir)
+def test_catalog_and_version():
+    catalog = [{'name': 'omop', 'version': '5.0.0',
+                'release': {'level': 'beta'}}]
+    with open(os.path.join(TEMP_DIR, 'models.json'), 'w') as f:
+        json.dump(catalog, f)
+    with open(os.path.join(TEMP_DIR, 'VERSION'), 'w') as f:
+        f.write('1.2.3\n')
+
+    eq_(get_models_json(fileservice.service_url(TEMP_DIR)),
+        (catalog, '1.2.3'))
+
+
+@with_setup(setup_dir, teardown_dir)
+def test_not_found():
+    eq_(fileservice.read(TEMP_DIR, 'schemata/omop/6.0.0')[0], 404)
+    eq_(fileservice.read(TEMP_DIR, 'schemata/../omop/5.0.0')[0], 404)
+    eq_(fileservice.read(TEMP_DIR, 'other')[0], 404)
+
+
+@with_setup(setup_dir, teardown_dir)
+def test_app():
+    client = fileservice.build_app(TEMP_DIR).test_client()
+
+    r = client.get('/schemata/omop/5.0.0?format=json')
+    eq_(r.status_code, 200)
+    eq_(json.loads(r.get_data()), MODEL_JSON)
+    eq_(r.headers['User-Agent'].split(' ')[0], 'DataModelsService/local')
+
+    r = client.get('/schemata/omop/5.0.0?format=json',
+                   headers={'If-None-Match': r.headers['ETag']})
+    eq_(r.status_code, 304)
+
+    r = client.get('/models?format=json')
+    eq_(len(json.loads(r.get_data())), 2)
+
+    eq_(client.get('/schemata/omop/6.0.0').status_code, 404)
@@ -0,0 +1,74 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from nose.tools import ok_
+from dmsa.fileservice import service_url, write_model
+from dmsa.tests.synthetic import synthetic_model
+
+# These tests check which packages dmsa commands import, rather than how long
+# the commands take, which depends on the machine: command durations are
+# measured by the benchmarks (see benchmark.py).
+
+# Run the command, then report the modules it imported.
+SCRIPT = """
+import json, sys
+from dmsa.main import main
+sys.argv = ['dmsa'] + json.loads(sys.argv[1])
+try:
+    main()
+except SystemExit:
+    pass
+sys.stderr.write(json.dumps({
+    'modules': [name for name, module in sys.modules.items() if module]}))
+"""
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+
+
+def run_dmsa(args, cwd):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    p = subprocess.Popen([sys.executable, '-c', SCRIPT, json.dumps(args)],
+                         cwd=cwd, env=env, stdout=subprocess.PIPE,
+                         stderr=subprocess.PIPE)
+    stdout, stderr = p.communicate()
+    return json.loads(stderr.splitlines()[-1])
+
+
+def imported(result, package):
+    return any(name == package or name.startswith(package + '.')
+               for name in result['modules'])
+
+
+def test_version():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        result = run_dmsa(['--version'], tmp_dir)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    for package in ['sqlalchemy', 'requests', 'flask']:
+        ok_(not imported(result, package), package)
+
+
+def test_ddl():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        service_dir = os.path.join(tmp_dir, 'service')
+        write_model(service_dir, 'synthetic', '1.0.0', synthetic_model(10))
+        output = os.path.join(tmp_dir, 'ddl.sql')
+        result = run_dmsa(['ddl', '--service=' + service_url(service_dir),
+                           '-o', output, 'synthetic', '1.0.0', 'postgresql'],
+                          tmp_dir)
+        ok_(os.path.getsize(output))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    # Only the requested dialect is loaded, and the web service isn't.
+    ok_(imported(result, 'sqlalchemy.dialects.postgresql'))
+    for package in ['sqlalchemy.dialects.oracle', 'sqlalchemy.dialects.mssql',
+                    'flask', 'werkzeug', 'jinja2']:
+        ok_(not imported(result, package), package)
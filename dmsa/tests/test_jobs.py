@@ -0,0 +1,135 @@
+import os
+import shutil
+import tempfile
+import time
+from nose.tools import eq_, ok_, raises, with_setup
+import dmsa.erd
+from dmsa import jobs
+
+SERVICE = 'http://dms.example.org/'
+
+OUTPUT_DIR = None
+REAL_WRITE = dmsa.erd.write
+
+
+def fake_write(model, model_version, output, service):
+    if model == 'broken':
+        raise ValueError('broken model')
+    time.sleep(0.2)
+    with open(output, 'w') as f:
+        f.write('png')
+
+
+def setup_jobs():
+    global OUTPUT_DIR
+    OUTPUT_DIR = tempfile.mkdtemp()
+    dmsa.erd.write = fake_write
+    # Stop the workers, so that the ones each test starts inherit the fake
+    # writer.
+    jobs.shutdown()
+
+
+def teardown_jobs():
+    # Stop the workers, which inherited the fake writer; later users start
+    # their own.
+    jobs.shutdown()
+    jobs.configure(workers=jobs.ERD_WORKERS, max_pending=jobs.MAX_PENDING,
+                   timeout=jobs.JOB_TIMEOUT)
+    dmsa.erd.write = REAL_WRITE
+    shutil.rmtree(OUTPUT_DIR)
+
+
+def wait_for(output):
+    for i in range(100):
+        if jobs.erd_status(output) != jobs.PENDING:
+            break
+        time.sleep(0.05)
+    return jobs.erd_status(output)
+
+
+@with_setup(setup_jobs, teardown_jobs)
+def test_synchronous():
+    jobs.configure(workers=0)
+    output = os.path.join(OUTPUT_DIR, 'erd.png')
+    ok_(jobs.submit_erd('omop', '5.0.0', output, SERVICE))
+    eq_(jobs.erd_status(output), 'ready')
+
+
+@with_setup(setup_jobs, teardown_jobs)
+def test_background():
+    jobs.configure(workers=2)
+    jobs.start()
+    output = os.path.join(OUTPUT_DIR, 'erd.png')
+    eq_(jobs.erd_status(output), None)
+    ok_(not jobs.submit_erd('omop', '5.0.0', output, SERVICE))
+    eq_(jobs.erd_status(output), jobs.PENDING)
+    eq_(wait_for(output), 'ready')
+    ok_(jobs.submit_erd('omop', '5.0.0', output, SERVICE))
+
+
+@with_setup(setup_jobs, teardown_jobs)
+def test_failed():
+    jobs.configure(workers=1)
+    jobs.start()
+    output = os.path.join(OUTPUT_DIR, 'erd.png')
+    jobs.submit_erd('broken', '5.0.0', output, SERVICE)
+    eq_(wait_for(output), jobs.FAILED)
+    ok_('broken model' in jobs.erd_error(output))
+
+
+@with_setup(setup_jobs, teardown_jobs)
+@raises(jobs.QueueFull)
+def test_queue_full():
+    jobs.configure(workers=1, max_pending=2)
+    jobs.start()
+    for i in range(3):
+        output = os.path.join(OUTPUT_DIR, 'erd_{0}.png'.format(i))
+        jobs.submit_erd('omop', '5.0.0', output, SERVICE)
+
+
+@with_setup(setup_jobs, teardown_jobs)
+def test_dedupe():
+    jobs.configure(workers=1, max_pending=1)
+    jobs.start()
+    output = os.path.join(OUTPUT_DIR, 'erd.png')
+    for i in range(3):
+        ok_(not jobs.submit_erd('omop', '5.0.0', output, SERVICE))
+    eq_(wait_for(output), 'ready')
+
+
+@with_setup(setup_jobs, teardown_jobs)
+def test_timeout():
+    jobs.configure(workers=1, max_pending=1, timeout=0.05)
+    jobs.start()
+    output = os.path.join(OUTPUT_DIR, 'erd.png')
+    ok_(not jobs.submit_erd('omop', '5.0.0', output, SERVICE))
+    time.sleep(0.1)
+    eq_(jobs.erd_status(output), jobs.FAILED)
+    ok_('within' in jobs.erd_error(output))
+
+    # The expired job no longer counts towards the maximum.
+    other = os.path.join(OUTPUT_DIR, 'other.png')
+    ok_(not jobs.submit_erd('omop', '5.0.0', other, SERVICE))
+
+
+@with_setup(setup_jobs, teardown_jobs)
+def test_failures_forgotten():
+    jobs.configure(workers=0)
+    outputs = [os.path.join(OUTPUT_DIR, 'erd_{0}.png'.format(i))
+               for i in range(jobs.MAX_FAILED + 5)]
+    for output in outputs:
+        ok_(not jobs.submit_erd('broken', '5.0.0', output, SERVICE))
+
+    # Only the latest failures are kept...
+    eq_(jobs.erd_status(outputs[0]), None)
+    eq_(jobs.erd_status(outputs[-1]), jobs.FAILED)
+    eq_(len(getattr(jobs, '__JOBS')), jobs.MAX_FAILED)
+
+    # ... and only for FAILED_TTL seconds.
+    ttl, jobs.FAILED_TTL = jobs.FAILED_TTL, 0
+    try:
+        jobs.submit_erd('broken', '5.0.0', outputs[0], SERVICE)
+    finally:
+        jobs.FAILED_TTL = ttl
+    time.sleep(0.01)
+    eq_(jobs.erd_status(outputs[0]), None)
@@ -2,8 +2,9 @@ from __future__ import unicode_literals
 
 from sqlalchemy import MetaData
 from sqlalchemy.schema import ForeignKeyConstraint, UniqueConstraint
-from nose.tools import eq_, ok_
-from dmsa.makers import make_model
+from nose.tools import eq_, ok_, raises
+from dmsa.makers import (make_model, make_model_from_service,
+                         MAKE_MODEL_SECONDS)
 
 model_json = {
     'schema': {
@@ -93,3 +94,17 @@ def test_foreign_key():
             break
     else:
         raise AssertionError('ForeignKeyConstraint not found.')
+
+
+def test_make_model_seconds():
+    make_model_from_service('seconds', '1.0.0', None, MetaData(),
+                            model_json)
+    eq_(MAKE_MODEL_SECONDS.count(model='seconds'), 1)
+
+
+@raises(KeyError)
+def test_make_model_seconds_failed():
+    try:
+        make_model_from_service('broken', '1.0.0', None, MetaData(), {})
+    finally:
+        eq_(MAKE_MODEL_SECONDS.count(model='broken'), 0)
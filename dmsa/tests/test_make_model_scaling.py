@@ -0,0 +1,53 @@
+from __future__ import unicode_literals
+
+import gc
+import time
+from nose.tools import eq_, ok_
+from sqlalchemy import MetaData
+from dmsa.makers import make_model
+from dmsa.tests.synthetic import synthetic_model
+
+# These tests build synthetic models of up to 1,000 tables and 50,000 fields,
+# with every field not null, and check that build time grows linearly with
+# model size (doubling the model should roughly double the build time). Only
+# the ratio of build times measured in the same run is checked, never an
+# absolute time, and each is the best of a few builds, so that a loaded
+# machine slows both alike rather than failing the test.
+
+REPEAT = 3
+
+
+def time_make_model(model_json):
+
+    gc.disable()
+    try:
+        start = time.time()
+        metadata = make_model(model_json, MetaData())
+        return time.time() - start, metadata
+    finally:
+        gc.enable()
+
+
+def test_large_model():
+
+    model_json = synthetic_model(1000)
+    elapsed, metadata = time_make_model(model_json)
+
+    eq_(len(metadata.tables), 1000)
+    eq_(sum(len(t.columns) for t in metadata.tables.values()), 50000)
+    ok_(not metadata.tables['table_999'].columns['field_49'].nullable)
+
+
+def test_linear_scaling():
+
+    small_json = synthetic_model(250)
+    large_json = synthetic_model(1000)
+    small_elapsed = min(time_make_model(small_json)[0]
+                        for i in range(REPEAT))
+    large_elapsed = min(time_make_model(large_json)[0]
+                        for i in range(REPEAT))
+
+    # Linear construction gives a ratio near 4; quadratic near 16.
+    ratio = large_elapsed / small_elapsed
+    ok_(ratio < 8, 'building 4x the tables took {0:.1f}x as long'.format(
+        ratio))
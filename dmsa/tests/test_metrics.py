@@ -0,0 +1,50 @@
+from nose.tools import eq_, ok_, raises
+from dmsa import metrics
+
+
+def test_counter():
+    c = metrics.Counter('test_counter_total', 'A test counter.',
+                        labels=('route',))
+    c.inc(route='/')
+    c.inc(2, route='/')
+    c.inc(route='/a "quoted"\nroute')
+    eq_(c.value(route='/'), 3)
+    lines = metrics.render().splitlines()
+    ok_('# HELP test_counter_total A test counter.' in lines)
+    ok_('# TYPE test_counter_total counter' in lines)
+    ok_('test_counter_total{route="/"} 3.0' in lines)
+    ok_('test_counter_total{route="/a \\"quoted\\"\\nroute"} 1.0' in lines)
+
+
+@raises(ValueError)
+def test_labels():
+    c = metrics.Counter('test_labels_total', 'A test counter.',
+                        labels=('route',))
+    c.inc(dialect='oracle')
+
+
+def test_histogram():
+    h = metrics.Histogram('test_seconds', 'A test histogram.',
+                          buckets=(0.1, 1))
+    h.observe(0.05)
+    h.observe(0.5)
+    h.observe(5)
+    with h.time():
+        pass
+    eq_(h.count(), 4)
+    lines = metrics.render().splitlines()
+    ok_('# TYPE test_seconds histogram' in lines)
+    ok_('test_seconds_bucket{le="0.1"} 2.0' in lines)
+    ok_('test_seconds_bucket{le="1.0"} 3.0' in lines)
+    ok_('test_seconds_bucket{le="+Inf"} 4.0' in lines)
+    ok_('test_seconds_count 4.0' in lines)
+
+
+def test_collector():
+    metrics.register_collector(lambda: [
+        ('test_collected', 'gauge', 'A collected gauge.',
+         [({'cache': 'memory'}, 7), ({'cache': 'disk'}, None)])])
+    lines = metrics.render().splitlines()
+    ok_('test_collected{cache="memory"} 7.0' in lines)
+    ok_(not [line for line in lines
+             if line.startswith('test_collected{cache="disk"')])
@@ -0,0 +1,43 @@
+import time
+from nose.tools import eq_, ok_, with_setup
+from dmsa import phases
+
+
+def teardown_phases():
+    phases.enable(False)
+
+
+@with_setup(teardown=teardown_phases)
+def test_disabled():
+    with phases.phase('fetch'):
+        pass
+    eq_(phases.report(), [])
+
+
+@with_setup(teardown=teardown_phases)
+def test_phases():
+    phases.enable()
+    with phases.phase('fetch'):
+        time.sleep(0.01)
+    for i in range(3):
+        with phases.phase('compile'):
+            pass
+    report = phases.report()
+    eq_([(name, calls) for name, calls, seconds, growth in report],
+        [('fetch', 1), ('compile', 3)])
+    ok_(report[0][2] >= 0.01)
+    lines = phases.format_report(1).splitlines()
+    eq_(lines[1].split()[:2], ['fetch', '1'])
+    eq_(lines[-2].split()[0], 'other')
+    eq_(lines[-1].split()[0], 'total')
+
+
+@with_setup(teardown=teardown_phases)
+def test_exception():
+    phases.enable()
+    try:
+        with phases.phase('fetch'):
+            raise IOError('unreachable')
+    except IOError:
+        pass
+    eq_(phases.report()[0][:2], ('fetch', 1))
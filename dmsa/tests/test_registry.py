@@ -0,0 +1,96 @@
+from __future__ import unicode_literals
+
+import threading
+import time
+from nose.tools import eq_, ok_, with_setup
+import dmsa.utility
+from dmsa import get_metadata
+from dmsa.registry import invalidate_metadata
+
+SERVICE = 'http://dms.example.org/'
+
+model_json = {
+    'schema': {
+        'constraints': {
+            'not_null': [],
+            'primary_keys': [{'table': 'test_table', 'fields': ['pk']}]
+        },
+        'indexes': []
+    },
+    'tables': [{'name': 'test_table', 'fields': [{'type': 'integer',
+                                                  'name': 'pk'}]}]
+}
+
+REAL_GET_MODEL_JSON = dmsa.utility.get_model_json
+FETCHES = []
+
+
+def fake_get_model_json(model, model_version, service):
+    FETCHES.append((model, model_version, service))
+    time.sleep(0.01)
+    return model_json
+
+
+def setup_fake():
+    del FETCHES[:]
+    invalidate_metadata()
+    dmsa.utility.get_model_json = fake_get_model_json
+
+
+def teardown_fake():
+    dmsa.utility.get_model_json = REAL_GET_MODEL_JSON
+    invalidate_metadata()
+
+
+@with_setup(setup_fake, teardown_fake)
+def test_shared():
+    metadata = get_metadata('test', '1.0.0', SERVICE)
+    ok_('test_table' in metadata.tables)
+    ok_(get_metadata('test', '1.0.0', SERVICE) is metadata)
+    eq_(len(FETCHES), 1)
+
+
+@with_setup(setup_fake, teardown_fake)
+def test_versions():
+    ok_(get_metadata('test', '1.0.0', SERVICE) is not
+        get_metadata('test', '2.0.0', SERVICE))
+    eq_(len(FETCHES), 2)
+
+
+@with_setup(setup_fake, teardown_fake)
+def test_invalidate():
+    metadata = get_metadata('test', '1.0.0', SERVICE)
+    get_metadata('other', '1.0.0', SERVICE)
+    invalidate_metadata(SERVICE, 'test')
+    ok_(get_metadata('test', '1.0.0', SERVICE) is not metadata)
+    get_metadata('other', '1.0.0', SERVICE)
+    eq_(len(FETCHES), 3)
+
+
+@with_setup(setup_fake, teardown_fake)
+def test_concurrent_build():
+    results = []
+
+    def build():
+        results.append(get_metadata('test', '1.0.0', SERVICE))
+
+    threads = [threading.Thread(target=build) for i in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    eq_(len(FETCHES), 1)
+    eq_(len(set(id(metadata) for metadata in results)), 1)
+
+
+@with_setup(setup_fake, teardown_fake)
+def test_build_locks_released():
+    import gc
+    from dmsa import registry
+
+    for i in range(10):
+        get_metadata('test', '{0}.0.0'.format(i), SERVICE)
+    gc.collect()
+
+    eq_(len(getattr(registry, '__BUILD_LOCKS')), 0)
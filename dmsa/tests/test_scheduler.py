@@ -0,0 +1,93 @@
+import threading
+import time
+from nose.tools import eq_, ok_
+from dmsa.scheduler import Scheduler
+
+
+class Task(object):
+
+    def __init__(self, failures=0):
+        self.calls = 0
+        self.failures = failures
+        self.threads = set()
+
+    def __call__(self):
+        self.calls += 1
+        self.threads.add(threading.current_thread().ident)
+        if self.calls <= self.failures:
+            raise IOError('service unavailable')
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_periodic():
+    task = Task()
+    scheduler = Scheduler(task, interval=0.05)
+    scheduler.start()
+    try:
+        ok_(wait_for(lambda: task.calls >= 3))
+    finally:
+        scheduler.stop()
+    eq_(len(task.threads), 1)
+    status = scheduler.status()
+    ok_(status['last_success'])
+    eq_(status['last_failure'], None)
+    eq_(status['failures'], 0)
+
+
+def test_trigger():
+    task = Task()
+    scheduler = Scheduler(task)
+    scheduler.start()
+    try:
+        time.sleep(0.1)
+        eq_(task.calls, 0)
+        for i in range(10):
+            scheduler.trigger(0.05)
+        ok_(wait_for(lambda: task.calls == 1))
+        time.sleep(0.1)
+        eq_(task.calls, 1)
+        eq_(scheduler.status()['next_run'], None)
+    finally:
+        scheduler.stop()
+
+
+def test_backoff():
+    task = Task(failures=2)
+    scheduler = Scheduler(task, interval=60, jitter=0, min_backoff=0.05)
+    scheduler.start(delay=0)
+    try:
+        ok_(wait_for(lambda: scheduler.status()['failures'] == 2))
+        status = scheduler.status()
+        ok_(status['last_failure'])
+        eq_(status['last_error'], 'IOError: service unavailable')
+        eq_(status['last_success'], None)
+        # The second retry waits twice as long as the first.
+        ok_(status['next_run'] - status['last_failure'] >= 0.1 - 1e-6)
+        ok_(wait_for(lambda: scheduler.status()['last_success']))
+        eq_(scheduler.status()['failures'], 0)
+        eq_(task.calls, 3)
+    finally:
+        scheduler.stop()
+
+
+def test_run():
+    task = Task(failures=1)
+    scheduler = Scheduler(task, interval=60, jitter=0, min_backoff=30)
+    try:
+        scheduler.run()
+    except IOError:
+        pass
+    else:
+        ok_(False, 'IOError not raised')
+    status = scheduler.status()
+    eq_(status['failures'], 1)
+    ok_(status['next_run'] - status['last_failure'] >= 30 - 1e-6)
+    scheduler.run()
+    ok_(scheduler.status()['last_success'])
+    eq_(scheduler.status()['failures'], 0)
@@ -1,5 +1,6 @@
 import os
-from nose.tools import eq_
+import time
+from nose.tools import eq_, ok_
 from dmsa import service
 from dmsa.utility import get_template_models
 
@@ -49,11 +50,17 @@ def check_endpoint(endpoint):
         except ImportError:
             eq_(r.status_code, 500)
         else:
-            eq_(r.status_code, 302)
+            # 302 if the ERD was already rendered, 202 if it was queued.
+            ok_(r.status_code in (202, 302))
             # Set endpoint to redirect location stripped of hostname and
-            # retest.
+            # retest until the queued render finishes.
             endpoint = r.location[r.location.find('/', 8):]
             r = test_app.get(endpoint)
+            for i in range(300):
+                if r.status_code != 202:
+                    break
+                time.sleep(0.1)
+                r = test_app.get(endpoint)
             eq_(r.status_code, 200)
     else:
         eq_(r.status_code, 200)
@@ -0,0 +1,113 @@
+import gzip
+import io
+import os
+import shutil
+import tempfile
+from nose.tools import eq_, ok_
+import dmsa.artifacts
+import dmsa.cache
+from dmsa import fileservice, jobs, service
+from dmsa.registry import invalidate_metadata
+from dmsa.tests.test_make_model import model_json
+
+# These tests serve the web service routes from a local data models service
+# directory (see dmsa.fileservice), so they run without the network.
+
+TEMP_DIR = None
+test_app = None
+
+DDL = '/test/1.0.0/ddl/postgresql/'
+
+
+def setup():
+    global TEMP_DIR, test_app
+    TEMP_DIR = tempfile.mkdtemp()
+    service_dir = os.path.join(TEMP_DIR, 'service')
+    fileservice.write_model(service_dir, 'test', '1.0.0', model_json)
+    fileservice.write_model(service_dir, 'test', '2.0.0', model_json)
+
+    # Keep the catalog and artifacts of other services out of the way.
+    dmsa.cache.set_cache_dir(os.path.join(TEMP_DIR, 'cache'))
+    dmsa.artifacts.clear_artifacts()
+    invalidate_metadata()
+
+    app = service.build_app(fileservice.service_url(service_dir),
+                            refresh_interval=None)
+    app.config['TESTING'] = True
+    test_app = app.test_client()
+
+
+def teardown():
+    jobs.shutdown()
+    dmsa.cache.set_cache_dir(service.app.instance_path)
+    dmsa.artifacts.clear_artifacts()
+    invalidate_metadata()
+    shutil.rmtree(TEMP_DIR)
+
+
+def test_endpoints():
+    for endpoint in ['/', '/test/', '/test/1.0.0/', DDL,
+                     '/test/1.0.0/ddl/sqlite/tables/',
+                     '/test/2.0.0/drop/sqlite/',
+                     '/test/2.0.0/delete/mysql/',
+                     '/test/1.0.0/nologging/oracle/indexes/']:
+        r = test_app.get(endpoint)
+        eq_(r.status_code, 200, endpoint)
+
+
+def test_not_modified():
+    r = test_app.get(DDL)
+    eq_(r.status_code, 200)
+    ok_(r.headers['ETag'])
+    ok_(r.headers['Cache-Control'].startswith('public'))
+    r = test_app.get(DDL, headers={'If-None-Match': r.headers['ETag']})
+    eq_(r.status_code, 304)
+    eq_(r.data, '')
+
+
+def test_gzip():
+    ddl = test_app.get(DDL).data
+    for encoding in dmsa.artifacts.encodings():
+        r = test_app.get(DDL, headers={'Accept-Encoding': encoding})
+        eq_(r.status_code, 200)
+        eq_(r.headers['Content-Encoding'], encoding)
+        ok_('Accept-Encoding' in r.headers['Vary'])
+        if encoding == 'gzip':
+            eq_(gzip.GzipFile(fileobj=io.BytesIO(r.data)).read(), ddl)
+
+
+def test_metrics():
+    test_app.get(DDL)
+    r = test_app.get('/metrics')
+    eq_(r.status_code, 200)
+    ok_('dmsa_requests_total{' in r.data)
+    ok_('dmsa_cache_hits_total{' in r.data)
+
+
+def test_not_found():
+    for endpoint in ['/test/1.0.0/ddl/sqlite/junk/',
+                     '/test/1.0.0/ddl/nodialect/',
+                     '/test/3.0.0/ddl/sqlite/',
+                     '/nope/1.0.0/drop/sqlite/']:
+        r = test_app.get(endpoint)
+        eq_(r.status_code, 404, endpoint)
+
+
+def test_compile_error():
+    # The model's constraints are unnamed, so they cannot be dropped: the
+    # error is an error response, not a truncated script.
+    service.app.config['PROPAGATE_EXCEPTIONS'] = False
+    try:
+        r = test_app.get('/test/1.0.0/drop/postgresql/')
+    finally:
+        service.app.config['PROPAGATE_EXCEPTIONS'] = None
+    eq_(r.status_code, 500)
+    ok_('ETag' not in r.headers)
+
+
+def test_erd_not_found():
+    eq_(test_app.get('/nope/1.0.0/erd/').status_code, 404)
+    eq_(test_app.get('/test/3.0.0/erd/').status_code, 404)
+    eq_(test_app.get('/test/1.0.0/erd/?format=exe').status_code, 400)
+    eq_(test_app.get('/test/1.0.0/erd/test.exe').status_code, 404)
+    eq_(test_app.get('/nope/1.0.0/erd/test.png').status_code, 404)
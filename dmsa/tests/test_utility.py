@@ -0,0 +1,168 @@
+import shutil
+import tempfile
+import time
+import requests
+from nose.tools import eq_, ok_, with_setup
+import dmsa.cache
+import dmsa.utility
+from dmsa.utility import (get_model_json, configure_session, get_session,
+                          JitteredRetry, SERVICE_TIMEOUT)
+
+SERVICE = 'http://dms.example.org/'
+MODEL_JSON = {'tables': [], 'schema': {'constraints': {}, 'indexes': []}}
+
+TEMP_DIR = None
+REAL_GET_SESSION = dmsa.utility.get_session
+
+
+class FakeResponse(object):
+
+    def __init__(self, status_code, json=None, headers=None):
+        self.status_code = status_code
+        self._json = json
+        self.headers = headers or {}
+
+    def json(self):
+        if self._json is None:
+            raise ValueError('No JSON object could be decoded')
+        return self._json
+
+
+class FakeSession(object):
+    """Stand-in for the shared requests session that records request headers
+    and timeouts and replays canned responses"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.headers = []
+        self.timeouts = []
+
+    def get(self, url, headers=None, timeout=None):
+        self.headers.append(headers or {})
+        self.timeouts.append(timeout)
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+def setup_dir():
+    global TEMP_DIR
+    TEMP_DIR = tempfile.mkdtemp()
+    dmsa.cache.set_cache_dir(TEMP_DIR)
+
+
+def teardown_dir():
+    dmsa.utility.get_session = REAL_GET_SESSION
+    dmsa.cache.set_cache_dir(None)
+    shutil.rmtree(TEMP_DIR)
+
+
+@with_setup(setup_dir, teardown_dir)
+def test_model_json_not_modified():
+    session = FakeSession(
+        FakeResponse(200, MODEL_JSON, {'ETag': '"abc"',
+                                       'Last-Modified': 'Mon, 01 Jan 2018'}),
+        FakeResponse(304))
+    dmsa.utility.get_session = lambda: session
+
+    eq_(get_model_json('omop', '5.0.0', SERVICE), MODEL_JSON)
+    eq_(get_model_json('omop', '5.0.0', SERVICE), MODEL_JSON)
+
+    eq_(session.headers[0], {})
+    eq_(session.headers[1], {'If-None-Match': '"abc"',
+                             'If-Modified-Since': 'Mon, 01 Jan 2018'})
+
+
+@with_setup(setup_dir, teardown_dir)
+def test_model_json_modified():
+    new_json = dict(MODEL_JSON, tables=[{'name': 'person'}])
+    session = FakeSession(FakeResponse(200, MODEL_JSON, {'ETag': '"abc"'}),
+                          FakeResponse(200, new_json, {'ETag': '"def"'}),
+                          FakeResponse(304))
+    dmsa.utility.get_session = lambda: session
+
+    get_model_json('omop', '5.0.0', SERVICE)
+    eq_(get_model_json('omop', '5.0.0', SERVICE), new_json)
+    eq_(get_model_json('omop', '5.0.0', SERVICE), new_json)
+    eq_(session.headers[2], {'If-None-Match': '"def"'})
+
+
+@with_setup(setup_dir, teardown_dir)
+def test_model_json_unreachable():
+    session = FakeSession(FakeResponse(200, MODEL_JSON, {'ETag': '"abc"'}),
+                          requests.ConnectionError('unreachable'))
+    dmsa.utility.get_session = lambda: session
+
+    get_model_json('omop', '5.0.0', SERVICE)
+    eq_(get_model_json('omop', '5.0.0', SERVICE), MODEL_JSON)
+
+
+@with_setup(setup_dir, teardown_dir)
+def test_model_json_server_error():
+    session = FakeSession(FakeResponse(200, MODEL_JSON, {'ETag': '"abc"'}),
+                          FakeResponse(503, {'error': 'unavailable'}))
+    dmsa.utility.get_session = lambda: session
+
+    get_model_json('omop', '5.0.0', SERVICE)
+    eq_(get_model_json('omop', '5.0.0', SERVICE), MODEL_JSON)
+
+
+@with_setup(setup_dir, teardown_dir)
+def test_timeout():
+    session = FakeSession(FakeResponse(200, MODEL_JSON))
+    dmsa.utility.get_session = lambda: session
+
+    configure_session(timeout=2.5)
+    try:
+        get_model_json('omop', '5.0.0', SERVICE)
+    finally:
+        configure_session(timeout=SERVICE_TIMEOUT)
+    eq_(session.timeouts, [2.5])
+
+
+def test_session():
+    configure_session(pool_size=4, retries=2)
+    try:
+        session = get_session()
+        ok_(session is get_session())
+        adapter = session.get_adapter(SERVICE)
+        eq_(adapter._pool_maxsize, 4)
+        ok_(isinstance(adapter.max_retries, JitteredRetry))
+        eq_(adapter.max_retries.total, 2)
+    finally:
+        configure_session(pool_size=dmsa.utility.SERVICE_POOL_SIZE,
+                          retries=dmsa.utility.SERVICE_RETRIES)
+
+
+def test_jittered_backoff():
+    retry = JitteredRetry(total=5, backoff_factor=1)
+    for i in range(3):
+        retry = retry.increment(method='GET', url='/')
+    for i in range(20):
+        backoff = retry.get_backoff_time()
+        ok_(0 <= backoff <= 4)
+
+
+def test_fetch_model_jsons():
+    versions = ['1.0.0', '2.0.0', '3.0.0', '4.0.0', '5.0.0', 'missing']
+
+    def slow_get_model_json(model, model_version, service):
+        time.sleep(0.2)
+        if model_version == 'missing':
+            raise requests.ConnectionError('not found')
+        return {'model': model, 'version': model_version}
+
+    real_get_model_json = dmsa.utility.get_model_json
+    dmsa.utility.get_model_json = slow_get_model_json
+
+    try:
+        start = time.time()
+        model_jsons = dmsa.utility.fetch_model_jsons(SERVICE, [
+            {'name': 'omop', 'versions': [{'name': v} for v in versions]}])
+        ok_(time.time() - start < 0.2 * len(versions) / 2)
+    finally:
+        dmsa.utility.get_model_json = real_get_model_json
+
+    eq_(sorted(model_jsons), [('omop', v) for v in versions[:-1]])
+    eq_(model_jsons[('omop', '2.0.0')]['version'], '2.0.0')
@@ -0,0 +1,131 @@
+from collections import Counter
+from nose.tools import eq_, ok_, with_setup
+import dmsa.artifacts
+import dmsa.ddl
+import dmsa.registry
+import dmsa.utility
+from dmsa import warm
+from dmsa.artifacts import artifact_key, get_artifact, set_artifact
+
+SERVICE = 'http://dms.example.org/'
+SERVICE_VERSION = '1.2.3'
+MODELS = [
+    {'name': 'omop', 'versions': [{'name': '5.0.0'}, {'name': '4.0.0'}]},
+    {'name': 'pedsnet', 'versions': [{'name': '2.0.0'}]}
+]
+VARIANTS = [('postgresql', 'ddl', 'all'), ('oracle', 'drop', 'tables')]
+
+REAL = {}
+BUILT = []
+
+
+def fake_get_model_json(model, model_version, service):
+    if model == 'broken':
+        raise ValueError('broken model')
+    return {'model': model, 'version': model_version}
+
+
+def fake_get_metadata(model, model_version, service, model_json=None):
+    # The model JSON is retrieved before the model is built.
+    eq_(model_json, fake_get_model_json(model, model_version, service))
+    BUILT.append((model, model_version))
+
+
+def fake_generate(model, model_version, dialect, service, **kwargs):
+    return '-- {0} {1} {2} {3}'.format(model, model_version, dialect,
+                                       sorted(k for k, v in kwargs.items()
+                                              if v))
+
+
+def setup_warm():
+    REAL.update(get_metadata=dmsa.registry.get_metadata,
+                generate=dmsa.ddl.generate,
+                get_model_json=dmsa.utility.get_model_json,
+                get_service_version=dmsa.utility.get_service_version)
+    dmsa.registry.get_metadata = fake_get_metadata
+    dmsa.utility.get_model_json = fake_get_model_json
+    dmsa.ddl.generate = fake_generate
+    dmsa.utility.get_service_version = lambda service: SERVICE_VERSION
+    dmsa.artifacts.clear_artifacts()
+    del BUILT[:]
+    warm.configure(2)
+
+
+def teardown_warm():
+    warm.configure(warm.WARM_WORKERS)
+    dmsa.registry.get_metadata = REAL['get_metadata']
+    dmsa.utility.get_model_json = REAL['get_model_json']
+    dmsa.ddl.generate = REAL['generate']
+    dmsa.utility.get_service_version = REAL['get_service_version']
+    dmsa.artifacts.clear_artifacts()
+
+
+def reset_requests():
+    # Forget the requests counted by other tests (e.g. of the web service).
+    setattr(warm, '__REQUESTS', Counter())
+
+
+@with_setup(reset_requests, reset_requests)
+def test_popular_variants():
+    default = [('postgresql', 'ddl', 'all'), ('oracle', 'ddl', 'all')]
+    for i in range(3):
+        warm.record_request('mysql', 'drop', 'all')
+    warm.record_request('sqlite', 'ddl', 'tables')
+    eq_(warm.popular_variants(default, n=3),
+        [('mysql', 'drop', 'all'), ('sqlite', 'ddl', 'tables'),
+         ('postgresql', 'ddl', 'all')])
+    eq_(warm.popular_variants(default, n=1), [('mysql', 'drop', 'all')])
+
+
+@with_setup(setup_warm, teardown_warm)
+def test_warm_jobs():
+    set_artifact(artifact_key('omop', '5.0.0', 'postgresql', 'ddl', 'all',
+                              SERVICE_VERSION), '-- cached')
+    set_artifact(artifact_key('omop', '5.0.0', 'oracle', 'drop', 'tables',
+                              SERVICE_VERSION), '-- cached')
+    set_artifact(artifact_key('omop', '4.0.0', 'oracle', 'drop', 'tables',
+                              SERVICE_VERSION), '-- cached')
+    jobs = warm.warm_jobs(MODELS, VARIANTS, SERVICE, SERVICE_VERSION)
+    eq_(jobs, [
+        ('omop', '4.0.0', [VARIANTS[0]], SERVICE, SERVICE_VERSION),
+        ('pedsnet', '2.0.0', VARIANTS, SERVICE, SERVICE_VERSION)
+    ])
+
+
+@with_setup(setup_warm, teardown_warm)
+def test_start():
+    ok_(warm.start(SERVICE, MODELS, VARIANTS))
+    ok_(warm.wait(5))
+    eq_(sorted(BUILT), [('omop', '4.0.0'), ('omop', '5.0.0'),
+                        ('pedsnet', '2.0.0')])
+    eq_(get_artifact(artifact_key('pedsnet', '2.0.0', 'oracle', 'drop',
+                                  'tables', SERVICE_VERSION)),
+        fake_generate('pedsnet', '2.0.0', 'oracle', SERVICE,
+                      **dmsa.ddl.operation_kwargs('drop', 'tables')))
+
+    # Everything is cached, so nothing is built again.
+    del BUILT[:]
+    ok_(warm.start(SERVICE, MODELS, VARIANTS))
+    ok_(warm.wait(5))
+    eq_(BUILT, [])
+
+
+@with_setup(setup_warm, teardown_warm)
+def test_errors():
+    stats = warm.stats()
+    models = [{'name': 'broken', 'versions': [{'name': '1.0.0'}]}] + MODELS
+    ok_(warm.start(SERVICE, models, VARIANTS))
+    ok_(warm.wait(5))
+    eq_(warm.stats()['errors'], stats['errors'] + 1)
+    eq_(warm.stats()['warmed'], stats['warmed'] + 6)
+
+
+def test_disabled():
+    ok_(not warm.start(SERVICE, MODELS, VARIANTS))
+
+
+def test_record_request_bounded():
+    for i in range(warm.MAX_VARIANTS + 1):
+        warm.record_request('sqlite', 'ddl', str(i))
+    ok_(len(warm.popular_variants([], n=2 * warm.MAX_VARIANTS)) <=
+        warm.MAX_VARIANTS)
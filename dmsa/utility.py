@@ -1,8 +1,15 @@
+import logging
+import random
+import threading
 import requests
 from functools import wraps
-from flask import make_response
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from dmsa import __version__
-from dmsa.cache import (get_cache, set_cache)
+from dmsa.cache import get_cache, set_cache, get_entry, set_entry
+from dmsa.fileservice import FileAdapter
+from dmsa.metrics import Counter, Histogram
+from dmsa.phases import phase
 
 PRETTY_MODELS = {
     'i2b2': 'i2b2',
@@ -27,11 +34,189 @@ RELEASE_COLORS = {
 }
 
 
+SERVICE_POOL_SIZE = 10
+SERVICE_TIMEOUT = (5, 30)  # seconds (connect, read)
+SERVICE_RETRIES = 3
+SERVICE_BACKOFF_FACTOR = 0.5  # seconds
+
+__SESSION = None
+__SESSION_LOCK = threading.Lock()
+__POOL = None
+__SESSION_CONFIG = {
+    'pool_size': SERVICE_POOL_SIZE,
+    'timeout': SERVICE_TIMEOUT,
+    'retries': SERVICE_RETRIES,
+    'backoff_factor': SERVICE_BACKOFF_FACTOR
+}
+
+
+class JitteredRetry(Retry):
+    """A urllib3 Retry policy that randomizes ("full jitter") the exponential
+    backoff between attempts, so that workers retrying together spread out
+    instead of hitting the service in lockstep."""
+
+    def get_backoff_time(self):
+        return random.uniform(0, super(JitteredRetry, self).get_backoff_time())
+
+
+def configure_session(pool_size=None, timeout=None, retries=None,
+                      backoff_factor=None):
+    """Configure the shared session used for data models service requests.
+
+    Arguments left as None keep their current values. The session (and the
+    pool of threads asynchronous requests are made in) is rebuilt on next
+    use.
+
+    Arguments:
+        pool_size - number of keep-alive connections to hold per host
+        timeout - seconds to wait for the service, either a single number or
+            a (connect, read) tuple
+        retries - number of times to retry failed connections, reads and
+            502/503/504 responses
+        backoff_factor - base of the exponential backoff between retries
+    """
+    global __SESSION, __POOL
+
+    with __SESSION_LOCK:
+        for name, value in [('pool_size', pool_size), ('timeout', timeout),
+                            ('retries', retries),
+                            ('backoff_factor', backoff_factor)]:
+            if value is not None:
+                __SESSION_CONFIG[name] = value
+        __SESSION = None
+        if __POOL is not None and pool_size is not None:
+            # Requests already queued still run in the old pool.
+            __POOL.close()
+            __POOL = None
+
+
+def get_session():
+    """Return the shared, connection-pooling session for service requests."""
+    global __SESSION
+
+    with __SESSION_LOCK:
+        if __SESSION is None:
+            retry = JitteredRetry(
+                total=__SESSION_CONFIG['retries'],
+                backoff_factor=__SESSION_CONFIG['backoff_factor'],
+                status_forcelist=(502, 503, 504),
+                raise_on_status=False)
+            adapter = HTTPAdapter(
+                pool_connections=__SESSION_CONFIG['pool_size'],
+                pool_maxsize=__SESSION_CONFIG['pool_size'],
+                max_retries=retry)
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.mount('file://', FileAdapter())
+            __SESSION = session
+        return __SESSION
+
+
+def get_pool():
+    """Return the shared pool of threads that asynchronous service requests
+    (and model builds) run in
+
+    The pool has as many threads as the session holds connections, so any
+    number of asynchronous requests can be queued without opening more
+    connections to the service or starting a thread per request.
+    """
+    global __POOL
+
+    from multiprocessing.pool import ThreadPool
+
+    with __SESSION_LOCK:
+        if __POOL is None:
+            __POOL = ThreadPool(__SESSION_CONFIG['pool_size'])
+        return __POOL
+
+
+UPSTREAM_SECONDS = Histogram(
+    'dmsa_upstream_request_seconds',
+    'Time spent in requests to the data models service.',
+    labels=('operation',))
+UPSTREAM_ERRORS = Counter(
+    'dmsa_upstream_errors_total',
+    'Requests to the data models service that failed or returned an error.',
+    labels=('operation',))
+
+
+def service_get(url, headers=None, operation='other'):
+    """GET the url using the shared session and the configured timeout.
+
+    The request's duration and failure, if any, are recorded in the upstream
+    metrics under the operation label.
+    """
+    try:
+        with UPSTREAM_SECONDS.time(operation=operation):
+            r = get_session().get(url, headers=headers,
+                                  timeout=__SESSION_CONFIG['timeout'])
+    except Exception:
+        UPSTREAM_ERRORS.inc(operation=operation)
+        raise
+
+    if r.status_code >= 400:
+        UPSTREAM_ERRORS.inc(operation=operation)
+
+    return r
+
+
 def get_model_json(model, model_version, service):
-    """Retrieve model JSON for the model and version from the service."""
-    r = requests.get(''.join([service, 'schemata/', model, '/', model_version,
-                              '?format=json']))
-    return r.json()
+    """Retrieve model JSON for the model and version from the service.
+
+    The JSON is cached on disk (in the 'model_json' cache namespace) along
+    with the `ETag` and `Last-Modified` response headers, which are used to
+    revalidate it with a conditional request. The cached copy is used if the
+    service answers 304 Not Modified, cannot be reached or still answers
+    with a server error after retrying.
+
+    JSON from a `file://` service is read directly and not cached.
+    """
+    url = ''.join([service, 'schemata/', model, '/', model_version,
+                   '?format=json'])
+    local = url.startswith('file://')
+    cached = None if local else get_entry('model_json', url)
+
+    headers = {}
+    if cached:
+        if cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        if cached.get('last_modified'):
+            headers['If-Modified-Since'] = cached['last_modified']
+
+    try:
+        with phase('fetch model JSON'):
+            r = service_get(url, headers=headers,
+                            operation='get_model_json')
+    except (requests.ConnectionError, requests.Timeout) as e:
+        if not cached:
+            raise
+        logging.warning('using cached {0} {1} model JSON: {2}'.format(
+            model, model_version, e))
+        return cached['model']
+
+    if r.status_code == 304 and cached:
+        return cached['model']
+
+    if r.status_code >= 500 and cached:
+        logging.warning('using cached {0} {1} model JSON: HTTP {2}'.format(
+            model, model_version, r.status_code))
+        return cached['model']
+
+    with phase('decode model JSON'):
+        model_json = r.json()
+
+    if r.status_code == 200 and not local:
+        try:
+            set_entry('model_json', url, {
+                'etag': r.headers.get('ETag'),
+                'last_modified': r.headers.get('Last-Modified'),
+                'model': model_json
+            })
+        except (IOError, OSError):
+            pass  # Already logged; the JSON is still usable.
+
+    return model_json
 
 
 def get_service_version(service):
@@ -47,11 +232,67 @@ def get_service_version(service):
 
 def get_models_json(service):
     """Get the models/versions from the service along with service version."""
-    r = requests.get(service + 'models?format=json')
+    r = service_get(service + 'models?format=json',
+                    operation='get_models_json')
     service_version = r.headers['User-Agent'].split(' ')[0].split('/')[1]
     return r.json(), service_version
 
 
+def aget_model_json(model, model_version, service, callback=None):
+    """Retrieve model JSON like `get_model_json`, but in the shared pool of
+    threads (see get_pool)
+
+    Returns: a multiprocessing AsyncResult whose `get()` returns the model
+    JSON or raises the retrieval's exception; `callback`, if given, is
+    called with the model JSON when it is retrieved.
+    """
+    return get_pool().apply_async(get_model_json,
+                                  (model, model_version, service),
+                                  callback=callback)
+
+
+def aget_models_json(service, callback=None):
+    """Get the models/versions and service version like `get_models_json`,
+    but in the shared pool of threads; returns an AsyncResult as
+    `aget_model_json` does"""
+    return get_pool().apply_async(get_models_json, (service,),
+                                  callback=callback)
+
+
+def fetch_model_jsons(service, models=None):
+    """Retrieve the model JSON of many model versions concurrently
+
+    Every model version is requested at once in the shared pool of threads
+    (see get_pool), so retrieving a whole catalog takes about as long as
+    the slowest request rather than the sum of them. Each retrieval is
+    cached on disk as by `get_model_json`.
+
+    Arguments:
+        models - template models, as returned by get_template_models, or
+            None for every model in the service's catalog
+
+    Return: dict of model JSON by (model, version); model versions that
+        could not be retrieved are logged and left out
+    """
+    if models is None:
+        models = get_template_models(service)
+
+    results = [((m['name'], v['name']),
+                aget_model_json(m['name'], v['name'], service))
+               for m in models for v in m['versions']]
+
+    model_jsons = {}
+
+    for (model, model_version), result in results:
+        try:
+            model_jsons[(model, model_version)] = result.get()
+        except Exception:
+            logging.exception('retrieving {0} {1} model JSON'.format(
+                model, model_version))
+
+    return model_jsons
+
+
 def get_template_models(service, force_refresh=False):
     """ Get the template models from the cache or service.
 
@@ -111,6 +352,8 @@ def get_template_dialects():
 
 def add_response_headers(headers={}):
     """This decorator adds the headers passed in to the response"""
+    from flask import make_response
+
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
@@ -132,6 +375,25 @@ def dmsa_version(f):
          format(__version__)})(f)
 
 
+def cache_control(max_age):
+    """This decorator lets clients and proxies cache successful (200 and 304)
+    responses for max_age seconds, and tells them not to cache others"""
+    from flask import make_response
+
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            resp = make_response(f(*args, **kwargs))
+            if resp.status_code in (200, 304):
+                resp.headers['Cache-Control'] = \
+                    'public, max-age={0}'.format(max_age)
+            else:
+                resp.headers['Cache-Control'] = 'no-cache'
+            return resp
+        return decorated_function
+    return decorator
+
+
 class ReverseProxied(object):
     """Wrap the application in this middleware and configure the
     front-end server to add these headers, to let you quietly bind
@@ -0,0 +1,249 @@
+""" Pre-warming of the model registry and generated DDL cache
+
+After the web service refreshes the data models catalog, the first request
+for each model version would otherwise pay for building the model and
+generating its DDL. Warming builds the MetaData and generates the most
+requested DDL variants (dialect, operation and elements) of every model
+version in the catalog ahead of those requests, in a bounded pool of
+background threads. Variants that are already cached are skipped, so only
+new model versions (or all of them, after the data models service's version
+changes) are generated. Artifact keys do not include the model JSON, so a
+model version whose content changes while the service version stays the
+same keeps its cached DDL until the service version (or dmsa's) changes.
+
+The threads share the web process's model registry and artifact cache, so
+warmed models and scripts are served directly from memory.
+
+Setting the number of workers to 0 disables warming.
+"""
+import logging
+import threading
+import time
+from collections import Counter
+from multiprocessing.pool import ThreadPool
+
+WARM_WORKERS = 0
+WARM_VARIANTS = 4
+MAX_VARIANTS = 256
+
+__POOL = None
+__WORKERS = WARM_WORKERS
+__LOCK = threading.Lock()
+__RUNNING = False
+__QUEUED = None
+__REQUESTS = Counter()
+__STATS = {'runs': 0, 'warmed': 0, 'errors': 0}
+
+
+def configure(workers):
+    """Set the number of warming threads (0 to disable warming)
+
+    Changing the number of workers waits for the current warm-up to finish.
+    """
+    global __WORKERS, __POOL
+
+    old_pool = None
+
+    with __LOCK:
+        if workers != __WORKERS:
+            __WORKERS = workers
+            old_pool, __POOL = __POOL, None
+
+    if old_pool is not None:
+        old_pool.close()
+        old_pool.join()
+
+
+def record_request(dialect, operation, elements):
+    """Count a request for a DDL variant, to rank variants by popularity
+
+    At most MAX_VARIANTS variants are counted: beyond that, the less
+    requested half is forgotten.
+    """
+    global __REQUESTS
+
+    with __LOCK:
+        __REQUESTS[(dialect, operation, elements)] += 1
+        if len(__REQUESTS) > MAX_VARIANTS:
+            __REQUESTS = Counter(dict(
+                __REQUESTS.most_common(MAX_VARIANTS // 2)))
+
+
+def popular_variants(default, n=WARM_VARIANTS):
+    """Return the n most requested (dialect, operation, elements) variants
+
+    Arguments:
+        default - variants to fill the list with, in order, until enough
+            requests have been counted
+        n - number of variants to return
+    """
+    with __LOCK:
+        variants = [v for v, count in __REQUESTS.most_common(n)]
+
+    for variant in default:
+        if len(variants) >= n:
+            break
+        if variant not in variants:
+            variants.append(variant)
+
+    return variants
+
+
+def warm_jobs(models, variants, service, service_version):
+    """Return a (model, version, variants, service, service_version) job for
+    every model version with variants that are not cached
+
+    Arguments:
+        models - template models, as returned by get_template_models
+        variants - (dialect, operation, elements) tuples to generate
+    """
+    from dmsa.artifacts import artifact_key, has_artifact
+
+    jobs = []
+
+    for m in models:
+        for v in m['versions']:
+            missing = [(dialect, operation, elements)
+                       for dialect, operation, elements in variants
+                       if not has_artifact(artifact_key(
+                           m['name'], v['name'], dialect, operation,
+                           elements, service_version))]
+            if missing:
+                jobs.append((m['name'], v['name'], missing, service,
+                             service_version))
+
+    return jobs
+
+
+def _warm(job, model_jsons):
+    """Build the model and generate the variants; run in worker threads
+
+    Return: (number of variants generated, number of errors)
+    """
+    from dmsa import ddl
+    from dmsa.artifacts import artifact_key, set_artifact
+    from dmsa.registry import get_metadata
+
+    model, model_version, variants, service, service_version = job
+    warmed = errors = 0
+
+    try:
+        get_metadata(model, model_version, service,
+                     model_jsons.get((model, model_version)))
+    except Exception:
+        logging.exception('warming {0} {1}'.format(model, model_version))
+        return 0, 1
+
+    for dialect, operation, elements in variants:
+        try:
+            ddl_str = ddl.generate(model, model_version, dialect,
+                                   service=service,
+                                   **ddl.operation_kwargs(operation,
+                                                          elements))
+        except Exception:
+            logging.exception('warming {0} {1} {2} {3} {4}'.format(
+                model, model_version, dialect, operation, elements))
+            errors += 1
+            continue
+        set_artifact(artifact_key(model, model_version, dialect, operation,
+                                  elements, service_version), ddl_str)
+        warmed += 1
+
+    return warmed, errors
+
+
+def _finished(results):
+    global __RUNNING, __QUEUED
+
+    with __LOCK:
+        __STATS['runs'] += 1
+        for warmed, errors in results:
+            __STATS['warmed'] += warmed
+            __STATS['errors'] += errors
+        __RUNNING = False
+        queued, __QUEUED = __QUEUED, None
+
+    if queued:
+        start(*queued)
+
+
+def start(service, models, variants):
+    """Warm the caches for the models in the background
+
+    If a warm-up is already running, another one is started once it
+    finishes, so that warm-ups never overlap.
+
+    Arguments:
+        service - base URL of the data models service
+        models - template models, as returned by get_template_models
+        variants - (dialect, operation, elements) tuples to generate
+
+    Return: False if warming is disabled, otherwise True
+    """
+    global __RUNNING, __QUEUED, __POOL
+
+    from dmsa.utility import get_service_version, fetch_model_jsons
+
+    with __LOCK:
+        if __WORKERS < 1:
+            return False
+        if __RUNNING:
+            __QUEUED = (service, models, variants)
+            return True
+        __RUNNING = True
+
+    try:
+        jobs = warm_jobs(models, variants, service,
+                         get_service_version(service))
+
+        with __LOCK:
+            if __POOL is None:
+                __POOL = ThreadPool(__WORKERS)
+            pool = __POOL
+
+        # Generate the biggest backlog first: model versions missing the
+        # most variants.
+        jobs.sort(key=lambda job: -len(job[2]))
+
+        # Retrieve the model JSON of every job at once, instead of one by
+        # one as the workers build the models.
+        model_jsons = fetch_model_jsons(service, [
+            {'name': job[0], 'versions': [{'name': job[1]}]}
+            for job in jobs])
+
+        if jobs:
+            pool.map_async(lambda job: _warm(job, model_jsons), jobs,
+                           chunksize=1, callback=_finished)
+        else:
+            _finished([])
+
+    except Exception:
+        # Warming is an optimization; the caches are filled on demand.
+        logging.exception('starting warm-up')
+        with __LOCK:
+            __RUNNING = False
+
+    return True
+
+
+def wait(timeout=None):
+    """Wait for the current warm-up (if any) to finish
+
+    Return: True if no warm-up is running
+    """
+    deadline = timeout and time.time() + timeout
+
+    while True:
+        with __LOCK:
+            if not __RUNNING:
+                return True
+        if deadline and time.time() > deadline:
+            return False
+        time.sleep(0.05)
+
+
+def stats():
+    """Return a dict with the number of warm-up runs, variants generated and
+    errors, and whether a warm-up is running"""
+    with __LOCK:
+        return dict(__STATS, running=__RUNNING, workers=__WORKERS)